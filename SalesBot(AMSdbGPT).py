@@ -1,593 +1,667 @@
 import pandas as pd
 import streamlit as st
-from sqlalchemy import create_engine, inspect
 import os
-from dotenv import load_dotenv
-import plotly.express as px
-import google.generativeai as genai
 import time
-from io import BytesIO
-import urllib.parse
-import re
 import datetime
-import html
-from schema_manager import get_llm_explanation
+import math
+import uuid
+from sales_engine import SalesEngine, Conversation, database_engine_from_env, GOVERN_QUERIES, USE_ROLLUPS, SUGGESTION_TIMEOUT_SECONDS
+from sql_generation import generate_sql
+from batch_runner import BatchRun, read_questions, build_workbook, summary_frame
+import background_tasks
+from chart_pipeline import prepare_chart_data
+from query_governor import format_plan_summary
+from tracing import DEFAULT_TRACE_PATH, read_spans, recent_requests, slowest_spans, stage_percentiles
+from result_export import ExportManager, DEFAULT_EXPORT_DIR, EXPORT_FORMATS, read_file
 
 st._config.set_option("theme.base", "dark")
-load_dotenv("Secrets.env")
-uid = os.getenv("DB_UID") # Your DB UID
-pwd = os.getenv("DB_PWD") # Your DB PWD
 st.set_page_config("YourAppName", layout="wide", page_icon="🤖") # Your App Name
 
 st.markdown("""
-    <style>
-        .stApp, body {
-            background-color: #0E1C26 !important;
-        }
-        .main-title {
-            color: #00E3FF !important; text-align: center; font-size: 40px; font-weight: 900;
-            text-shadow: 2px 2px #032B3E !important;
-        }
-        .subtext {
-            color: #FFD700 !important; text-align: center; font-size: 16px;
-        }
-        .stChatMessage {
-            background-color: #1a2a3a !important; border-radius: 10px !important; border: 1px solid #1a2a3a !important;
-        }
-        .stChatMessage * {
-            color: #FFFFFF !important;
-        }
-        .stButton button {
-            background-color: #1a2a3a !important; color: #FFFFFF !important; border: 1px solid #00E3FF !important;
-        }
-        .stTextInput [data-baseweb="input"] {
-            background-color: #1a2a3a !important; color: #FFFFFF !important;
-        }
-        .styled-scrollbox {
-            direction: rtl;
-            display: flex;
-            justify-content: flex-end;
-            scrollbar-width: auto; 
-            scrollbar-color: #00E3FF #1a2a3a;
-        }
-        .styled-scrollbox > table {
-            direction: ltr;
-        }
-        .styled-scrollbox::-webkit-scrollbar {
-          width: 12px;
-          height: 12px;
-        }
-        .styled-scrollbox::-webkit-scrollbar-track {
-          background: #1a2a3a;
-          border-radius: 10px;
-        }
-        .styled-scrollbox::-webkit-scrollbar-thumb {
-          background-color: #00E3FF;
-          border-radius: 10px;
-          border: 3px solid #1a2a3a;
-        }
-        .styled-scrollbox::-webkit-scrollbar-thumb:hover {
-          background-color: #FFD700;
-        }
-        details > summary {
-            background-color: #1a2a3a;
-            color: #FFFFFF;
-            border: 1px solid #00E3FF;
-            border-radius: 5px;
-            padding: 5px 10px;
-            cursor: pointer;
-            display: inline-block;
-            margin-top: 10px;
-            font-weight: bold;
-        }
-        details > summary::marker {
-            color: #FFD700;
-        }
-        details[open] > summary {
-            background-color: #032B3E;
-        }
-    </style>
+    <style>
+        .stApp, body {
+            background-color: #0E1C26 !important;
+        }
+        .main-title {
+            color: #00E3FF !important; text-align: center; font-size: 40px; font-weight: 900;
+            text-shadow: 2px 2px #032B3E !important;
+        }
+        .subtext {
+            color: #FFD700 !important; text-align: center; font-size: 16px;
+        }
+        .stChatMessage {
+            background-color: #1a2a3a !important; border-radius: 10px !important; border: 1px solid #1a2a3a !important;
+        }
+        .stChatMessage * {
+            color: #FFFFFF !important;
+        }
+        .stButton button {
+            background-color: #1a2a3a !important; color: #FFFFFF !important; border: 1px solid #00E3FF !important;
+        }
+        .stTextInput [data-baseweb="input"] {
+            background-color: #1a2a3a !important; color: #FFFFFF !important;
+        }
+        .styled-scrollbox {
+            direction: rtl;
+            display: flex;
+            justify-content: flex-end;
+            scrollbar-width: auto; 
+            scrollbar-color: #00E3FF #1a2a3a;
+        }
+        .styled-scrollbox > table {
+            direction: ltr;
+        }
+        .styled-scrollbox::-webkit-scrollbar {
+          width: 12px;
+          height: 12px;
+        }
+        .styled-scrollbox::-webkit-scrollbar-track {
+          background: #1a2a3a;
+          border-radius: 10px;
+        }
+        .styled-scrollbox::-webkit-scrollbar-thumb {
+          background-color: #00E3FF;
+          border-radius: 10px;
+          border: 3px solid #1a2a3a;
+        }
+        .styled-scrollbox::-webkit-scrollbar-thumb:hover {
+          background-color: #FFD700;
+        }
+        details > summary {
+            background-color: #1a2a3a;
+            color: #FFFFFF;
+            border: 1px solid #00E3FF;
+            border-radius: 5px;
+            padding: 5px 10px;
+            cursor: pointer;
+            display: inline-block;
+            margin-top: 10px;
+            font-weight: bold;
+        }
+        details > summary::marker {
+            color: #FFD700;
+        }
+        details[open] > summary {
+            background-color: #032B3E;
+        }
+    </style>
 """, unsafe_allow_html=True)
 
-genai.configure(api_key=os.getenv("GOOGLE_API")) # Your Google API Key
+@st.cache_resource
+def get_sales_engine():
+    # One engine for the whole process (pool, caches, query queue, result store); the script body reruns on every interaction.
+    # The pipeline itself lives in sales_engine.py, which api_server.py serves over HTTP as well.
+    return SalesEngine(database_engine_from_env())
 
 try:
-    params = urllib.parse.quote_plus(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=Connection_String;" # Your DB Connection String
-        "DATABASE=Database;" # Your Database Name
-        f"UID={uid};"
-        f"PWD={pwd}"
-    )
-    _engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+    engine = get_sales_engine()
 except Exception as e:
-    st.error(f"DB connection failed: {e}")
-    st.stop()
+    st.error(f"DB connection failed: {e}")
+    st.stop()
+
+TABLE_PAGE_SIZE = int(os.getenv("TABLE_PAGE_SIZE", "100"))
+EXPANDED_RESULTS = int(os.getenv("EXPANDED_RESULTS", "2")) # Older result tables collapse to a one-line summary
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "5000")) # Above this many rows charts are aggregated/downsampled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # Open the app with ?admin=<token> to see the performance panel
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000")) # Rows per chunk written by exports
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "5000000")) # Ceiling for "full result" exports that re-read the database
+EXPORT_TIMEOUT_SECONDS = float(os.getenv("EXPORT_TIMEOUT_SECONDS", "900")) # Statement timeout for those re-reads
+
+@st.cache_resource
+def get_export_manager():
+    return ExportManager(os.getenv("EXPORT_DIR", DEFAULT_EXPORT_DIR), max_workers=int(os.getenv("EXPORT_WORKERS", "2")), ttl=float(os.getenv("EXPORT_TTL_MINUTES", "60")) * 60)
+
+def current_result_df():
+    # Session state only holds a handle; the frame lives in the result store (memory or Arrow file).
+    handle = conversation.result_handle
+    return engine.result_store.get(handle) if handle else None
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def build_chart(result_key, chart_type, x_col, y_col, color_col, _df):
+    # Keyed on the result handle and chart settings, so toggling the chart or revisiting a selection reuses the figure.
+    import plotly.express as px # Only paid for once somebody opens the chart generator
+    plot_df, notes, use_webgl = prepare_chart_data(_df, chart_type, x_col, y_col, color_col, max_points=CHART_MAX_POINTS)
+    render_mode = "webgl" if use_webgl else "auto"
+    binned = "points" in plot_df.columns and "points" not in _df.columns
+    if chart_type == "Bar": fig = px.bar(plot_df, x=x_col, y=y_col, color=color_col)
+    elif chart_type == "Line": fig = px.line(plot_df, x=x_col, y=y_col, color=color_col, render_mode=render_mode)
+    elif chart_type == "Pie": fig = px.pie(plot_df, names=x_col, values=y_col)
+    elif chart_type == "Scatter": fig = px.scatter(plot_df, x=x_col, y=y_col, color="points" if binned else color_col, render_mode=render_mode)
+    elif chart_type == "Area": fig = px.area(plot_df, x=x_col, y=y_col, color=color_col)
+    elif chart_type == "Box": fig = px.box(plot_df, x=x_col, y=y_col, color=color_col)
+    fig.update_layout(template="plotly_dark")
+    return fig, notes
 
 def initialize_session_state():
-    defaults = {
-        'result_df': None, 'question': "", 'ready_to_run': False,
-        'show_chart': False, 'chat_messages': [], 'show_batch_upload': False,
-        'batch_results': [], 'awaiting_clarification': False, 'clarification_details': {},
-        'sql_generated': False, 'sql_query': None, 'llm_explanation': None,
-        'follow_up_suggestions': [],
-        'generating_suggestions': False
-    }
-    for key, default_value in defaults.items():
-        if key not in st.session_state:
-            st.session_state[key] = default_value
+    # The conversation (messages, Gemini chat, trace, result handle) is engine state; the rest drives the rerun phases.
+    defaults = {
+        'conversation': None, 'ready_to_run': False,
+        'show_chart': False, 'show_batch_upload': False,
+        'batch_results': [],
+        'sql_generated': False, 'sql_query': None, 'llm_explanation': None,
+        'follow_up_suggestions': [],
+        'generating_suggestions': False, 'bypass_result_cache': False,
+        'query_job': None, 'batch_run': None, 'batch_workbook': None,
+        'suggestions_future': None, 'plan_review': None, 'plan_approved_sql': None
+    }
+    for key, default_value in defaults.items():
+        if key not in st.session_state:
+            st.session_state[key] = default_value
+    if st.session_state.conversation is None:
+        st.session_state.conversation = Conversation()
 
 def reset_chat_state():
-    initialize_session_state()
-    st.session_state.chat_messages = []
-    st.session_state.question = ""
-    st.session_state.result_df = None
-    st.session_state.show_chart = False
-    st.session_state.show_batch_upload = False
-    st.session_state.batch_results = []
-    st.session_state.follow_up_suggestions = []
-    st.session_state.generating_suggestions = False
-    if 'system_prompt' in st.session_state:
-        del st.session_state['system_prompt']
-    initialize_system_prompt()
-
-@st.cache_data
-def get_database_schema(_engine):
-    inspector = inspect(_engine)
-    schema = {}
-    schemas_to_include = ['your_schema_name'] # Your DB schema names
-    for idx, current_schema_name in enumerate(schemas_to_include):
-        for table_name in inspector.get_table_names(schema=current_schema_name):
-            full_table_name = f"{current_schema_name}.{table_name}"
-            try:
-                schema[full_table_name] = [col['name'] for col in inspector.get_columns(table_name, schema=current_schema_name)]
-            except Exception as e:
-                print(f"Could not retrieve columns for {full_table_name}: {e}")
-        if idx < len(schemas_to_include) - 1:
-            schema[f"--- GAP ({current_schema_name} done) ---"] = []
-    return schema
-
-def show_left_aligned_table(df, rows_before_scroll: int = 10):
-    if df is None: return
-    styler = (df.style.format(precision=2).set_table_styles([
-        {"selector": "th", "props": [("text-align", "left !important"), ("white-space", "nowrap"), ("border", "1px solid black"), ("background-color", "#0E1C26"), ("color", "white"), ("position", "sticky"), ("top", "0"), ("z-index", "1")]},
-        {"selector": "td", "props": [("text-align", "left !important"), ("white-space", "nowrap"), ("border", "1px solid black"), ("background-color", "#0E1C26"), ("color", "white")]},
-        {"selector": "table", "props": [("border-collapse", "collapse"), ("border", "1px solid black")]}],
-        overwrite=False).set_properties(**{"text-align": "left", "white-space": "nowrap", "border": "1px solid black", "background-color": "#0E1C26", "color": "white"}))
-    html_table = styler.to_html()
-    row_h, header_h = 32, 38
-    max_height_px = header_h + rows_before_scroll * row_h
-    if len(df) > rows_before_scroll:
-        html_render = f'<div class="styled-scrollbox" style="max-height:{max_height_px}px; overflow-y:auto; overflow-x:auto; border:1px solid #1a2a3a; margin-bottom:0.75rem;">{html_table}</div>'
-    else:
-        html_render = html_table
-    st.markdown(html_render, unsafe_allow_html=True)
-
-@st.cache_resource
-def format_schema_for_prompt(schema: dict, one_big_llm_hint: str = "") -> str:
-    formatted = []
-    for table, cols in sorted(schema.items()):
-        base = table.split('.')[-1]
-        alias = ''.join([w[0] for w in base.split('_') if w]).lower()
-        formatted.append(f"Table: {table} (alias: {alias})")
-        formatted.append(f"    Columns: ({', '.join(f'`{c}`' for c in cols)})")
-    if one_big_llm_hint:
-        formatted.append("\n### 🧠 LLM Schema Summary:\n")
-        formatted.append(one_big_llm_hint)
-    return "\n".join(formatted)
-
-def validate_question(question):
-    detected_issues = []
-    question_padded = f" {question.lower()} "
-    known_terms = {
-        "volume": ["Sold Quantity", "Cancelled Quantity", "Quantity"], # Placeholder columns
-        "date": ["OrderDate", "DispatchDate", "DeliveryDate", "CancelDate", "CreatedDate"], # Placeholder columns
-        "price": ["UnitPrice", "NetPrice", "PriceAfterDiscount"], # Placeholder columns
-        "top product": ["Highest TotalNetAmount", "Highest Quantity"], # Placeholder columns
-    }
-    for term, options in known_terms.items():
-        if f" {term.strip()} " in question_padded:
-            detected_issues.append({'type': 'ambiguity', 'term': term.strip(), 'options': options})
-            return detected_issues
-
-    time_spec_found = False
-    if "year"or"last" in question_padded:
-        time_spec_found = True
-    if not time_spec_found:
-        potential_years = re.findall(r'\b\d{4}\b', question)
-        if potential_years:
-            current_year = datetime.datetime.now().year
-            for year_str in potential_years:
-                year = int(year_str)
-                if 2019 < year <= current_year + 1: # Placeholder year range
-                    time_spec_found = True
-                    break
-    if not time_spec_found:
-        detected_issues.append({'type': 'year', 'message': "No time period specified. Please specify the 'YEAR' or 'FY' (e.g., 2025)."})
-    return detected_issues
-
-def generate_sql_with_context(new_question, current_chat_messages):
-    gemini_history = []
-    for msg in current_chat_messages:
-        if msg["role"] in ["user", "assistant"]:
-            role = "model" if msg["role"] == "assistant" else "user"
-            gemini_history.append({"role": role, "parts": [msg["content"].split("\n\n<details>")[0]]})
-    try:
-        model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=st.session_state.get("system_prompt", ""), generation_config=genai.types.GenerationConfig(temperature=0.2, top_p=0.93, top_k=40))
-        chat = model.start_chat(history=gemini_history)
-        response = chat.send_message(new_question)
-        assistant_reply = response.text
-    except Exception as e:
-        return None, None, f"Gemini failed: {e}"
-    sql, explanation = None, assistant_reply
-    if "```sql" in assistant_reply:
-        parts = assistant_reply.split("```sql")
-        explanation = parts[0].strip()
-        sql = parts[1].split("```")[0].strip()
-    elif assistant_reply.lower().startswith("select"):
-        sql = assistant_reply.strip()
-    return explanation, sql, None
-
-def execute_sql(sql):
-    try:
-        return pd.read_sql(sql, _engine), None
-    except Exception as e:
-        return None, f"Query failed: {e}"
-
-def generate_follow_up_questions(original_question, sql_query, df_columns):
-    """Generates contextual follow-up questions using a cost-effective LLM."""
-    prompt = f"""
-    Based on the user's last question and the data columns from the result, suggest 3 insightful and relevant follow-up questions a data analyst might ask next.
-    The goal is to explore the data further, such as breaking it down by another dimension, comparing time periods, or focusing on top/bottom performers.
-
-    PREVIOUS QUESTION: "{original_question}"
-    GENERATED SQL QUERY: "{sql_query}"
-    RESULTING DATA COLUMNS: {', '.join(df_columns)}
-
-    Return ONLY a Python-style list of 3 short, clear question strings.
-    Example: ["Can you break this down by sales channel?", "How does this compare to the previous year?", "What are the top 5 products in this category?"]
-    """
-    try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(temperature=0.7))
-        suggestions = re.findall(r'"(.*?)"', response.text)
-        return suggestions[:3] 
-    except Exception as e:
-        st.warning(f"Could not generate follow-up questions: {e}")
-        return []
+    initialize_session_state()
+    old_conversation = st.session_state.conversation
+    engine.reset(old_conversation)
+    get_export_manager().drop_session(old_conversation.id)
+    st.session_state.conversation = Conversation(compact_results=old_conversation.compact_results)
+    st.session_state.show_chart = False
+    st.session_state.show_batch_upload = False
+    st.session_state.batch_results = []
+    if st.session_state.batch_run is not None:
+        st.session_state.batch_run.cancel()
+        st.session_state.batch_run = None
+    st.session_state.follow_up_suggestions = []
+    st.session_state.generating_suggestions = False
+    background_tasks.discard(st.session_state.suggestions_future)
+    st.session_state.suggestions_future = None
+    st.session_state.plan_review = None
+    st.session_state.plan_approved_sql = None
+    if st.session_state.query_job is not None:
+        st.session_state.query_job.cancel()
+        st.session_state.query_job = None
+
+def style_table_html(df):
+    styler = (df.style.format(precision=2).set_table_styles([
+        {"selector": "th", "props": [("text-align", "left !important"), ("white-space", "nowrap"), ("border", "1px solid black"), ("background-color", "#0E1C26"), ("color", "white"), ("position", "sticky"), ("top", "0"), ("z-index", "1")]},
+        {"selector": "td", "props": [("text-align", "left !important"), ("white-space", "nowrap"), ("border", "1px solid black"), ("background-color", "#0E1C26"), ("color", "white")]},
+        {"selector": "table", "props": [("border-collapse", "collapse"), ("border", "1px solid black")]}],
+        overwrite=False).set_properties(**{"text-align": "left", "white-space": "nowrap", "border": "1px solid black", "background-color": "#0E1C26", "color": "white"}))
+    return styler.to_html()
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def render_table_page(result_id, page, page_size, _df):
+    # Only the visible window is styled; result_id changes whenever the message's frame does.
+    return style_table_html(_df.iloc[page * page_size:(page + 1) * page_size])
+
+def show_left_aligned_table(df, rows_before_scroll: int = 10, result_id=None):
+    if df is None: return
+    page_count = max(1, math.ceil(len(df) / TABLE_PAGE_SIZE))
+    page = min(st.session_state.get(f"table_page_{result_id}", 0), page_count - 1) if result_id else 0
+    if result_id:
+        html_table = render_table_page(result_id, page, TABLE_PAGE_SIZE, df)
+    else:
+        html_table = style_table_html(df.head(TABLE_PAGE_SIZE))
+    visible_rows = min(TABLE_PAGE_SIZE, len(df) - page * TABLE_PAGE_SIZE)
+    row_h, header_h = 32, 38
+    max_height_px = header_h + rows_before_scroll * row_h
+    if visible_rows > rows_before_scroll:
+        html_render = f'<div class="styled-scrollbox" style="max-height:{max_height_px}px; overflow-y:auto; overflow-x:auto; border:1px solid #1a2a3a; margin-bottom:0.75rem;">{html_table}</div>'
+    else:
+        html_render = html_table
+    st.markdown(html_render, unsafe_allow_html=True)
+    if result_id and page_count > 1:
+        prev_col, info_col, next_col = st.columns([1, 6, 1])
+        if prev_col.button("◀", key=f"prev_page_{result_id}", disabled=page == 0, use_container_width=True):
+            st.session_state[f"table_page_{result_id}"] = page - 1
+            st.rerun()
+        info_col.caption(f"Rows {page * TABLE_PAGE_SIZE + 1:,}–{page * TABLE_PAGE_SIZE + visible_rows:,} of {len(df):,} · page {page + 1} of {page_count}")
+        if next_col.button("▶", key=f"next_page_{result_id}", disabled=page >= page_count - 1, use_container_width=True):
+            st.session_state[f"table_page_{result_id}"] = page + 1
+            st.rerun()
+
+def summarize_result(info):
+    columns = ", ".join(info["columns"][:5]) + (", …" if len(info["columns"]) > 5 else "")
+    return f"📊 {info['rows']:,} rows × {len(info['columns'])} columns ({columns})"
+
+def execute_sql_streaming(sql, use_cache=True):
+    """Runs the query on a background job, rendering the first chunk as soon as it arrives.
+
+    The job lives in session state so that a click on Cancel (which reruns the script) finds
+    and aborts the statement that is still running."""
+    if use_cache:
+        cached_df = engine.cached_result(conversation, sql)
+        if cached_df is not None:
+            return cached_df, None
+    job = st.session_state.query_job
+    if job is None or job.sql != sql:
+        job = engine.submit_query(conversation, sql, use_cache)
+        st.session_state.query_job = job
+    if st.button("⛔ Cancel query", key="cancel_query"):
+        job.cancel()
+    progress, preview = st.empty(), st.empty()
+    preview_shown = False
+    while not job.wait(0.2):
+        if job.status == "queued":
+            progress.caption(f"⏳ Waiting for a database slot... position {job.queue_position} in the queue · {job.elapsed:.1f}s")
+            continue
+        progress.caption(f"⚙️ Executing Query... {job.rows:,} rows received · {job.elapsed:.1f}s")
+        if not preview_shown and job.chunks:
+            with preview.container():
+                show_left_aligned_table(job.preview())
+            preview_shown = True
+    progress.empty()
+    preview.empty()
+    st.session_state.query_job = None
+    return engine.finish_query(conversation, job)
+
+def abandon_pending_query():
+    engine.finish_trace(conversation, "not_run")
+    background_tasks.discard(st.session_state.suggestions_future)
+    st.session_state.suggestions_future = None
+    st.session_state.sql_generated = False
+    st.session_state.sql_query = None
+    st.session_state.llm_explanation = None
+    conversation.question = ""
+
+def query_plan_allows(sql):
+    """Pre-flight check on the estimated plan. False when the query was blocked or awaits confirmation."""
+    if not GOVERN_QUERIES:
+        return True
+    if st.session_state.plan_approved_sql == sql:
+        st.session_state.plan_approved_sql = None
+        return True
+    with st.spinner("🔍 Checking the query plan..."):
+        plan = engine.check_plan(conversation, sql)
+    if plan["verdict"] == "allow":
+        return True
+    if plan["verdict"] == "confirm":
+        st.session_state.plan_review = plan
+        return False
+    engine.block_query(conversation, plan, sql)
+    abandon_pending_query()
+    return False
+
+def collect_follow_up_suggestions(timeout=None):
+    # No future means a simple question: the engine builds suggestions from the result's columns.
+    future = st.session_state.suggestions_future
+    st.session_state.suggestions_future = None
+    if future is not None and future.cancelled():
+        return []
+    try:
+        return engine.collect_follow_ups(conversation, future, timeout)
+    except Exception as e:
+        st.warning(f"Could not generate follow-up questions: {e}")
+        return []
+
+def start_export(message, export_format, full_export):
+    """Queues an export of a result message; a full export streams the SQL again without the row cap,
+    after the governor check and under EXPORT_TIMEOUT_SECONDS."""
+    extension = EXPORT_FORMATS[export_format][0]
+    if full_export:
+        sql, user = message["sql"], conversation.user
+        chunks_fn = lambda: engine.export_chunks(sql, user, EXPORT_CHUNK_ROWS, EXPORT_MAX_ROWS, EXPORT_TIMEOUT_SECONDS)
+    else:
+        result_store, handle = engine.result_store, message["handle"]
+        chunks_fn = lambda: result_store.iter_chunks(handle, EXPORT_CHUNK_ROWS)
+    return get_export_manager().submit(conversation.id, export_format, extension, chunks_fn, title=message.get("question"))
+
+@st.fragment(run_every=2)
+def show_exports():
+    # Re-renders on its own while exports run, without rerunning the whole script.
+    export_manager = get_export_manager()
+    for job in export_manager.jobs(conversation.id):
+        if job.status == "running":
+            st.caption(f"⏳ {job.file_name}: {job.rows:,} rows written")
+        elif job.status == "done":
+            note = " (cut at Excel's row limit)" if job.truncated else ""
+            st.download_button(f"⬇️ {job.file_name} · {job.rows:,} rows · {job.bytes / 1024 ** 2:.1f} MB{note}", data=lambda path=job.path: read_file(path),
+                               file_name=job.file_name, mime=next(mime for ext, mime in EXPORT_FORMATS.values() if ext == job.extension),
+                               key=f"download_{job.id}", on_click="ignore", use_container_width=True)
+        else:
+            st.caption(f"❌ {job.file_name}: {job.error}")
+            if st.button("Dismiss", key=f"dismiss_{job.id}"):
+                export_manager.remove(job)
+                st.rerun(scope="fragment")
+
+def answer_from_rollup(routed):
+    """Shows a rollup answer like a query result (see SalesEngine.answer_from_rollup)."""
+    st.session_state.suggestions_future = engine.answer_from_rollup(conversation, routed)
+    st.session_state.sql_query = routed["sql"]
+    st.session_state.llm_explanation = routed["explanation"]
+    st.session_state.ready_to_run = False
+    st.session_state.generating_suggestions = True
 
 def initialize_system_prompt():
-    if 'system_prompt' in st.session_state: return
-    schema = get_database_schema(_engine)
-    if not schema:
-        st.error("Could not load schema from database.")
-        st.stop()
-    big_llm_hint = get_llm_explanation(schema) # Your LLM explanation (schema_manager.py)
-    formatted_schema_with_explanation = format_schema_for_prompt(schema, one_big_llm_hint=big_llm_hint)
-    system_prompt_string = f"""
-You are an expert-level T-SQL Architect. Your sole function is to generate a single, optimized, and syntactically correct ,simple T-SQL query for SQL Server based on the user's request and the rules below.
-You will follow this four-step internal process:
-- Deconstruct Request: Silently analyze the user's goal to identify all required metrics, dimensions, and filters.
-- Apply Logic: Methodically apply all relevant business logic, error handling, and metric formulas.
-- Generate Query: Construct the T-SQL query, strictly adhering to all syntax, performance, and naming conventions.
-- Format Output: Present the final response using the precise markdown structure specified in Part 4.
----
-Part 1: Database Schema Reference:
-{formatted_schema_with_explanation}
----
-Part 2: Core Directives & Rules
-You must follow these rules without exception.
-
-A. T-SQL Syntax, Naming & Performance
-
-- Always Round off to 2 decimal places.
-- Global Naming Convention: All table and column references must be prefixed with `your_schema.` (e.g., `your_schema.YourTable.YourColumn`, `alias.YourColumn`).
-- Engine & Compatibility: Generate T-SQL for SQL Server only. Do not use functions from other SQL dialects (e.g., `DATE_TRUNC`, `STRING_AGG`, `LPAD`).
-- CTEs (Common Table Expressions): Always begin the query with a CTE. Precede the first `WITH` clause with a semicolon (;). Remove any unused CTEs from the final query.
-- Joins: Default to using `LEFT JOIN`. Use `INNER JOIN` only for relationships that are mandatory and non-nullable. Do not use `FULL OUTER JOIN`.
-- Table Hints: Apply `WITH (NOLOCK)` to every table, view, or CTE in all `FROM` and `JOIN` clauses.
-- Pagination: For TOP N queries, use `TOP (N)` or `OFFSET ... FETCH`. Do not use `LIMIT`.
-- Aliasing: Use short, intuitive table aliases (e.g., `so` for `your_schema.Sales_SalesOrder`). Every column reference must be prefixed with the correct alias (e.g., `so.OrderID`). Do not use periods in aliases themselves.
-
-B. Error Handling & Type Safety
-- Once a table is given an alias(short), Never use schema name again (e.g., use so.OrderID, not your_schema.so.OrderID).
-- Safe Casting: Use `TRY_CAST` or `TRY_CONVERT` instead of `CAST` to prevent type conversion errors.
-- Safe Division: To prevent divide-by-zero errors, always wrap the denominator with `NULLIF(expression, 0)`.
-- Safe Aggregation: To prevent integer overflow in large sums, use `SUM(TRY_CAST(expression AS BIGINT))`.
-- Date Handling: Do not cast directly from `INT` to `DATE`. Use appropriate conversion logic.
-- Ensure all columns are referenced with the correct table aliases and joins.
-- Identify where implicit or explicit conversion between string (VARCHAR) and integer is happening.
-- Fix the query by ensuring correct data type handling without changing the logic.
-- TOP N WITH TIES clause is not allowed without a corresponding ORDER BY clause
-- Revise the SQL to eliminate the 'Conversion failed when converting the nvarchar value ''TV'' to data type int' error: do not cast alphanumeric NVARCHARs to INT; instead align datatypes (cast the INT side to NVARCHAR or use TRY_CONVERT for numeric-only rows)
-- Only prepend 'your_schema. or any other alias' if the table name is not already schema-qualified (doesn't contain a period).
-- Correct any syntax errors related to the NOLOCK hint in the SELECT statement.
-- Use proper date functions (YEAR(), FORMAT()) instead of string manipulation for filtering and grouping to ensure reliable and readable SQL.
-
-C. Standard Business Logic & Filters (Apply to ALL Queries)
-
-- Only show top 1000 results.
-- Always display the total values by default for the question asked.
-- Default Date Range: `[YourDateColumn] >= 'YYYY-MM-DD'` # Your default date filter
-- When date is specified use full range for that day (eg. so.OrderDate >= 'Date' and so.OrderDate < 'Date+1).
-- Exclude Cancelled Orders: `[YourStatusIDColumn] NOT IN (17, 20, 21) AND [YourCancelDateColumn] IS NULL` # Your specific filters
-- Exclude Returned Items: `ISNULL([YourItemStatusID], 0) NOT IN (20)` # Your specific filters
-- Include Valid Products: `[YourProductIDColumn] > 0` # Your specific filters
-- Fiscal Year Logic: A fiscal year (e.g., 'FY2024') runs from April 1st to March 31st. Translate this to `[YourDateColumn] >= 'YYYY-MM-DD' AND [YourDateColumn] < 'YYYY-MM-DD'`.
-- Specific Column Mapping:
-- Target (only use these) = 'your_schema.Sales_SaleTargets.Sales', Mobile Target = 'your_schema.Sales_MobileTargets.Sales',[Always use Daily/Hourly filtering  (e.g. 'your_schema.Sales_SaleTargets.Type' = 'Daily')],[When asked monthly target 'SUM 'Daily' sales for that month'.], Dont use TargetDate use Date. Use 
-    
-    - Always use `your_schema.Sales_SalesOrderlines.SalesChannelID` for `SalesChannelID`. # Your specific column mapping
-    - Always use `your_schema.Auction_TVAuctionPrice.TargetPrice` for `TargetPrice`. # Your specific column mapping
-    - Quantity = "your_schema.Sales_SalesOrderlines.QTY" # Your specific column mapping
-    - TotalNetAmount = "your_schema.Sales_SalesOrderlines.TotalNetAmt" # Your specific column mapping
-    - ProductID = "your_schema.Sales_SalesOrderlines.ProductID" # Your specific column mapping
-    - Discount = "your_schema.Discount_Discounts" # Your specific column mapping
-    - Source/Channel = "your_schema.Sales_MstSalesChannels" # Your specific column mapping
-    
-D. Advanced Logic & Metric Formulas
-
-- Metric Formulas(If the user asks for any words, use ONLY its exact SQL expression listed below. Do NOT search for, infer, or replace with other columns or words)
-    *sol = your_schema.Sales_SalesOrderLines , BP = your_schema.System_MstBudgetPay # Your specific aliases and tables
-    
-    - DepartmentID : "your_schema.Sales_SalesOrders" # Your specific column mapping
-    - Mobile = "your_schema.System_MstDepartments.DepartmentID = 15" # Your specific filter
-    - Gross Sales: `SUM([YourColumn])` # Your formula
-    - Unique Customers: `COUNT(DISTINCT [YourCustomerID])` # Your formula
-    - Order Count: `COUNT(DISTINCT [YourOrderID])` # Your formula
-    - Margin: `[Your Margin Formula]` # Your specific formula
-    - Margin %: `[Your Margin % Formula]` # Your specific formula
-    - Margin Loss: `[Your Margin Loss Formula]` # Your specific formula
-    - AuctionDuration (in minutes): `[Your Auction Duration Formula]` # Your specific formula
-    - GCPM = `[Your GCPM Formula]` # Your specific formula
-    - PnP = `[Your PnP Formula]` # Your specific formula
-    - New Customers:`[Your New Customers Logic]` # Your specific logic
-    - Cash Sales: `[Your Cash Sales Formula]` # Your specific formula
-    - When asked for specific type of sales use 'your_schema.Sales_MstSalesChannels'(eg. Mobile FPC = 'your_schema.Sales_MstSalesChannels.Name like'%Mobile FPC%'). # Your specific logic
-- Top/Best-Selling Logic: When asked for top-selling products, order results descending by `SUM([YourQuantityColumn])`. # Your specific logic
-- Flexible Product search: If asked to find a specific product, search for the keyword across all relevant name and description columns using `LIKE '%keyword%'`.
-- When filtering for channels, do not use exact matches. Instead, use 'LIKE' with wildcards to include any name containing "TV" or "Web". [For example:(your_schema.Sales_MstSalesChannels.Name LIKE '%TV%' OR your_schema.Sales_MstSalesChannels.Name LIKE '%Web%')] # Your specific logic
-- Customer Acquisition Logic: To find a customer's first purchase, find the `MIN([YourOrderDate])` for each `[YourCustomerID]` after the `[YourCreatedDate]`. # Your specific logic
-- Only use Columns with Tables they exist in.
-- Weekly Performance Classification: If requested, classify week-over-week performance changes as 'Growth', 'Decline', 'Stable' using a `CASE` statement comparing the current week's metric to the 
-previous week's.
-- Mainly join using [YourJoiningColumn1],[YourJoiningColumn2]
----
-Part 3: Final Output Format
-You must present your final answer using the exact format below. Provide no other commentary or text outside this structure.
-T-SQL Query
--- Your generated T-SQL query goes here
-Explanation
-A 2-3 line summary explaining the query's objective, the logic used to fulfill the request, and any specific error-prevention techniques applied.
-Validation
--- This query checks for data existence based on the primary filters.
--- It should return a count > 0 if data is available.
-SELECT COUNT(*)
-FROM your_schema.Sales_SalesOrder AS so WITH (NOLOCK)
-WHERE /* Add the primary date or fiscal year filter from the main query here */;
-Validation Points:
-- Verify the final `SELECT` statement includes all columns and metrics requested.
-- Check that Gross Sales and Order Count are positive values.
-- Ensure Order Count is greater than or equal to Unique Customers.
-"""
-    st.session_state.system_prompt = system_prompt_string
-    if not st.session_state.chat_messages:
-        st.session_state.chat_messages = [{"role": "assistant", "content": "Hello, How can I help you?"}]
+    # Compiled once per schema fingerprint and rules version, then shared by every session (see system_prompt.py).
+    if engine.prompt() is None:
+        st.error("Could not load schema from database.")
+        st.stop()
 
 # --- Initialize App State and Prompt ---
 initialize_session_state()
 initialize_system_prompt()
+conversation = st.session_state.conversation
 
 # --- Main App UI ---
 st.markdown("<h1 class='main-title'>YourAppName</h1>", unsafe_allow_html=True) # Your App Name
 st.markdown("<div class='subtext'>Your AI-powered Sales Insights Assistant</div>", unsafe_allow_html=True)
 
 chat_container = st.container()
-with chat_container:
-    for message in st.session_state.chat_messages:
-        if message["role"] in ["user", "assistant"]:
-            with st.chat_message(message["role"], avatar="🤠" if message["role"] == "user" else "⚙️"):
-                st.markdown(message["content"], unsafe_allow_html=True)
-        elif message["role"] == "dataframe":
-            show_left_aligned_table(message["content"])
-
-    if st.session_state.get('awaiting_clarification'):
-        details = st.session_state.clarification_details
-        if details['type'] == 'year':
-            with st.chat_message("assistant", avatar="⚙️"):
-                st.markdown(details['message'])
+with chat_container, engine.tracer.span("render", conversation.trace_id, messages=len(conversation.messages)):
+    dataframe_indices = [i for i, m in enumerate(conversation.messages) if m["role"] == "dataframe"]
+    expanded_indices = set(dataframe_indices[-EXPANDED_RESULTS:]) if EXPANDED_RESULTS else set()
+    for msg_idx, message in enumerate(conversation.messages):
+        if message["role"] in ["user", "assistant"]:
+            with st.chat_message(message["role"], avatar="🤠" if message["role"] == "user" else "⚙️"):
+                st.markdown(message["content"], unsafe_allow_html=True)
+                if message.get("plan"):
+                    st.caption(format_plan_summary(message["plan"]))
+        elif message["role"] == "dataframe":
+            result_id = message.setdefault("result_id", uuid.uuid4().hex)
+            result_info = engine.result_store.info(message["handle"])
+            if result_info is None:
+                st.caption("📊 This result has expired. Ask the question again to re-run it.")
+                continue
+            if msg_idx not in expanded_indices and not st.toggle(summarize_result(result_info), key=f"expand_{result_id}"):
+                continue
+            result_df = engine.result_store.get(message["handle"])
+            if result_df is None:
+                continue
+            show_left_aligned_table(result_df, result_id=result_id)
+            with st.popover("⬇️ Export", key=f"export_menu_{result_id}"):
+                export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key=f"export_format_{result_id}")
+                full_export = bool(message.get("sql")) and result_df.attrs.get("partial_result") == "truncated" and st.checkbox(
+                    f"Full result from the database (not just the {len(result_df):,} rows shown)", key=f"export_full_{result_id}")
+                if st.button("Start export", key=f"export_{result_id}"):
+                    start_export(message, export_format, full_export)
+                    st.toast("Export started; the download appears in the sidebar when it is ready.")
+            if message.get("sql") and st.button("🔄 Refresh", key=f"refresh_{msg_idx}", help="Re-run this query against the database, bypassing the result cache"):
+                refreshed_df, refresh_error = engine.execute_sql(message["sql"], conversation.user, use_cache=False, compact=conversation.compact_results)
+                if refresh_error:
+                    st.error(refresh_error)
+                else:
+                    refreshed_handle = engine.result_store.put(conversation.id, refreshed_df)
+                    if conversation.result_handle == message["handle"]:
+                        conversation.result_handle = refreshed_handle
+                    message["handle"] = refreshed_handle
+                    message["result_id"] = uuid.uuid4().hex
+                    st.rerun()
+            if message.get("question"):
+                if message.get("verified"):
+                    st.caption("👍 Marked correct: this query is now a preferred example for similar questions.")
+                elif st.button("👍 Mark correct", key=f"verify_{msg_idx}", help="Keep this question and SQL as a verified example for similar questions"):
+                    engine.example_library.add(message["question"], message["sql"], verified=True)
+                    message["verified"] = True
+                    st.rerun()
+
+    if conversation.clarification and conversation.clarification['type'] == 'year':
+        with st.chat_message("assistant", avatar="⚙️"):
+            st.markdown(conversation.clarification['message'])
 
 # --- Display Follow-up Suggestion Buttons ---
 if st.session_state.get("follow_up_suggestions"):
-    st.markdown("🤔 **Suggested next questions:**")
-    num_suggestions = len(st.session_state.follow_up_suggestions)
-    cols = st.columns(num_suggestions)
-    for i, suggestion in enumerate(st.session_state.follow_up_suggestions):
-        with cols[i]:
-            if st.button(suggestion, key=f"suggestion_{i}", use_container_width=True):
-                st.session_state.question = suggestion
-                st.session_state.chat_messages.append({"role": "user", "content": suggestion})
-                st.session_state.ready_to_run = True
-                st.session_state.awaiting_clarification = False
-                st.session_state.follow_up_suggestions = [] 
-                st.session_state.result_df = None
-                st.rerun()
+    st.markdown("🤔 **Suggested next questions:**")
+    num_suggestions = len(st.session_state.follow_up_suggestions)
+    cols = st.columns(num_suggestions)
+    for i, suggestion in enumerate(st.session_state.follow_up_suggestions):
+        with cols[i]:
+            if st.button(suggestion, key=f"suggestion_{i}", use_container_width=True):
+                engine.take_message(conversation, suggestion, validate=False)
+                st.session_state.ready_to_run = True
+                st.session_state.follow_up_suggestions = []
+                conversation.result_handle = None
+                st.rerun()
 
 if st.session_state.get("show_batch_upload"):
-    st.subheader("📥 Batch Upload from Excel")
-    # Batch upload logic remains the same...
+    st.subheader("📥 Batch Upload from Excel")
+    uploaded_file = st.file_uploader("Questions sheet (one question per row, in a 'Question' column or the first column)", type=["xlsx", "csv"])
+    batch_run = st.session_state.batch_run
+    if uploaded_file is not None and (batch_run is None or batch_run.finished) and st.button("▶️ Run batch"):
+        batch_questions = read_questions(uploaded_file, uploaded_file.name)
+        sql_cache, governor = engine.sql_cache, engine.governor if GOVERN_QUERIES else None
+        batch_user, batch_compact = conversation.user, conversation.compact_results
+        prompt_hash = sql_cache.hash_prompt(engine.prompt()["system_prompt"])
+        # Prompts are pruned up front; workers only see plain strings. Each question stands alone, as in a new chat.
+        batch_prompts = {q: engine.build_question_prompt(Conversation(), q) for q in batch_questions}
+        batch_models = {q: engine.router.model(engine.route_question(Conversation(), q), batch_prompts[q]) for q in batch_questions}
+
+        def execute_governed(sql):
+            # Nobody is around to confirm in a batch, so only plans the governor blocks are refused.
+            plan = governor.check(sql) if governor else None
+            if plan and plan["verdict"] == "block":
+                sql_cache.discard(sql)
+                return None, "Blocked by the query cost governor: " + "; ".join(plan["reasons"])
+            df, error = engine.execute_sql(sql, batch_user, compact=batch_compact)
+            if error:
+                sql_cache.discard(sql)
+            else:
+                sql_cache.confirm(sql)
+            return df, error
+
+        batch_run = BatchRun(
+            batch_questions,
+            generate_fn=lambda q: generate_sql(q, batch_prompts[q], sql_cache=sql_cache, prompt_hash=prompt_hash, model=batch_models[q]),
+            execute_fn=execute_governed,
+            llm_workers=int(os.getenv("BATCH_LLM_WORKERS", "4")), db_workers=int(os.getenv("BATCH_DB_WORKERS", "2")),
+            llm_per_minute=float(os.getenv("BATCH_LLM_RPM", "60"))).start()
+        st.session_state.batch_run = batch_run
+        st.session_state.batch_results = batch_run.results
+        st.session_state.batch_workbook = None
+    if batch_run is not None:
+        batch_progress = batch_run.progress()
+        st.progress(batch_progress["finished"] / max(batch_progress["total"], 1), text=f"{batch_progress['finished']}/{batch_progress['total']} questions · {batch_progress['elapsed']:.0f}s · " + ", ".join(f"{status}: {count}" for status, count in batch_progress["counts"].items()))
+        st.dataframe(summary_frame(st.session_state.batch_results).drop(columns=["SQL"]), use_container_width=True, hide_index=True)
+        if not batch_run.finished:
+            if st.button("⛔ Cancel batch"):
+                batch_run.cancel()
+            time.sleep(1)
+            st.rerun()
+        else:
+            if st.session_state.batch_workbook is None:
+                st.session_state.batch_workbook = build_workbook(st.session_state.batch_results).getvalue()
+            st.download_button("⬇️ Download results (.xlsx)", data=st.session_state.batch_workbook, file_name=f"batch_results_{datetime.datetime.now():%Y%m%d_%H%M}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 if not st.session_state.get("show_batch_upload"):
-    if st.session_state.get('awaiting_clarification') and st.session_state.clarification_details.get('type') == 'ambiguity':
-        details = st.session_state.clarification_details
-        st.info(f"Ambiguity detected for **'{details['term']}'**:")
-        choice = st.selectbox(f"Select meaning for '{details['term']}':", details['options'], key=f"amb_{details['term']}")
-        if st.button("✅ Confirm Selection"):
-            st.session_state.question = st.session_state.question.replace(details['term'], choice)
-            st.session_state.awaiting_clarification = False
-            st.session_state.clarification_details = {}
-            issues = validate_question(st.session_state.question)
-            if issues:
-                st.session_state.clarification_details = issues[0]
-                st.session_state.awaiting_clarification = True
-            else:
-                st.session_state.ready_to_run = True
-            st.rerun()
-
-    user_input = st.chat_input("Ask a sales-related question...")
-
-    if user_input:
-        st.session_state.follow_up_suggestions = [] 
-        follow_up_phrases = ["for the same", "how about", "what about","also"]
-        if any(phrase in user_input.lower() for phrase in follow_up_phrases):
-            st.session_state.question = user_input
-            st.session_state.chat_messages.append({"role": "user", "content": user_input})
-            st.session_state.awaiting_clarification = False
-            st.session_state.ready_to_run = True
-
-        elif st.session_state.get('awaiting_clarification') and st.session_state.clarification_details.get('type') == 'year':
-            st.session_state.question = f"{st.session_state.question} {user_input}"
-            if st.session_state.chat_messages and st.session_state.chat_messages[-1]["role"] == "user":
-                st.session_state.chat_messages[-1]["content"] = st.session_state.question
-            st.session_state.awaiting_clarification = False
-            st.session_state.clarification_details = {}
-            issues = validate_question(st.session_state.question)
-            if issues:
-                st.session_state.clarification_details = issues[0]
-                st.session_state.awaiting_clarification = True
-            else:
-                st.session_state.ready_to_run = True
-        
-        else:
-            st.session_state.question = user_input
-            st.session_state.chat_messages.append({"role": "user", "content": user_input})
-            st.session_state.awaiting_clarification = False
-            st.session_state.clarification_details = {}
-            issues = validate_question(user_input)
-            if issues:
-                st.session_state.clarification_details = issues[0]
-                st.session_state.awaiting_clarification = True
-            else:
-                st.session_state.ready_to_run = True
-                
-        st.rerun()
-
-    if st.session_state.get('ready_to_run'):
-        q = st.session_state.question
-        with st.spinner("⚙️ Generating Query..."):
-            gen_explanation, sql_query, gen_error = generate_sql_with_context(q, st.session_state.chat_messages)
-        
-        if gen_error or not sql_query:
-            error_message = gen_error or (gen_explanation or "The model did not generate a SQL query.")
-            st.session_state.chat_messages.append({"role": "assistant", "content": f"❌ {error_message}"})
-            st.session_state.ready_to_run = False
-            st.session_state.question = ""
-        else:
-            st.session_state.sql_query = sql_query
-            st.session_state.llm_explanation = gen_explanation
-            escaped_sql = html.escape(sql_query)
-            sql_expander_html = f"""<div style="display: flex; justify-content: left; align-items: left;">
-<details>
-    <summary>View Generated SQL</summary>
-    <pre><code class="language-sql">{escaped_sql}</code></pre>
-</details>
-</div>"""
-            response_content = f"{gen_explanation}\n\n{sql_expander_html}"
-            st.session_state.chat_messages.append({"role": "assistant", "content": response_content})
-            st.session_state.ready_to_run = False
-            st.session_state.sql_generated = True
-        st.rerun()
-
-    # MODIFIED: Logic split into two parts for sequential display
-    elif st.session_state.get('sql_generated'):
-        with st.spinner("⚙️ Executing Query..."):
-            df_result, exec_error = execute_sql(st.session_state.sql_query)
-
-        exec_status_message = ""
-        if exec_error:
-            exec_status_message = f"❌ Query execution failed: {exec_error}"
-        elif df_result.empty:
-            exec_status_message = "✅ Query executed successfully, but returned no results."
-        else:
-            exec_status_message = "✅ Query executed successfully!"
-        
-        st.session_state.chat_messages.append({"role": "assistant", "content": exec_status_message})
-        st.session_state.result_df = df_result
-    
-        if df_result is not None and not df_result.empty:
-            st.session_state.chat_messages.append({"role": "dataframe", "content": df_result})
-            # Set flag to generate suggestions on the next rerun, AFTER results are shown
-            st.session_state.generating_suggestions = True
-        else:
-            # If no results, clear query state now as no suggestions will be generated
-            st.session_state.sql_query = None
-            st.session_state.llm_explanation = None
-            st.session_state.question = ""
-        
-        st.session_state.sql_generated = False # Prevent this block from re-running
-        st.rerun()
-
-    # NEW: This block runs AFTER the results are displayed to the user
-    elif st.session_state.get('generating_suggestions'):
-        with st.spinner("🤔 Thinking of next steps..."):
-            last_user_question = ""
-            for msg in reversed(st.session_state.chat_messages):
-                if msg["role"] == "user":
-                    last_user_question = msg["content"]
-                    break
-            
-            if last_user_question and st.session_state.result_df is not None:
-                st.session_state.follow_up_suggestions = generate_follow_up_questions(
-                    original_question=last_user_question,
-                    sql_query=st.session_state.sql_query,
-                    df_columns=st.session_state.result_df.columns.tolist()
-                )
-
-        # Clean up all temporary states after suggestions are generated
-        st.session_state.generating_suggestions = False
-        st.session_state.sql_query = None
-        st.session_state.llm_explanation = None
-        st.session_state.question = ""
-        st.rerun()
+    if conversation.clarification and conversation.clarification['type'] == 'ambiguity':
+        details = conversation.clarification
+        st.info(f"Ambiguity detected for **'{details['term']}'**:")
+        choice = st.selectbox(f"Select meaning for '{details['term']}':", details['options'], key=f"amb_{details['term']}")
+        if st.button("✅ Confirm Selection"):
+            st.session_state.ready_to_run = engine.resolve_ambiguity(conversation, choice) is None
+            st.rerun()
+
+    user_input = st.chat_input("Ask a sales-related question...")
+
+    if user_input:
+        st.session_state.follow_up_suggestions = []
+        # Follow-ups run as they are; a reply to the missing-year prompt completes the pending question (see SalesEngine.take_message).
+        st.session_state.ready_to_run = engine.take_message(conversation, user_input) is None
+        st.rerun()
+
+    if st.session_state.get('ready_to_run'):
+        q = conversation.question
+        if conversation.repair is None:  # a retry on the stronger model stays in the same trace
+            engine.start_trace(conversation)
+            routed = engine.route_rollup(conversation, q)
+            if routed is not None:
+                answer_from_rollup(routed)
+                st.rerun()
+        with st.spinner("⚙️ Generating Query..."):
+            streamed_text = st.chat_message("assistant", avatar="⚙️").empty()
+            gen_explanation, sql_query, gen_error = engine.generate_sql(conversation, q,
+                                                                        on_explanation=lambda text: streamed_text.markdown(f"{text} ▌") if text else None)
+            streamed_text.empty()
+
+        if gen_error or not sql_query:
+            error_message = gen_error or (gen_explanation or "The model did not generate a SQL query.")
+            conversation.messages.append({"role": "assistant", "content": f"❌ {error_message}"})
+            engine.finish_trace(conversation, "generation_failed")
+            st.session_state.ready_to_run = False
+            conversation.question = ""
+        else:
+            st.session_state.sql_query = sql_query
+            st.session_state.llm_explanation = gen_explanation
+            engine.add_sql_message(conversation, gen_explanation, sql_query)
+            last_user_question = next((msg["content"] for msg in reversed(conversation.messages) if msg["role"] == "user"), q)
+            st.session_state.suggestions_future = engine.suggest_follow_ups(conversation, last_user_question, sql_query)
+            st.session_state.ready_to_run = False
+            st.session_state.sql_generated = True
+            st.session_state.plan_review = None
+        st.rerun()
+
+    elif st.session_state.get('plan_review'):
+        plan = st.session_state.plan_review
+        st.warning("⚠️ This query could be expensive to run:\n\n" + "\n".join(f"- {reason}" for reason in plan["reasons"]))
+        run_col, skip_col = st.columns(2)
+        if run_col.button("▶️ Run anyway", use_container_width=True):
+            st.session_state.plan_approved_sql = st.session_state.sql_query
+            st.session_state.plan_review = None
+            st.rerun()
+        if skip_col.button("✖️ Don't run", use_container_width=True):
+            st.session_state.plan_review = None
+            conversation.messages.append({"role": "assistant", "content": "Query not run. Narrow the question (date range, filters, TOP N) and ask again."})
+            abandon_pending_query()
+            st.rerun()
+
+    # MODIFIED: Logic split into two parts for sequential display
+    elif st.session_state.get('sql_generated'):
+        if not query_plan_allows(st.session_state.sql_query):
+            st.rerun()
+        df_result, exec_error = execute_sql_streaming(st.session_state.sql_query, use_cache=not st.session_state.bypass_result_cache)
+
+        if engine.record_result(conversation, st.session_state.sql_query, df_result, exec_error):
+            future = st.session_state.suggestions_future
+            if future is None or future.done():
+                st.session_state.follow_up_suggestions = collect_follow_up_suggestions()
+                engine.finish_trace(conversation, "done")
+                st.session_state.sql_query = None
+                st.session_state.llm_explanation = None
+                conversation.question = ""
+            else:
+                # Still running: show the results first, then wait for the suggestions on the next rerun
+                st.session_state.generating_suggestions = True
+        elif exec_error and engine.escalate(conversation, st.session_state.sql_query, exec_error):
+            background_tasks.discard(st.session_state.suggestions_future)
+            st.session_state.suggestions_future = None
+            st.session_state.sql_query = None
+            st.session_state.llm_explanation = None
+            st.session_state.ready_to_run = True
+        else:
+            # If no results, clear query state now as no suggestions will be generated
+            engine.finish_trace(conversation, "failed" if exec_error else "no_rows")
+            background_tasks.discard(st.session_state.suggestions_future)
+            st.session_state.suggestions_future = None
+            st.session_state.sql_query = None
+            st.session_state.llm_explanation = None
+            conversation.question = ""
+        
+        st.session_state.sql_generated = False # Prevent this block from re-running
+        st.rerun()
+
+    # NEW: This block runs AFTER the results are displayed to the user
+    elif st.session_state.get('generating_suggestions'):
+        with st.spinner("🤔 Thinking of next steps..."):
+            if conversation.result_handle is not None:
+                st.session_state.follow_up_suggestions = collect_follow_up_suggestions(timeout=SUGGESTION_TIMEOUT_SECONDS)
+
+        # Clean up all temporary states after suggestions are generated
+        engine.finish_trace(conversation, "done")
+        st.session_state.generating_suggestions = False
+        st.session_state.sql_query = None
+        st.session_state.llm_explanation = None
+        conversation.question = ""
+        st.rerun()
 
 
 # --- Footer and Charting Logic (Unchanged) ---
 with st._bottom:
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        if st.button("➕ New Chat", use_container_width=True):
-            reset_chat_state()
-            st.rerun()
-    with col2:
-        if st.button("📈 Toggle Chart", use_container_width=True):
-            st.session_state.show_chart = not st.session_state.show_chart
-            st.rerun()
-    with col3:
-        if st.button("📎 Batch Upload", use_container_width=True):
-            st.session_state.show_batch_upload = not st.session_state.get("show_batch_upload", False)
-            st.session_state.question = ""
-            st.rerun()
-
-if st.session_state.show_chart and st.session_state.result_df is not None and not st.session_state.result_df.empty:
-    df = st.session_state.result_df
-    st.subheader("📈 Chart Generator")
-    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-    if not numeric_cols:
-        st.warning("No numeric columns for charting.")
-    else:
-        chart_type = st.selectbox("Chart Type", ["Bar", "Line", "Pie", "Scatter", "Area", "Box"])
-        color_col = st.selectbox("Color By", ["None"] + df.select_dtypes(include=['object']).columns.tolist())
-        x_col = st.selectbox("X-axis", df.columns.tolist())
-        y_col = st.selectbox("Y-axis", numeric_cols)
-        try:
-            color_arg = color_col if color_col != "None" else None
-            if chart_type == "Bar": fig = px.bar(df, x=x_col, y=y_col, color=color_arg)
-            elif chart_type == "Line": fig = px.line(df, x=x_col, y=y_col, color=color_arg)
-            elif chart_type == "Pie": fig = px.pie(df, names=x_col, values=y_col)
-            elif chart_type == "Scatter": fig = px.scatter(df, x=x_col, y=y_col, color=color_arg)
-            elif chart_type == "Area": fig = px.area(df, x=x_col, y=y_col, color=color_arg)
-            elif chart_type == "Box": fig = px.box(df, x=x_col, y=y_col, color=color_arg)
-            fig.update_layout(template="plotly_dark")
-            st.plotly_chart(fig, use_container_width=True)
-        except Exception as e:
-            st.error(f"Chart error: {e}")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("➕ New Chat", use_container_width=True):
+            reset_chat_state()
+            st.rerun()
+    with col2:
+        if st.button("📈 Toggle Chart", use_container_width=True):
+            st.session_state.show_chart = not st.session_state.show_chart
+            st.rerun()
+    with col3:
+        if st.button("📎 Batch Upload", use_container_width=True):
+            st.session_state.show_batch_upload = not st.session_state.get("show_batch_upload", False)
+            conversation.question = ""
+            st.rerun()
+
+with st.sidebar:
+    st.markdown("### ⚡ Performance")
+    sql_cache_stats = engine.sql_cache.stats()
+    st.caption(f"SQL cache: {sql_cache_stats['hits']} hits ({sql_cache_stats['template_hits']} template) / {sql_cache_stats['misses']} misses · {sql_cache_stats['hit_rate']:.0%} hit rate · ~{sql_cache_stats['seconds_saved']:.1f}s LLM time saved · {sql_cache_stats['entries']} entries")
+    if st.button("🧹 Clear SQL cache", use_container_width=True):
+        engine.sql_cache.clear()
+        st.rerun()
+    if conversation.last_prompt_stats:
+        prompt_stats = conversation.last_prompt_stats
+        saved = 1 - prompt_stats["pruned_tokens"] / max(prompt_stats["full_tokens"], 1)
+        st.caption(f"Last prompt: ~{prompt_stats['pruned_tokens']:,} tokens vs ~{prompt_stats['full_tokens']:,} with the full schema ({saved:.0%} smaller, {prompt_stats['tables']}/{prompt_stats['total_tables']} tables)")
+    if conversation.last_history_stats:
+        history_stats = conversation.last_history_stats
+        st.caption(f"History: ~{history_stats['history_tokens']:,} tokens ({history_stats['verbatim_turns']} recent turns verbatim, {history_stats['summarized_turns']} summarized)")
+    result_cache_stats = engine.result_cache.stats()
+    st.caption(f"Result cache: {result_cache_stats['hits']} hits / {result_cache_stats['misses']} misses · {result_cache_stats['hit_rate']:.0%} hit rate · {result_cache_stats['entries']} entries · {result_cache_stats['bytes'] / 1024 ** 2:.1f} / {result_cache_stats['max_bytes'] / 1024 ** 2:.0f} MB · {result_cache_stats['evictions']} evictions")
+    st.session_state.bypass_result_cache = st.checkbox("Bypass result cache", value=st.session_state.bypass_result_cache, help="Always run queries against the database")
+    conversation.compact_results = st.checkbox("Compact result frames", value=conversation.compact_results, help="float32/small integers where values allow, categories for repeated text")
+    if conversation.last_compaction:
+        compaction = conversation.last_compaction
+        st.caption(f"Last result: {compaction['before_bytes'] / 1024 ** 2:.2f} MB fetched → {compaction['after_bytes'] / 1024 ** 2:.2f} MB after compaction")
+    if st.button("🧹 Clear result cache", use_container_width=True):
+        engine.result_cache.invalidate()
+        st.rerun()
+    if GOVERN_QUERIES:
+        governor_stats = engine.governor.stats()
+        st.caption(f"Query governor: {governor_stats['checks']} checks ({governor_stats['cache_hits']} cached) · {governor_stats['allow']} allowed / {governor_stats['confirm']} needed confirmation / {governor_stats['block']} blocked · {governor_stats['errors']} plans unavailable")
+    if USE_ROLLUPS:
+        rollup_stats = engine.rollup_router.stats()
+        rollup_refreshed = engine.rollup_router.store.manifest().get("refreshed_at")
+        st.caption(f"Rollups: {rollup_stats['routed']} questions answered locally / {rollup_stats['declined']} sent to the LLM · " +
+                   (f"refreshed {datetime.datetime.fromtimestamp(rollup_refreshed):%Y-%m-%d %H:%M}" if rollup_refreshed else "not built yet"))
+    library_stats = engine.example_library.stats()
+    with_examples, without_examples = (library_stats.get(group, {"success_rate": 0.0, "avg_attempts": 0.0}) for group in ("with_examples", "without_examples"))
+    st.caption(f"Examples: {library_stats['examples']} answered questions ({library_stats['verified']} verified) · success {with_examples['success_rate']:.0%} with examples vs {without_examples['success_rate']:.0%} without · {with_examples['avg_attempts']:.1f} vs {without_examples['avg_attempts']:.1f} attempts per answer")
+    route_stats = engine.router.stats()
+    if route_stats:
+        st.caption("Model routes: " + " · ".join(
+            f"{name} {route['calls'] or route['ok'] + route['failed']} calls" + (f", {route['success_rate']:.0%} ok" if route["success_rate"] is not None else "") +
+            (f", p50 {route['p50_ms']:.0f} ms" if route["p50_ms"] is not None else "") for name, route in route_stats.items()))
+    service_stats = engine.query_service.stats()
+    st.caption(f"Database: {service_stats['running']}/{service_stats['max_concurrent']} queries running · {service_stats['queued']} queued from {service_stats['queued_users']} sessions · wait avg {service_stats['avg_wait_seconds']:.1f}s / max {service_stats['max_wait_seconds']:.1f}s · {service_stats['rejected']} rejected · pool {service_stats['checked_out']}/{service_stats['pool_size']} connections in use")
+    if get_export_manager().jobs(conversation.id):
+        st.markdown("### 📦 Exports")
+        show_exports()
+    result_store_stats = engine.result_store.stats()
+    st.caption(f"Result store: {result_store_stats['results']} results in {result_store_stats['sessions']} sessions · {result_store_stats['in_memory']} in memory ({result_store_stats['memory_bytes'] / 1024 ** 2:.1f} / {result_store_stats['max_bytes'] / 1024 ** 2:.0f} MB) · {result_store_stats['disk_bytes'] / 1024 ** 2:.1f} MB on disk · {result_store_stats['evictions']} evictions")
+
+if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+    with st.expander("🛠️ Performance panel (admin)"):
+        window_label = st.radio("Window", ["15 min", "1 hour", "24 hours"], horizontal=True, key="perf_window")
+        since = time.time() - {"15 min": 900, "1 hour": 3600, "24 hours": 86400}[window_label]
+        if st.checkbox("Read the span log (all app processes)", key="perf_from_log", help="Otherwise only this process's recent spans are shown"):
+            spans = read_spans(engine.tracer.path or DEFAULT_TRACE_PATH, since=since)
+        else:
+            spans = [span for span in engine.tracer.spans() if span["ts"] >= since]
+        st.markdown("**Rolling percentiles by stage**")
+        st.dataframe(pd.DataFrame(stage_percentiles(spans)), use_container_width=True, hide_index=True)
+        st.markdown("**Recent requests**")
+        st.dataframe(pd.DataFrame(recent_requests(spans)), use_container_width=True, hide_index=True)
+        st.markdown("**Slowest queries**")
+        st.dataframe(pd.DataFrame(slowest_spans(spans, "sql_execute")), use_container_width=True, hide_index=True)
+
+chart_df = current_result_df() if st.session_state.show_chart else None
+if chart_df is not None and not chart_df.empty:
+    df = chart_df
+    st.subheader("📈 Chart Generator")
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    if not numeric_cols:
+        st.warning("No numeric columns for charting.")
+    else:
+        chart_type = st.selectbox("Chart Type", ["Bar", "Line", "Pie", "Scatter", "Area", "Box"])
+        color_col = st.selectbox("Color By", ["None"] + df.select_dtypes(include=['object', 'string', 'category']).columns.tolist())
+        x_col = st.selectbox("X-axis", df.columns.tolist())
+        y_col = st.selectbox("Y-axis", numeric_cols)
+        try:
+            color_arg = color_col if color_col != "None" else None
+            fig, chart_notes = build_chart(conversation.result_handle, chart_type, x_col, y_col, color_arg, df)
+            for note in chart_notes:
+                st.caption(f"ℹ️ {note}")
+            st.plotly_chart(fig, use_container_width=True)
+        except Exception as e:
+            st.error(f"Chart error: {e}")
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import anyio
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from sales_engine import Conversation, SalesEngine, database_engine_from_env
+
+API_WORKERS = int(os.getenv("API_WORKERS", "32")) # Turns running at once; the fair queue still caps database concurrency
+API_MAX_CONVERSATIONS = int(os.getenv("API_MAX_CONVERSATIONS", "5000"))
+API_CONVERSATION_TTL_MINUTES = float(os.getenv("API_CONVERSATION_TTL_MINUTES", "120"))
+API_PREVIEW_ROWS = int(os.getenv("API_PREVIEW_ROWS", "100")) # Rows of a result returned with the answer; page through the rest
+
+
+class ConversationStore:
+    """Conversations by id, each with the lock that keeps its turns in order. Idle conversations
+    expire after `ttl` seconds and the least recently used go once there are `max_conversations`;
+    their stored results are dropped with them."""
+
+    def __init__(self, engine, max_conversations: int = 5000, ttl: float = 7200):
+        self.engine = engine
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict()  # id -> (Conversation, asyncio.Lock)
+
+    def create(self, user=None):
+        self._expire()
+        conversation = Conversation(user=user)
+        self._conversations[conversation.id] = (conversation, asyncio.Lock())
+        return conversation
+
+    def get(self, conversation_id):
+        entry = self._conversations.get(conversation_id)
+        if entry is not None:
+            self._conversations.move_to_end(conversation_id)
+        return entry
+
+    def remove(self, conversation_id):
+        entry = self._conversations.pop(conversation_id, None)
+        if entry is not None:
+            self.engine.reset(entry[0])
+        return entry is not None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for conversation_id, (conversation, lock) in list(self._conversations.items()):
+            if len(self._conversations) < self.max_conversations and conversation.last_active >= cutoff:
+                break  # oldest first: the rest are newer
+            if not lock.locked():
+                self.remove(conversation_id)
+
+    def __len__(self):
+        return len(self._conversations)
+
+
+def frame_page(df, offset=0, limit=API_PREVIEW_ROWS) -> dict:
+    """{"columns", "data", "offset", "total_rows"} for a slice of a result; NaN/NaT become null, dates ISO strings."""
+    page = json.loads(df.iloc[offset:offset + limit].to_json(orient="split", index=False, date_format="iso"))
+    return {"columns": page["columns"], "data": page["data"], "offset": offset, "total_rows": len(df)}
+
+
+def _error(status, message):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def _int_param(value, default):
+    """`value` as an int (`default` when it is missing), or None when it is not an integer."""
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _body(request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def create_app(engine: SalesEngine = None, workers: int = API_WORKERS) -> Starlette:
+    """The HTTP API over a SalesEngine (built from the environment on startup when not given).
+
+    Turns are blocking (LLM call, database query), so each runs on a worker thread; at most `workers`
+    at once, which lets one process serve many conversations without blocking the event loop."""
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        app.state.engine = engine or await anyio.to_thread.run_sync(lambda: SalesEngine(database_engine_from_env()))
+        app.state.conversations = ConversationStore(app.state.engine, API_MAX_CONVERSATIONS, API_CONVERSATION_TTL_MINUTES * 60)
+        app.state.limiter = anyio.CapacityLimiter(workers)
+        yield
+
+    async def run_blocking(request, fn, *args):
+        return await anyio.to_thread.run_sync(fn, *args, limiter=request.app.state.limiter)
+
+    def conversation_or_404(request):
+        return request.app.state.conversations.get(request.path_params["conversation_id"])
+
+    async def with_preview(request, turn, rows):
+        result = turn.get("result")
+        if result and rows:
+            df = await run_blocking(request, request.app.state.engine.result_store.get, result["handle"])
+            if df is not None:
+                result["preview"] = frame_page(df, 0, rows)
+        return JSONResponse(turn)
+
+    async def create_conversation(request):
+        body = await _body(request)
+        conversation = request.app.state.conversations.create(user=body.get("user"))
+        return JSONResponse({"conversation_id": conversation.id, "messages": conversation.messages}, status_code=201)
+
+    async def get_conversation(request):
+        entry = conversation_or_404(request)
+        if entry is None:
+            return _error(404, "unknown conversation")
+        conversation = entry[0]
+        return JSONResponse({"conversation_id": conversation.id, "question": conversation.question, "clarification": conversation.clarification,
+                             "awaiting_confirmation": conversation.pending is not None,
+                             "messages": [dict(msg, result=request.app.state.engine.result_store.info(msg["handle"])) if msg["role"] == "dataframe"
+                                          else {key: value for key, value in msg.items() if key != "plan"} for msg in conversation.messages]})
+
+    async def delete_conversation(request):
+        if not request.app.state.conversations.remove(request.path_params["conversation_id"]):
+            return _error(404, "unknown conversation")
+        return JSONResponse({"deleted": True})
+
+    async def ask(request):
+        entry = conversation_or_404(request)
+        if entry is None:
+            return _error(404, "unknown conversation")
+        body = await _body(request)
+        question, choice = (body.get("question") or "").strip(), body.get("choice")
+        if not question and choice is None:
+            return _error(400, "'question' (or 'choice' for a clarification) is required")
+        rows = _int_param(body.get("rows"), API_PREVIEW_ROWS)
+        if rows is None:
+            return _error(400, "'rows' must be an integer")
+        conversation, lock = entry
+        async with lock:
+            # Checked under the lock: a turn running on this conversation may still change its clarification.
+            if choice is not None and (conversation.clarification or {}).get("type") != "ambiguity":
+                return _error(409, "no ambiguity is waiting for a choice")
+            turn = await run_blocking(request, lambda: request.app.state.engine.ask(conversation, question, choice=choice, use_cache=body.get("use_cache", True)))
+        return await with_preview(request, turn, rows)
+
+    async def confirm(request):
+        entry = conversation_or_404(request)
+        if entry is None:
+            return _error(404, "unknown conversation")
+        body = await _body(request)
+        rows = _int_param(body.get("rows"), API_PREVIEW_ROWS)
+        if rows is None:
+            return _error(400, "'rows' must be an integer")
+        conversation, lock = entry
+        async with lock:
+            turn = await run_blocking(request, lambda: request.app.state.engine.confirm(conversation, run=body.get("run", True), use_cache=body.get("use_cache", True)))
+        return await with_preview(request, turn, rows)
+
+    async def get_result(request):
+        entry = conversation_or_404(request)
+        handle = request.path_params["handle"]
+        if entry is None or not handle.startswith(f"{entry[0].id}/"):
+            return _error(404, "unknown result")
+        offset, limit = _int_param(request.query_params.get("offset"), 0), _int_param(request.query_params.get("limit"), API_PREVIEW_ROWS)
+        if offset is None or limit is None:
+            return _error(400, "'offset' and 'limit' must be integers")
+        df = await run_blocking(request, request.app.state.engine.result_store.get, handle)
+        if df is None:
+            return _error(410, "this result has expired; ask the question again")
+        return JSONResponse(frame_page(df, max(offset, 0), max(min(limit, 10_000), 0)))
+
+    async def health(request):
+        return JSONResponse({"status": "ok", "conversations": len(request.app.state.conversations)})
+
+    async def stats(request):
+        limiter = request.app.state.limiter
+        engine_stats = await run_blocking(request, request.app.state.engine.stats)
+        return JSONResponse(dict(engine_stats, api={"conversations": len(request.app.state.conversations), "turns_running": limiter.borrowed_tokens,
+                                                    "turns_waiting": limiter.statistics().tasks_waiting, "workers": limiter.total_tokens}),
+                            headers={"Cache-Control": "no-store"})
+
+    return Starlette(routes=[
+        Route("/health", health),
+        Route("/stats", stats),
+        Route("/conversations", create_conversation, methods=["POST"]),
+        Route("/conversations/{conversation_id}", get_conversation),
+        Route("/conversations/{conversation_id}", delete_conversation, methods=["DELETE"]),
+        Route("/conversations/{conversation_id}/ask", ask, methods=["POST"]),
+        Route("/conversations/{conversation_id}/confirm", confirm, methods=["POST"]),
+        Route("/conversations/{conversation_id}/results/{handle:path}", get_result),
+    ], lifespan=lifespan)
+
+
+def main(argv=None):
+    """`python api_server.py [--host 0.0.0.0] [--port 8000]`; several processes can share the on-disk caches."""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the sales question pipeline over HTTP.")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="turns running at once in this process")
+    args = parser.parse_args(argv)
+    uvicorn.run(create_app(workers=args.workers), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,26 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide pool for work that overlaps a Streamlit phase (e.g. LLM calls while SQL runs)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("BACKGROUND_WORKERS", "8")), thread_name_prefix="background")
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """Starts `fn` in the background; the returned Future can be kept in session state across reruns."""
+    return get_executor().submit(fn, *args, **kwargs)
+
+
+def discard(future):
+    """Drops a task whose result is no longer wanted; a task that already started just finishes unobserved."""
+    if future is not None:
+        future.cancel()
@@ -0,0 +1,245 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+# Deadlocks and dropped connections. A statement timeout is not retried: the query is too heavy
+# and would only run out its time again while holding a `db_workers` slot.
+_TRANSIENT_DB_ERRORS = re.compile(r"deadlock|connection|communication link|08S01|40001|\b1205\b", re.IGNORECASE)
+# Rate limits (429), server errors (5xx, as the status code leading the API message) and network trouble;
+# anything else (bad request, invalid key, blocked prompt) fails the same way on every attempt.
+_TRANSIENT_LLM_ERRORS = re.compile(r"(?:^|:\s*)(?:429|5\d\d)\b|rate.?limit|resource.?exhausted|deadline exceeded|timeout|timed out|"
+                                   r"unavailable|overloaded|internal error|connection|temporar", re.IGNORECASE)
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls evenly at `per_minute` (0 disables it)."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def read_questions(source, filename: str = None):
+    """Questions from an uploaded or on-disk xlsx/csv: the "Question" column if present, else the first one."""
+    name = (filename or getattr(source, "name", "") or str(source)).lower()
+    df = pd.read_csv(source) if name.endswith(".csv") else pd.read_excel(source)
+    if df.empty:
+        return []
+    column = next((c for c in df.columns if str(c).strip().lower() in ("question", "questions")), df.columns[0])
+    return [str(q).strip() for q in df[column].dropna() if str(q).strip()]
+
+
+def _backoff(attempt: int, base: float, cap: float = 30.0) -> float:
+    return min(cap, base * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+
+class BatchRun:
+    """Runs questions through LLM generation and SQL execution on two bounded pools.
+
+    `results` is a list of per-question dicts updated in place while the run progresses, so a
+    UI can poll it; `on_update(result)` is called from worker threads after every change."""
+
+    def __init__(self, questions, generate_fn, execute_fn, llm_workers: int = 4, db_workers: int = 2, llm_per_minute: float = 60,
+                 max_attempts: int = 3, backoff_seconds: float = 2.0, on_update=None):
+        self.results = [{"index": i, "question": q, "status": "queued", "explanation": None, "sql": None, "error": None,
+                         "rows": None, "df": None, "attempts": 0, "llm_seconds": None, "db_seconds": None}
+                        for i, q in enumerate(questions)]
+        self.generate_fn = generate_fn
+        self.execute_fn = execute_fn
+        self.llm_workers = llm_workers
+        self.db_workers = db_workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.on_update = on_update
+        self.rate_limiter = RateLimiter(llm_per_minute)
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._llm_slots = threading.BoundedSemaphore(llm_workers)
+        self._db_slots = threading.BoundedSemaphore(db_workers)
+
+    def _update(self, result, **changes):
+        with self._lock:
+            result.update(changes)
+        if self.on_update:
+            self.on_update(result)
+
+    def _process(self, result):
+        if self._cancelled.is_set():
+            self._update(result, status="cancelled")
+            return
+        started = time.perf_counter()
+        explanation = sql = error = None
+        for attempt in range(1, self.max_attempts + 1):
+            with self._llm_slots:
+                self.rate_limiter.acquire()
+                self._update(result, status="generating", attempts=attempt)
+                explanation, sql, error = self.generate_fn(result["question"])
+            if not error or self._cancelled.is_set() or not _TRANSIENT_LLM_ERRORS.search(error) or attempt == self.max_attempts:
+                break
+            time.sleep(_backoff(attempt, self.backoff_seconds))
+        self._update(result, explanation=explanation, sql=sql, llm_seconds=round(time.perf_counter() - started, 2))
+        if error or not sql:
+            self._update(result, status="failed" if error else "no_sql", error=error or explanation)
+            return
+        # Generation can run ahead of the database, but at most `db_workers` queries run at once.
+        with self._db_slots:
+            started = time.perf_counter()
+            for attempt in range(1, self.max_attempts + 1):
+                if self._cancelled.is_set():
+                    self._update(result, status="cancelled")
+                    return
+                self._update(result, status="executing")
+                df, error = self.execute_fn(sql)
+                if not error or not _TRANSIENT_DB_ERRORS.search(error) or attempt == self.max_attempts:
+                    break
+                time.sleep(_backoff(attempt, self.backoff_seconds))
+        self._update(result, db_seconds=round(time.perf_counter() - started, 2))
+        if error:
+            self._update(result, status="failed", error=error)
+        else:
+            self._update(result, status="done", df=df, rows=len(df))
+
+    def _run(self):
+        try:
+            with ThreadPoolExecutor(max_workers=self.llm_workers + self.db_workers, thread_name_prefix="batch") as pool:
+                list(pool.map(self._process, self.results))
+        finally:
+            self.finished_at = time.perf_counter()
+            self._done.set()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        threading.Thread(target=self._run, name="batch-run", daemon=True).start()
+        return self
+
+    def run(self):
+        self.start()
+        self.wait()
+        return self.results
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def progress(self) -> dict:
+        with self._lock:
+            counts = {}
+            for result in self.results:
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+        finished = sum(counts.get(s, 0) for s in ("done", "failed", "no_sql", "cancelled"))
+        return {"total": len(self.results), "finished": finished, "counts": counts,
+                "elapsed": (self.finished_at or time.perf_counter()) - self.started_at if self.started_at else 0.0}
+
+
+def summary_frame(results) -> pd.DataFrame:
+    return pd.DataFrame([{
+        "#": r["index"] + 1, "Question": r["question"], "Status": r["status"], "Rows": r["rows"],
+        "Attempts": r["attempts"], "LLM (s)": r["llm_seconds"], "DB (s)": r["db_seconds"],
+        "Sheet": f"Q{r['index'] + 1}" if r["df"] is not None else None, "Error": r["error"], "SQL": r["sql"],
+    } for r in results])
+
+
+def build_workbook(results) -> BytesIO:
+    """In-memory xlsx with a Summary sheet followed by one sheet per answered question."""
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        summary_frame(results).to_excel(writer, sheet_name="Summary", index=False)
+        for r in results:
+            if r["df"] is not None:
+                r["df"].to_excel(writer, sheet_name=f"Q{r['index'] + 1}", index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def main(argv=None):
+    """Headless mode: `python batch_runner.py questions.xlsx -o results.xlsx` (e.g. from a nightly scheduler)."""
+    from dotenv import load_dotenv
+    import google.generativeai as genai
+    from sqlalchemy import create_engine
+    from query_governor import QueryGovernor, table_row_estimates
+    from query_runner import run_query
+    from schema_snapshot import DEFAULT_SNAPSHOT_PATH, load_snapshot
+    from sql_cache import SqlCache, DEFAULT_CACHE_PATH
+    from sql_generation import generate_sql
+    from system_prompt import DEFAULT_PROMPT_DIR, compiled_prompt_path
+
+    load_dotenv("Secrets.env")  # before the defaults below read PROMPT_DIR, DB_URL...
+    parser = argparse.ArgumentParser(description="Run a sheet of questions through SQL generation and execution.")
+    parser.add_argument("questions", help="xlsx/csv file with a 'Question' column (or questions in the first column)")
+    parser.add_argument("-o", "--output", default="batch_results.xlsx")
+    parser.add_argument("--system-prompt", default=os.getenv("SYSTEM_PROMPT_PATH", compiled_prompt_path(os.getenv("PROMPT_DIR", DEFAULT_PROMPT_DIR))),
+                        help="file holding the compiled system prompt (default: the one the app compiled last)")
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"), help="SQLAlchemy URL of the database")
+    parser.add_argument("--llm-workers", type=int, default=4)
+    parser.add_argument("--db-workers", type=int, default=2)
+    parser.add_argument("--rpm", type=float, default=60, help="max LLM requests per minute")
+    parser.add_argument("--max-rows", type=int, default=100_000)
+    parser.add_argument("--no-governor", action="store_true", help="skip the estimated-plan check that blocks runaway queries")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.system_prompt) or not args.db_url:
+        parser.error("--system-prompt (a compiled prompt file; open the app once to create it) and --db-url (or DB_URL) are required")
+
+    genai.configure(api_key=os.getenv("GOOGLE_API"))
+    with open(args.system_prompt, encoding="utf-8") as f:
+        system_prompt = f.read()
+    engine = create_engine(args.db_url)
+    sql_cache = SqlCache(os.getenv("SQL_CACHE_PATH", DEFAULT_CACHE_PATH))
+    questions = read_questions(args.questions)
+    governor = None if args.no_governor else QueryGovernor(engine, table_rows=table_row_estimates(load_snapshot(os.getenv("SCHEMA_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH))))
+
+    def _execute(sql):
+        plan = governor.check(sql) if governor else None
+        if plan and plan["verdict"] == "block":
+            sql_cache.discard(sql)
+            return None, "Blocked by the query cost governor: " + "; ".join(plan["reasons"])
+        df, error = run_query(engine, sql, max_rows=args.max_rows).result()
+        if error:
+            sql_cache.discard(sql)
+        else:
+            sql_cache.confirm(sql)
+        return df, error
+
+    def _print_status(result):
+        if result["status"] in ("done", "failed", "no_sql"):
+            print(f"[{result['index'] + 1}/{len(questions)}] {result['status']:<7} {result['question'][:80]}", flush=True)
+
+    run = BatchRun(questions, generate_fn=lambda q: generate_sql(q, system_prompt, sql_cache=sql_cache),
+                   execute_fn=_execute,
+                   llm_workers=args.llm_workers, db_workers=args.db_workers, llm_per_minute=args.rpm, on_update=_print_status)
+    results = run.run()
+    with open(args.output, "wb") as f:
+        f.write(build_workbook(results).getvalue())
+    progress = run.progress()
+    print(f"Finished {progress['finished']}/{progress['total']} in {progress['elapsed']:.1f}s: {progress['counts']} -> {args.output}")
+    return 0 if progress["counts"].get("done", 0) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,399 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import event
+
+import sales_engine
+from query_service import create_pooled_engine
+from sales_engine import Conversation, SalesEngine
+from schema_index import estimate_tokens
+from stub_llm import StubModel
+from system_prompt import PromptArtifacts, RULES_TEMPLATE
+from tracing import Tracer
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "bench")
+SCHEMA = "your_schema"
+STAGES = ["rollup_route", "prompt_build", "history_build", "llm_generate", "plan_check", "queue_wait", "sql_execute", "compact", "suggestions", "end_to_end"]
+
+_DDL = """
+CREATE TABLE System_MstDepartments (DepartmentID INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Sales_MstSalesChannels (SalesChannelID INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Sales_SalesOrders (
+    OrderID INTEGER PRIMARY KEY, CustomerID INTEGER, OrderDate TEXT, CreatedDate TEXT, StatusID INTEGER, CancelDate TEXT,
+    DepartmentID INTEGER REFERENCES System_MstDepartments (DepartmentID));
+CREATE TABLE Sales_SalesOrderLines (
+    OrderLineID INTEGER PRIMARY KEY, OrderID INTEGER REFERENCES Sales_SalesOrders (OrderID), ProductID INTEGER, QTY INTEGER,
+    UnitPrice REAL, TotalNetAmt REAL, SalesChannelID INTEGER REFERENCES Sales_MstSalesChannels (SalesChannelID), ItemStatusID INTEGER);
+CREATE TABLE Sales_SaleTargets (Date TEXT, Type TEXT, Sales REAL);
+CREATE TABLE Discount_Discounts (DiscountID INTEGER PRIMARY KEY, ProductID INTEGER, Amount REAL, StartDate TEXT, EndDate TEXT);
+CREATE INDEX ix_orders_date ON Sales_SalesOrders (OrderDate);
+CREATE INDEX ix_lines_order ON Sales_SalesOrderLines (OrderID);
+"""
+
+_CONDITIONS = "so.StatusID NOT IN (17, 20, 21) AND so.CancelDate IS NULL AND IFNULL(sol.ItemStatusID, 0) NOT IN (20) AND sol.ProductID > 0"
+_FROM_LINES = f"""FROM {SCHEMA}.Sales_SalesOrderLines sol
+JOIN {SCHEMA}.Sales_SalesOrders so ON so.OrderID = sol.OrderID"""
+
+# (pattern, explanation, SQL) shaped like the model's answers, in SQLite dialect for the stand-in database.
+RECORDED_ANSWERS = [
+    (r"by (sales )?channel", "Gross sales per sales channel for the fiscal year.", f"""SELECT sc.Name AS Channel, ROUND(SUM(sol.TotalNetAmt), 2) AS GrossSales
+{_FROM_LINES}
+LEFT JOIN {SCHEMA}.Sales_MstSalesChannels sc ON sc.SalesChannelID = sol.SalesChannelID
+WHERE so.OrderDate >= '2024-04-01' AND so.OrderDate < '2025-04-01' AND {_CONDITIONS}
+GROUP BY sc.Name ORDER BY GrossSales DESC LIMIT 1000"""),
+    (r"top \d+ .*products?", "Best-selling products by quantity.", f"""SELECT sol.ProductID, SUM(sol.QTY) AS Quantity, ROUND(SUM(sol.TotalNetAmt), 2) AS GrossSales
+{_FROM_LINES}
+WHERE so.OrderDate >= '2025-01-01' AND so.OrderDate < '2026-01-01' AND {_CONDITIONS}
+GROUP BY sol.ProductID ORDER BY Quantity DESC LIMIT 10"""),
+    (r"daily order count", "Distinct orders per day.", f"""SELECT DATE(so.OrderDate) AS Day, COUNT(DISTINCT so.OrderID) AS OrderCount
+{_FROM_LINES}
+WHERE so.OrderDate >= '2025-03-01' AND so.OrderDate < '2025-04-01' AND {_CONDITIONS}
+GROUP BY DATE(so.OrderDate) ORDER BY Day LIMIT 1000"""),
+    (r"unique customers", "Unique customers per department.", f"""SELECT d.Name AS Department, COUNT(DISTINCT so.CustomerID) AS UniqueCustomers
+{_FROM_LINES}
+LEFT JOIN {SCHEMA}.System_MstDepartments d ON d.DepartmentID = so.DepartmentID
+WHERE so.OrderDate >= '2024-01-01' AND so.OrderDate < '2025-01-01' AND {_CONDITIONS}
+GROUP BY d.Name ORDER BY UniqueCustomers DESC LIMIT 1000"""),
+    (r"monthly", "Gross sales per month.", f"""SELECT STRFTIME('%Y-%m', so.OrderDate) AS Month, ROUND(SUM(sol.TotalNetAmt), 2) AS GrossSales
+{_FROM_LINES}
+WHERE so.OrderDate >= '2024-01-01' AND so.OrderDate < '2025-01-01' AND {_CONDITIONS}
+GROUP BY Month ORDER BY Month LIMIT 1000"""),
+    (r"average order value", "Gross sales divided by order count per channel.", f"""SELECT sc.Name AS Channel, ROUND(SUM(sol.TotalNetAmt) / NULLIF(COUNT(DISTINCT so.OrderID), 0), 2) AS AvgOrderValue
+{_FROM_LINES}
+LEFT JOIN {SCHEMA}.Sales_MstSalesChannels sc ON sc.SalesChannelID = sol.SalesChannelID
+WHERE so.OrderDate >= '2025-04-01' AND so.OrderDate < '2026-04-01' AND {_CONDITIONS}
+GROUP BY sc.Name ORDER BY AvgOrderValue DESC LIMIT 1000"""),
+    (r"cancel", "Cancelled orders per month.", f"""SELECT STRFTIME('%Y-%m', so.OrderDate) AS Month, COUNT(*) AS CancelledOrders
+FROM {SCHEMA}.Sales_SalesOrders so
+WHERE so.OrderDate >= '2024-01-01' AND so.OrderDate < '2025-01-01' AND (so.StatusID IN (17, 20, 21) OR so.CancelDate IS NOT NULL)
+GROUP BY Month ORDER BY Month LIMIT 1000"""),
+    (r"target", "Daily target against actual sales.", f"""WITH actual AS (
+    SELECT DATE(so.OrderDate) AS Day, SUM(sol.TotalNetAmt) AS Sales
+    {_FROM_LINES}
+    WHERE so.OrderDate >= '2025-03-01' AND so.OrderDate < '2025-04-01' AND {_CONDITIONS}
+    GROUP BY DATE(so.OrderDate))
+SELECT t.Date, ROUND(t.Sales, 2) AS Target, ROUND(a.Sales, 2) AS Actual, ROUND(a.Sales / NULLIF(t.Sales, 0) * 100, 2) AS AchievedPct
+FROM {SCHEMA}.Sales_SaleTargets t LEFT JOIN actual a ON a.Day = t.Date
+WHERE t.Type = 'Daily' AND t.Date >= '2025-03-01' AND t.Date < '2025-04-01' ORDER BY t.Date LIMIT 1000"""),
+    (r"order lines|line items|every", "All order lines in the period.", f"""SELECT so.OrderID, so.OrderDate, sol.ProductID, sol.QTY, sol.TotalNetAmt, sol.SalesChannelID
+{_FROM_LINES}
+WHERE so.OrderDate >= '2024-04-01' AND so.OrderDate < '2025-04-01' AND {_CONDITIONS}"""),
+]
+DEFAULT_ANSWER = ("Total gross sales for the default period.", f"""SELECT ROUND(SUM(sol.TotalNetAmt), 2) AS GrossSales, COUNT(DISTINCT so.OrderID) AS OrderCount
+{_FROM_LINES}
+WHERE so.OrderDate >= '2024-04-01' AND {_CONDITIONS}""")
+# Real replies end with a validation section after the SQL block; streaming skips waiting for it.
+VALIDATION_NOTES = ("\n\n**Validation:**\n- Applied the standard order filters (StatusID, CancelDate, ItemStatusID, ProductID).\n"
+                    "- Date bounds follow the fiscal year convention (April 1st to March 31st).\n- Joins use the documented keys; "
+                    "no Cartesian products.\n- Amounts are rounded to two decimals and columns carry descriptive aliases.")
+SUGGESTIONS_REPLY = '["Can you break this down by sales channel?", "How does this compare to the previous year?", "What are the top 5 products in this category?"]'
+QUESTIONS = [
+    "What were gross sales by sales channel in FY2024?", "Top 10 selling products in 2025", "Daily order count for March 2025",
+    "Unique customers by department in 2024", "Monthly gross sales trend for 2024", "Average order value by channel in FY2025",
+    "How many cancelled orders per month in 2024?", "Daily target vs actual sales for March 2025", "Show every order line for FY2024",
+    "What about total gross sales?",
+]
+# Stand-in for the app's rules (Parts 2-4); pass --system-prompt to measure the real prompt.
+_RULES_STANDIN = """You are an expert-level SQL architect. Generate a single, optimized query for the user's request.
+Part 1: Database Schema Reference:
+<<SCHEMA_SECTION>>
+Part 2: Core Directives & Rules
+""" + "\n".join(f"- Rule {i}: always qualify columns with table aliases, round to 2 decimals, exclude cancelled orders and returned items." for i in range(60))
+
+
+def build_dataset(path, orders: int = 50_000, seed: int = 7):
+    """Seeded SQLite copy of the sales schema: ~2.5 lines per order between FY2023 and FY2025."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(_DDL)
+    conn.executemany("INSERT INTO System_MstDepartments VALUES (?, ?)", [(i, "Mobile" if i == 15 else f"Department {i}") for i in range(1, 21)])
+    channels = ["TV", "Web", "Mobile FPC", "Mobile App", "Call Center", "Retail"]
+    conn.executemany("INSERT INTO Sales_MstSalesChannels VALUES (?, ?)", list(enumerate(channels, start=1)))
+    start = np.datetime64("2023-04-01T00:00:00")
+    order_times = np.sort(start + rng.integers(0, 912 * 86400, orders).astype("timedelta64[s]"))
+    order_dates = [str(t).replace("T", " ") for t in order_times]
+    cancelled = rng.random(orders) < 0.04
+    conn.executemany("INSERT INTO Sales_SalesOrders VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (i + 1, int(rng.integers(1, orders // 3 + 2)), order_dates[i], order_dates[i], 17 if cancelled[i] else 5,
+         order_dates[i] if cancelled[i] else None, int(rng.integers(1, 21))) for i in range(orders)])
+    line_orders = np.repeat(np.arange(1, orders + 1), rng.integers(1, 5, orders))
+    qty = rng.integers(1, 6, len(line_orders))
+    price = np.round(rng.gamma(2.0, 40.0, len(line_orders)), 2)
+    conn.executemany("INSERT INTO Sales_SalesOrderLines VALUES (?, ?, ?, ?, ?, ?, ?, ?)", zip(
+        range(1, len(line_orders) + 1), line_orders.tolist(), rng.integers(1, 2000, len(line_orders)).tolist(), qty.tolist(),
+        price.tolist(), np.round(qty * price, 2).tolist(), rng.integers(1, len(channels) + 1, len(line_orders)).tolist(),
+        np.where(rng.random(len(line_orders)) < 0.02, 20, 0).tolist()))
+    days = np.arange(np.datetime64("2023-04-01"), np.datetime64("2025-10-01"))
+    conn.executemany("INSERT INTO Sales_SaleTargets VALUES (?, 'Daily', ?)", [(str(d), float(v)) for d, v in zip(days, np.round(rng.normal(40_000, 5_000, len(days)), 2))])
+    conn.executemany("INSERT INTO Discount_Discounts VALUES (?, ?, ?, '2024-01-01', '2024-12-31')", [(i, int(rng.integers(1, 2000)), float(rng.integers(5, 50))) for i in range(1, 301)])
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_database(path, max_concurrent: int = 4):
+    """Engine whose connections see the dataset as `your_schema`, as the generated SQL expects."""
+    engine = create_pooled_engine(f"sqlite:///{path}", pool_size=max_concurrent + 2)
+
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_conn, _):
+        dbapi_conn.execute(f"ATTACH DATABASE '{path}' AS {SCHEMA}")
+
+    return engine
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values, dtype="float64") * 1000
+    return {"count": len(arr), "mean_ms": round(float(arr.mean()), 2), "p50_ms": round(float(np.percentile(arr, 50)), 2),
+            "p95_ms": round(float(np.percentile(arr, 95)), 2), "p99_ms": round(float(np.percentile(arr, 99)), 2), "max_ms": round(float(arr.max()), 2)}
+
+
+class _RunTracer(Tracer):
+    """Keeps every span of the run grouped by trace, and the last trace each thread started."""
+
+    def __init__(self):
+        super().__init__(None, max_recent=1)
+        self.by_trace = defaultdict(list)
+        self._local = threading.local()
+
+    def new_trace(self) -> str:
+        trace_id = super().new_trace()
+        self._local.trace_id = trace_id
+        return trace_id
+
+    def last_trace(self):
+        return getattr(self._local, "trace_id", None)
+
+    def record(self, name: str, seconds: float, trace_id=None, **attrs):
+        super().record(name, seconds, trace_id, **attrs)
+        self.by_trace[trace_id].append({"span": name, "seconds": seconds, "attrs": attrs})
+
+
+def build_engine(db_engine, run_dir, sql_model, suggestion_model, rules_template=RULES_TEMPLATE):
+    """A SalesEngine over the SQLite stand-in whose caches, result store, rollups and prompts live in `run_dir`."""
+    for name, value in {"SQL_CACHE_PATH": "sql_cache.sqlite3", "RESULT_STORE_DIR": "results", "EXAMPLE_LIBRARY_PATH": "examples.sqlite3",
+                        "PROMPT_DIR": "prompts", "ROLLUP_DIR": "rollups", "SCHEMA_SNAPSHOT_PATH": "schema_snapshot.json"}.items():
+        os.environ[name] = os.path.join(run_dir, value)
+    os.environ["TRACING"] = "0"
+    engine = SalesEngine(db_engine, schemas=[SCHEMA], explain=lambda snapshot: "", sql_model=sql_model, suggestion_model=suggestion_model)
+    engine.prompt_artifacts = PromptArtifacts(os.environ["PROMPT_DIR"], rules_template=rules_template)
+    return engine
+
+
+class Benchmark:
+    """Simulated users, each with its own Conversation, asking questions through SalesEngine.ask as the
+    HTTP API does: rollups, SQL cache, model routing, governor, fair queue, compaction, result store
+    and example library included. Stage timings come from the engine's trace spans."""
+
+    def __init__(self, engine, auto_confirm: bool = True):
+        self.engine = engine
+        self.tracer = engine.tracer = _RunTracer()
+        self.auto_confirm = auto_confirm
+
+    def ask(self, conversation, question) -> dict:
+        started = time.perf_counter()
+        turn = self.engine.ask(conversation, question)
+        if turn["status"] == "needs_confirmation" and self.auto_confirm:
+            turn = self.engine.confirm(conversation)
+        seconds = time.perf_counter() - started
+        sample = {"user": conversation.user, "question": question, "status": turn["status"], "source": turn.get("source"), "stages": {},
+                  "error": turn.get("error") or turn["status"] if turn["status"] in ("failed", "blocked", "not_run") else None}
+        if turn["status"] == "clarify":
+            return sample
+        for span in self.tracer.by_trace.get(self.tracer.last_trace(), []):
+            stage = "end_to_end" if span["span"] == "request" else span["span"]
+            sample["stages"][stage] = sample["stages"].get(stage, 0.0) + span["seconds"]
+            if span["span"] == "llm_generate":
+                for kind in ("prompt_tokens", "history_tokens", "response_tokens"):
+                    if span["attrs"].get(kind) is not None:
+                        sample[kind] = sample.get(kind, 0) + span["attrs"][kind]
+        sample["stages"].setdefault("end_to_end", seconds)
+        result = turn.get("result")
+        if result:
+            sample["rows"] = result.get("rows")
+            sample["result_bytes"] = result.get("bytes")
+        return sample
+
+    def run(self, users: int, questions_per_user: int, questions=QUESTIONS, think_time: float = 0.0, seed: int = 0):
+        def _user(index):
+            rng = random.Random(seed + index)
+            conversation, samples = Conversation(user=f"user-{index}"), []
+            for _ in range(questions_per_user):
+                samples.append(self.ask(conversation, rng.choice(questions)))
+                if think_time:
+                    time.sleep(rng.uniform(0, 2 * think_time))
+            self.engine.reset(conversation)
+            return samples
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users, thread_name_prefix="bench-user") as pool:
+            samples = [s for user_samples in pool.map(_user, range(users)) for s in user_samples]
+        return samples, time.perf_counter() - started
+
+
+def summarize(samples, wall_seconds, full_prompt_tokens) -> dict:
+    ok = [s for s in samples if not s["error"]]
+    rows = [s["rows"] for s in ok if s.get("rows") is not None]
+    token_stats = {}
+    for kind in ("prompt_tokens", "history_tokens", "response_tokens"):
+        values = [s[kind] for s in samples if s.get(kind) is not None]
+        token_stats[kind] = {"mean": round(float(np.mean(values)), 1), "p50": float(np.percentile(values, 50)), "max": max(values)} if values else {}
+    token_stats["full_prompt_tokens"] = full_prompt_tokens
+    return {
+        "questions": len(samples), "errors": len(samples) - len(ok), "wall_seconds": round(wall_seconds, 3),
+        "throughput_qps": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        "statuses": dict(Counter(s["status"] for s in samples)), "sources": dict(Counter(s["source"] for s in samples if s["source"])),
+        "stages": {stage: percentiles([s["stages"][stage] for s in ok if stage in s["stages"]]) for stage in STAGES},
+        "tokens": token_stats,
+        "rows": {"mean": round(float(np.mean(rows)), 1), "p50": float(np.percentile(rows, 50)), "max": max(rows)} if rows else {},
+        "error_samples": sorted({s["error"] for s in samples if s["error"]})[:10],
+    }
+
+
+def compare(result, baseline, max_regression: float):
+    """Per-stage p50/p95 deltas against an earlier run; returns the stages that regressed beyond `max_regression`."""
+    regressions = []
+    print(f"\n{'stage':<18}{'p50 base':>10}{'p50 now':>10}{'p95 base':>10}{'p95 now':>10}{'Δp95':>8}")
+    for stage, now in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage, {})
+        if not now.get("count") or not base.get("count"):
+            continue
+        delta = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        print(f"{stage:<18}{base['p50_ms']:>10.1f}{now['p50_ms']:>10.1f}{base['p95_ms']:>10.1f}{now['p95_ms']:>10.1f}{delta:>+8.0%}")
+        if delta > max_regression and now["p95_ms"] - base["p95_ms"] > 5:
+            regressions.append(stage)
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    """`python benchmark.py --users 8 --questions 20 -o bench.json [--baseline old.json]`"""
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with a stub LLM and a seeded SQLite sales database.")
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--questions", type=int, default=10, help="questions per user")
+    parser.add_argument("--orders", type=int, default=50_000, help="orders in the seeded dataset (~2.5 lines each)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds before the stub model answers")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--seconds-per-token", type=float, default=0.002, help="simulated generation speed")
+    parser.add_argument("--recordings", help="JSON list of {pattern, reply} replacing the built-in answers")
+    parser.add_argument("--system-prompt", help="prompt template file containing <<SCHEMA_SECTION>>")
+    parser.add_argument("--real-rules", action="store_true", help="use the app's rules template instead of the short stand-in")
+    parser.add_argument("--db-concurrency", type=int, default=4)
+    parser.add_argument("--max-rows", type=int, default=100_000)
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's questions")
+    parser.add_argument("--warmup", type=int, default=2, help="questions run before measuring")
+    parser.add_argument("--sql-cache", action="store_true", help="serve repeated questions from a fresh SQL cache")
+    parser.add_argument("--result-cache", action="store_true", help="serve repeated queries from a fresh result cache")
+    parser.add_argument("--stream", action="store_true", help="stream replies and run the SQL as soon as its block closes")
+    parser.add_argument("--no-governor", action="store_true", help="skip the estimated-plan check")
+    parser.add_argument("--no-rollups", action="store_true", help="send every question to the LLM instead of refreshing and using the rollups")
+    parser.add_argument("--no-routing", action="store_true", help="one model tier for every question (MODEL_ROUTING=0)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("-o", "--output", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="fail when a stage's p95 grows by more than this fraction")
+    args = parser.parse_args(argv)
+
+    db_path = os.path.join(BENCH_DIR, f"sales_{args.orders}_{args.seed}.sqlite3")
+    if not os.path.exists(db_path):
+        print(f"Seeding {db_path} ...", file=sys.stderr)
+        build_dataset(db_path, args.orders, args.seed)
+    template = RULES_TEMPLATE if args.real_rules else _RULES_STANDIN
+    if args.system_prompt:
+        with open(args.system_prompt, encoding="utf-8") as f:
+            template = f.read()
+    model_kwargs = {"latency": args.llm_latency, "jitter": args.llm_jitter, "seconds_per_token": args.seconds_per_token, "seed": args.seed}
+    if args.recordings:
+        sql_model = StubModel.from_recordings(args.recordings, **model_kwargs)
+    else:
+        sql_model = StubModel([(p, f"{e}\n\n```sql\n{s}\n```{VALIDATION_NOTES}") for p, e, s in RECORDED_ANSWERS],
+                              default_reply=f"{DEFAULT_ANSWER[0]}\n\n```sql\n{DEFAULT_ANSWER[1]}\n```{VALIDATION_NOTES}", **model_kwargs)
+    suggestion_model = StubModel(default_reply=SUGGESTIONS_REPLY, **dict(model_kwargs, latency=args.llm_latency / 2))
+
+    # The engine reads these when it is built; the rest of its settings keep their defaults.
+    os.environ.update({"DB_MAX_CONCURRENT": str(args.db_concurrency), "SQL_CACHE_MAX_ENTRIES": "2000" if args.sql_cache else "0",
+                       "RESULT_CACHE_MB": os.getenv("RESULT_CACHE_MB", "512") if args.result_cache else "0",
+                       "MODEL_ROUTING": "0" if args.no_routing else os.getenv("MODEL_ROUTING", "1")})
+    sales_engine.STREAM_SQL = args.stream
+    sales_engine.GOVERN_QUERIES = not args.no_governor
+    sales_engine.USE_ROLLUPS = not args.no_rollups
+    sales_engine.QUERY_LIMITS = dict(sales_engine.QUERY_LIMITS, max_rows=args.max_rows)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix="run_", dir=BENCH_DIR)
+    try:
+        engine = build_engine(open_database(db_path, args.db_concurrency), run_dir, sql_model, suggestion_model, template)
+        full_prompt_tokens = estimate_tokens(engine.prompt()["system_prompt"])
+        rollup_seconds = None
+        if not args.no_rollups:
+            started = time.perf_counter()
+            engine.rollup_router.store.refresh(engine.db_engine, SCHEMA, full=True)
+            rollup_seconds = round(time.perf_counter() - started, 3)
+        bench = Benchmark(engine)
+        warmup = Conversation(user="warmup")
+        for question in QUESTIONS[:args.warmup]:
+            bench.ask(warmup, question)
+        engine.reset(warmup)
+        samples, wall_seconds = bench.run(args.users, args.questions, think_time=args.think_time, seed=args.seed)
+        result = summarize(samples, wall_seconds, full_prompt_tokens)
+        result["memory"] = {"peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+        if args.tracemalloc:
+            result["memory"]["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+            tracemalloc.stop()
+        result["llm_calls"] = {"sql": sql_model.calls, "suggestions": suggestion_model.calls,
+                               "prompt_tokens": sql_model.prompt_tokens + suggestion_model.prompt_tokens}
+        result["engine"] = engine.stats()
+        result["meta"] = {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                          "platform": platform.platform(), "cpus": os.cpu_count(), "rollup_refresh_seconds": rollup_seconds, "args": vars(args)}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"{result['questions']} questions, {result['errors']} errors, {result['throughput_qps']} q/s, "
+              f"end-to-end p50 {result['stages']['end_to_end'].get('p50_ms')} ms / p95 {result['stages']['end_to_end'].get('p95_ms')} ms -> {args.output}")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        if regressions:
+            print(f"Regressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
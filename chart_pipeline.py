@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x, y, threshold: int):
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual shape of a series."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indices = [0]
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        area = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.nanargmax(area)) if len(area) and not np.all(np.isnan(area)) else start
+        indices.append(prev)
+    indices.append(n - 1)
+    return np.asarray(indices)
+
+
+def _as_numeric(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("int64")
+    return pd.to_numeric(series, errors="coerce")
+
+
+def _group_keys(x_col, color_col):
+    return [x_col] + ([color_col] if color_col and color_col != x_col else [])
+
+
+def _aggregate(df, x_col, y_col, color_col):
+    return df.groupby(_group_keys(x_col, color_col), observed=True, sort=False, dropna=False)[y_col].sum().reset_index()
+
+
+def prepare_chart_data(df, chart_type: str, x_col, y_col, color_col=None, max_points: int = 5000, webgl_points: int = 200_000):
+    """Shrinks a result to what the browser can draw.
+
+    Returns (plot_df, notes, use_webgl). Below `max_points` rows the frame is passed through
+    untouched. Above it, bars and pies are aggregated by X/color, lines and areas are
+    LTTB-downsampled per color series, boxes are sampled per X group, and scatters switch to
+    WebGL, falling back to 2-D binning beyond `webgl_points`."""
+    rows = len(df)
+    if rows <= max_points:
+        return df, [], False
+    notes = []
+    if chart_type in ("Bar", "Pie"):
+        keys = [x_col] if chart_type == "Pie" else _group_keys(x_col, color_col)
+        plot_df = df.groupby(keys, observed=True, sort=False, dropna=False)[y_col].sum().reset_index()
+        if chart_type == "Pie" and len(plot_df) > 20:
+            plot_df = plot_df.sort_values(y_col, ascending=False)
+            other = pd.DataFrame({x_col: ["Other"], y_col: [plot_df[y_col].iloc[19:].sum()]})
+            plot_df = pd.concat([plot_df.head(19), other], ignore_index=True)
+        notes.append(f"Aggregated {rows:,} rows to {len(plot_df):,} by summing {y_col}.")
+        return plot_df, notes, False
+    if chart_type in ("Line", "Area"):
+        x_numeric = _as_numeric(df[x_col])
+        if x_numeric.isna().all():
+            # Categorical X: points per category are summed, as the bar chart would.
+            plot_df = _aggregate(df, x_col, y_col, color_col)
+            notes.append(f"Aggregated {rows:,} rows to {len(plot_df):,} by summing {y_col} per {x_col}.")
+            return plot_df, notes, True
+        groups = [g for _, g in df.groupby(color_col, observed=True, sort=False)] if color_col else [df]
+        per_series = max(max_points // max(len(groups), 1), 3)
+        parts = []
+        for group in groups:
+            group = group.assign(_x=_as_numeric(group[x_col])).dropna(subset=["_x"]).sort_values("_x")
+            keep = lttb_indices(group["_x"].to_numpy(), pd.to_numeric(group[y_col], errors="coerce").fillna(0).to_numpy(), per_series)
+            parts.append(group.iloc[keep].drop(columns="_x"))
+        plot_df = pd.concat(parts, ignore_index=True)
+        notes.append(f"Downsampled {rows:,} points to {len(plot_df):,} (LTTB per series).")
+        return plot_df, notes, True
+    if chart_type == "Box":
+        # Sampled by row position so the grouping column stays in the frame (groupby.apply drops it in pandas 3).
+        codes = df.groupby(x_col, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+        groups = np.split(np.argsort(codes, kind="stable"), np.cumsum(np.bincount(codes))[:-1])
+        per_group = max(max_points // max(len(groups), 1), 50)
+        rng = np.random.default_rng(0)
+        keep = np.concatenate([rng.choice(positions, size=min(len(positions), per_group), replace=False) for positions in groups])
+        plot_df = df.iloc[np.sort(keep)]
+        notes.append(f"Box plots are drawn from a sample of {len(plot_df):,} of {rows:,} rows, stratified by {x_col}.")
+        return plot_df.reset_index(drop=True), notes, False
+    if chart_type == "Scatter":
+        if rows <= webgl_points:
+            notes.append(f"Drawing {rows:,} points with WebGL.")
+            return df, notes, True
+        x_numeric, y_numeric = _as_numeric(df[x_col]), pd.to_numeric(df[y_col], errors="coerce")
+        if x_numeric.isna().all():
+            plot_df = _aggregate(df, x_col, y_col, color_col)
+            notes.append(f"Aggregated {rows:,} rows to {len(plot_df):,} by summing {y_col} per {x_col}.")
+            return plot_df, notes, True
+        bins = int(np.sqrt(max_points))
+        binned = pd.DataFrame({"x_bin": pd.cut(x_numeric, bins), "y_bin": pd.cut(y_numeric, bins)})
+        counts = binned.groupby(["x_bin", "y_bin"], observed=True).size().reset_index(name="points")
+        plot_df = pd.DataFrame({x_col: counts["x_bin"].map(lambda iv: iv.mid).astype("float64"),
+                                y_col: counts["y_bin"].map(lambda iv: iv.mid).astype("float64"), "points": counts["points"]})
+        if pd.api.types.is_datetime64_any_dtype(df[x_col]):
+            plot_df[x_col] = plot_df[x_col].round().astype("int64").astype(df[x_col].dtype)
+        notes.append(f"Binned {rows:,} points into {len(plot_df):,} cells; marker color shows the point count.")
+        return plot_df, notes, True
+    return df, notes, False
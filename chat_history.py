@@ -0,0 +1,116 @@
+import html
+import re
+
+from schema_index import estimate_tokens
+
+# Metric names from Part 2-D of the system prompt, used to describe what older turns established.
+METRIC_TERMS = [
+    "gross sales", "unique customers", "order count", "margin loss", "margin %", "margin", "auction duration",
+    "gcpm", "pnp", "new customers", "cash sales", "quantity", "target", "discount",
+]
+_SQL_BLOCK_RE = re.compile(r'<code class="language-sql">(.*?)</code>', re.DOTALL)
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+(?:\w+\.)?(\w+)", re.IGNORECASE)
+_FILTER_RE = re.compile(r"\b\w+\.\w+\s*(?:>=|<=|<>|!=|=|<|>|\bnot\s+in\b|\bin\b|\bnot\s+like\b|\blike\b)\s*(?:'[^']*'|\([^)]*\)|-?\d+(?:\.\d+)?)", re.IGNORECASE)
+_STATUS_PREFIXES = ("✅", "❌", "⛔", "⚠️", "🛑", "⚡", "🔁")
+
+
+def split_turns(chat_messages, new_question=None):
+    """Groups chat messages into turns of {question, explanation, sql, outcome}, without HTML payloads."""
+    messages = [m for m in chat_messages if m["role"] in ("user", "assistant")]
+    # The pending question is already appended to the chat; it is sent separately, not as history.
+    if new_question is not None and messages and messages[-1]["role"] == "user" and messages[-1]["content"] == new_question:
+        messages = messages[:-1]
+    turns = []
+    for msg in messages:
+        content = msg["content"]
+        if msg["role"] == "user":
+            turns.append({"question": content, "explanation": "", "sql": None, "outcome": ""})
+            continue
+        if not turns:
+            continue  # greeting
+        turn = turns[-1]
+        if content.startswith(_STATUS_PREFIXES):
+            turn["outcome"] = content
+            continue
+        sql_match = _SQL_BLOCK_RE.search(content)
+        if sql_match:
+            turn["sql"] = html.unescape(sql_match.group(1)).strip()
+        turn["explanation"] = content.split("\n\n<")[0].strip()
+    return turns
+
+
+def _render_turn(turn, include_sql):
+    reply = turn["explanation"]
+    if include_sql and turn["sql"]:
+        reply = f"{reply}\n\n```sql\n{turn['sql']}\n```"
+    if turn["outcome"].startswith(("❌", "⛔", "🛑")):
+        reply = f"{reply}\n\n{turn['outcome']}"
+    return [{"role": "user", "parts": [turn["question"]]}, {"role": "model", "parts": [reply.strip() or "(no reply)"]}]
+
+
+def summarize_turns(turns, max_tokens: int = 300) -> str:
+    """Compact description of older turns: the questions, tables, filters and metrics they established."""
+    tables, filters, metrics = [], [], []
+    for turn in turns:
+        sql = turn["sql"] or ""
+        for table in _TABLE_RE.findall(sql):
+            if table not in tables and not table.lower().startswith("cte"):
+                tables.append(table)
+        for flt in _FILTER_RE.findall(sql):
+            flt = re.sub(r"\s+", " ", flt)
+            if flt not in filters:
+                filters.append(flt)
+        text = turn["question"].lower()
+        for term in METRIC_TERMS:
+            if term in text and term not in metrics:
+                metrics.append(term)
+    lines = ["Summary of the earlier conversation:"]
+    if metrics:
+        lines.append(f"- Metrics discussed: {', '.join(metrics)}")
+    if tables:
+        lines.append(f"- Tables used: {', '.join(tables)}")
+    if filters:
+        lines.append(f"- Filters established: {'; '.join(filters[-10:])}")
+    questions = [f'"{turn["question"]}"' for turn in turns]
+    # Newest questions are the most useful ones; drop the oldest until the summary fits.
+    while questions:
+        candidate = "\n".join(lines + [f"- Questions asked: {'; '.join(questions)}"])
+        if estimate_tokens(candidate) <= max_tokens:
+            return candidate
+        questions.pop(0)
+    return "\n".join(lines)
+
+
+class HistoryManager:
+    """Builds Gemini chat history within a token budget: recent turns verbatim, older ones summarized."""
+
+    def __init__(self, token_budget: int = 2000, keep_turns: int = 4, summary_tokens: int = 300):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_tokens = summary_tokens
+
+    def build(self, chat_messages, new_question=None):
+        """Returns (gemini_history, stats)."""
+        turns = split_turns(chat_messages, new_question)
+        split_at = max(len(turns) - self.keep_turns, 0)
+        older, recent = turns[:split_at], turns[split_at:]
+
+        def _render(kept):
+            # Only the latest SQL is worth resending: follow-ups like "same but by channel" edit it.
+            rendered = []
+            for i, turn in enumerate(kept):
+                rendered += _render_turn(turn, include_sql=i == len(kept) - 1)
+            return rendered
+
+        history = _render(recent)
+        budget = self.token_budget - (self.summary_tokens if older else 0)
+        while len(recent) > 1 and sum(estimate_tokens(p["parts"][0]) for p in history) > budget:
+            older.append(recent.pop(0))
+            budget = self.token_budget - self.summary_tokens
+            history = _render(recent)
+        if older:
+            summary = summarize_turns(older, self.summary_tokens)
+            history = [{"role": "user", "parts": [summary]}, {"role": "model", "parts": ["Understood. I will keep these filters, tables and metrics in mind for follow-up questions."]}] + history
+        stats = {"turns": len(turns), "verbatim_turns": len(recent), "summarized_turns": len(older),
+                 "history_tokens": sum(estimate_tokens(p["parts"][0]) for p in history)}
+        return history, stats
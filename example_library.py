@@ -0,0 +1,137 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sql_cache import normalize_question, question_template
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "examples.sqlite3")
+
+_WORD_RE = re.compile(r"<\w+>|[a-z0-9%]+")
+_STOPWORDS = {"the", "a", "an", "of", "for", "in", "on", "by", "and", "to", "is", "are", "was", "were", "what", "show", "me",
+              "give", "get", "list", "all", "with", "please", "can", "you", "i", "we", "our", "do", "did", "how", "which"}
+
+
+def tokenize(question: str) -> list:
+    """Word unigrams and bigrams of the literal-free question: "FY2024" and "FY2023" look alike."""
+    words = [w for w in _WORD_RE.findall(question_template(question)[0]) if w not in _STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class ExampleLibrary:
+    """Question -> SQL pairs that ran successfully, retrieved with BM25 as few-shot examples.
+
+    Pairs are stored in SQLite next to the SQL cache; the BM25 postings are kept in memory and
+    updated on every add. Verified pairs (confirmed by a user) get `verified_boost` on their score
+    and are never evicted in favour of unverified ones."""
+
+    def __init__(self, path: str = DEFAULT_LIBRARY_PATH, max_entries: int = 5000, k1: float = 1.2, b: float = 0.75, verified_boost: float = 1.5):
+        self.path = path
+        self.max_entries = max_entries
+        self.k1 = k1
+        self.b = b
+        self.verified_boost = verified_boost
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS examples (
+                    key TEXT PRIMARY KEY, question TEXT, sql TEXT, verified INTEGER, successes INTEGER, created REAL, last_used REAL
+                )""")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outcomes (grp TEXT PRIMARY KEY, attempts INTEGER, answered INTEGER, answer_attempts INTEGER)")
+        self._docs = {}  # key -> (question, sql, verified, term counts, length)
+        self._postings = defaultdict(set)
+        for key, question, sql, verified in self._conn.execute("SELECT key, question, sql, verified FROM examples"):
+            self._index(key, question, sql, bool(verified))
+
+    def _index(self, key, question, sql, verified):
+        self._unindex(key)
+        terms = Counter(tokenize(question))
+        self._docs[key] = (question, sql, verified, terms, sum(terms.values()))
+        for term in terms:
+            self._postings[term].add(key)
+
+    def _unindex(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc[3]:
+            self._postings[term].discard(key)
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def add(self, question: str, sql: str, verified: bool = False):
+        """Records a pair that ran successfully; a later success with different SQL replaces it unless it was verified."""
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT sql, verified, successes, created FROM examples WHERE key = ?", (key,)).fetchone()
+            if row and row[1] and not verified and row[0] != sql:
+                return
+            verified = verified or bool(row and row[1])
+            successes = row[2] + 1 if row and row[0] == sql else 1
+            self._conn.execute("INSERT OR REPLACE INTO examples VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (key, question.strip(), sql, int(verified), successes, row[3] if row else now, now))
+            self._index(key, question.strip(), sql, verified)
+            for (evicted,) in self._conn.execute("SELECT key FROM examples ORDER BY verified DESC, last_used DESC LIMIT -1 OFFSET ?", (self.max_entries,)).fetchall():
+                self._conn.execute("DELETE FROM examples WHERE key = ?", (evicted,))
+                self._unindex(evicted)
+
+    def search(self, question: str, k: int = 3, min_score: float = 1.0) -> list:
+        """Up to `k` of {question, sql, verified, score}, best first."""
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_length = sum(doc[4] for doc in self._docs.values()) / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize(question)):
+                keys = self._postings.get(term)
+                if not keys:
+                    continue
+                idf = math.log(1 + (n_docs - len(keys) + 0.5) / (len(keys) + 0.5))
+                for key in keys:
+                    tf, length = self._docs[key][3][term], self._docs[key][4]
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            results = []
+            for key, score in scores.items():
+                question_text, sql, verified = self._docs[key][:3]
+                score *= self.verified_boost if verified else 1.0
+                if score >= min_score:
+                    results.append({"question": question_text, "sql": sql, "verified": verified, "score": round(score, 2)})
+        return sorted(results, key=lambda r: r["score"], reverse=True)[:k]
+
+    def record_attempt(self, with_examples: bool):
+        self._bump("with_examples" if with_examples else "without_examples", attempts=1)
+
+    def record_answer(self, with_examples: bool, attempts: int):
+        """A question was answered after `attempts` tries (rephrasings included) in its session."""
+        self._bump("with_examples" if with_examples else "without_examples", answered=1, answer_attempts=attempts)
+
+    def _bump(self, group, attempts=0, answered=0, answer_attempts=0):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO outcomes VALUES (?, 0, 0, 0)", (group,))
+            self._conn.execute("UPDATE outcomes SET attempts = attempts + ?, answered = answered + ?, answer_attempts = answer_attempts + ? WHERE grp = ?",
+                               (attempts, answered, answer_attempts, group))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"examples": len(self._docs), "verified": sum(1 for doc in self._docs.values() if doc[2])}
+            for group, attempts, answered, answer_attempts in self._conn.execute("SELECT grp, attempts, answered, answer_attempts FROM outcomes"):
+                stats[group] = {"attempts": attempts, "answered": answered, "success_rate": answered / attempts if attempts else 0.0,
+                                "avg_attempts": answer_attempts / answered if answered else 0.0}
+        return stats
+
+
+def format_examples(examples) -> str:
+    """Few-shot block sent ahead of the question."""
+    if not examples:
+        return ""
+    blocks = [f"Question: {e['question']}\n```sql\n{e['sql']}\n```" for e in examples]
+    return ("Previously answered questions that ran correctly against this database (adapt them; do not copy blindly):\n\n" +
+            "\n\n".join(blocks) + "\n\nNow answer this question:\n")
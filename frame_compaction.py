@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRING = pd.StringDtype("pyarrow")
+except ImportError:
+    ARROW_STRING = None
+
+
+def _is_text(series) -> bool:
+    if pd.api.types.is_string_dtype(series) and not pd.api.types.is_object_dtype(series):
+        return True
+    return pd.api.types.is_object_dtype(series) and pd.api.types.infer_dtype(series, skipna=True) == "string"
+
+
+def _fits_float32(values, decimals) -> bool:
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return True
+    narrowed = finite.astype("float32").astype("float64")
+    return bool(np.all(np.round(narrowed, decimals) == np.round(finite, decimals)))
+
+
+def compact_frame(df, category_ratio: float = 0.5, category_max: int = 1000, min_rows: int = 64, float_decimals: int = 2):
+    """Smaller dtypes for a fetched result: (compacted frame, report).
+
+    - float64 -> float32 when every value still rounds to the same `float_decimals` (money amounts
+      up to ~100k do, large totals stay float64);
+    - integers -> the smallest integer type holding their range;
+    - text with at most `category_ratio` * rows (and `category_max`) distinct values -> category,
+      other text kept in object columns -> Arrow-backed strings.
+    Frames under `min_rows` rows are returned as they are. `df.attrs` are kept."""
+    before = int(df.memory_usage(deep=True).sum())
+    report = {"before_bytes": before, "after_bytes": before, "columns": {}}
+    if len(df) < min_rows:
+        return df, report
+    columns = {}  # position -> compacted column; SQL results may repeat a column name
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if series.dtype == "float64":
+            if _fits_float32(series.to_numpy(), float_decimals):
+                columns[position] = series.astype("float32")
+        elif pd.api.types.is_integer_dtype(series) and not pd.api.types.is_extension_array_dtype(series):
+            downcast = pd.to_numeric(series, downcast="integer")
+            if downcast.dtype != series.dtype:
+                columns[position] = downcast
+        elif _is_text(series):
+            distinct = series.nunique(dropna=True)
+            if distinct <= min(category_max, category_ratio * len(series)):
+                columns[position] = series.astype("category")
+            elif pd.api.types.is_object_dtype(series) and ARROW_STRING is not None:
+                columns[position] = series.astype(ARROW_STRING)
+    if not columns:
+        return df, report
+    compacted = df.copy(deep=False)
+    for position, column in columns.items():
+        compacted.isetitem(position, column)
+    compacted.attrs = dict(df.attrs)
+    report["columns"] = {str(df.columns[position]): f"{df.dtypes.iloc[position]} -> {column.dtype}" for position, column in columns.items()}
+    report["after_bytes"] = int(compacted.memory_usage(deep=True).sum())
+    return compacted, report
@@ -0,0 +1,198 @@
+import os
+import re
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from sql_generation import SQL_MODEL_NAME, get_sql_model, get_suggestion_model
+
+TIERS = ("fast", "standard", "strong")
+DEFAULT_MODELS = {
+    "fast": os.getenv("SQL_MODEL_FAST", "gemini-2.5-flash-lite"),
+    "standard": os.getenv("SQL_MODEL_STANDARD", SQL_MODEL_NAME),
+    "strong": os.getenv("SQL_MODEL_STRONG", "gemini-2.5-pro"),
+}
+# Metrics from Part 2-D of the system prompt: plain aggregates, and formulas that usually need extra joins or CTEs.
+SIMPLE_METRICS = ["gross sales", "sales", "revenue", "quantity", "qty", "volume", "order count", "orders", "unique customers", "customers", "discount"]
+FORMULA_METRICS = ["margin loss", "margin %", "margin", "gcpm", "pnp", "auction duration", "new customers", "customer acquisition", "cash sales", "target"]
+ANALYSIS_CUES = [r"\bcompare|\bcomparison|\bvs\.?\b|\bversus\b", r"\bgrowth\b|\bchange\b|\bincrease\b|\bdecline\b", r"\btrend\b|\bover time\b",
+                 r"week[- ]over[- ]week|month[- ]over[- ]month|year[- ]over[- ]year|\byoy\b|\bmom\b|\bwow\b", r"\bshare\b|\bcontribution\b|\bpercent|%",
+                 r"\brank|\btop \d+ .* (?:by|per|in each)\b|\bper each\b|\bfor each\b", r"\bcumulative\b|\brunning total\b|\baverage of\b", r"\bclassify\b|\bcategori[sz]e\b"]
+# Execution errors a better query cannot fix: statement/login timeouts (HYT00/HYT01), cancelled operations
+# (HY008), the fair queue turning the query away, pool exhaustion, lost or refused connections (08xxx),
+# failed logins (28000) and deadlocks (40001, 1205). Specific phrases and codes only: an error such as
+# "Invalid column name 'CancelDate'" is a SQL mistake worth a repair.
+_TRANSIENT_ERROR_RE = re.compile(
+    r"statement timed out|query timeout expired|login timeout expired|\bHYT0[01]\b|operation cancell?ed|\bHY008\b|"
+    r"database is busy|no database slot|too many queries|QueuePool limit|connection timed out|"
+    r"communication link failure|\b08(?:S01|001|004)\b|login failed|\b28000\b|deadlock|\b40001\b|\b1205\b", re.IGNORECASE)
+_DATE_NAME_RE = re.compile(r"date|day|week|month|year|quarter|period|time", re.IGNORECASE)
+_ID_NAME_RE = re.compile(r"id$|code$|number$|no$", re.IGNORECASE)
+
+
+def _find_terms(text, terms) -> list:
+    """Terms present in `text`, longest first, each match consumed ("margin loss" is not also "margin")."""
+    found = []
+    for term in sorted(terms, key=len, reverse=True):
+        pattern = r"\b" + re.escape(term).rstrip("%") + (r"\s*%" if term.endswith("%") else r"\b")
+        if re.search(pattern, text):
+            found.append(term)
+            text = re.sub(pattern, " ", text)
+    return found
+
+
+def complexity(question: str, matched_tables=(), history_turns: int = 0) -> dict:
+    """Signals of how hard a question is to answer in SQL, and their score.
+
+    Each table beyond two adds 1, each plain metric beyond the first 1, each formula metric 3,
+    each kind of analysis (comparison, growth, share, ranking...) 2, and a conversation of three
+    or more earlier turns 1 (follow-ups then depend on what came before)."""
+    text = f" {question.lower()} "
+    formulas = _find_terms(text, FORMULA_METRICS)
+    metrics = _find_terms(re.sub("|".join(map(re.escape, formulas)) or r"(?!)", " ", text), SIMPLE_METRICS)
+    cues = [cue for cue in ANALYSIS_CUES if re.search(cue, text)]
+    score = max(len(matched_tables) - 2, 0) + max(len(metrics) - 1, 0) + 3 * len(formulas) + 2 * len(cues) + (1 if history_turns >= 3 else 0)
+    return {"score": score, "tables": len(matched_tables), "metrics": metrics, "formulas": formulas, "analysis": len(cues), "history_turns": history_turns}
+
+
+def _label(column) -> str:
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", str(column)).replace("_", " ").strip().lower()
+
+
+def template_follow_ups(question: str, df, limit: int = 3) -> list:
+    """Follow-up questions built from the result's column types: a time column suggests a period
+    comparison, a text column a ranking, a lone measure a breakdown. No LLM call."""
+    if df is None or df.empty:
+        return []
+    dates, dimensions, measures = [], [], []
+    for position in range(df.shape[1]):
+        name, series = df.columns[position], df.iloc[:, position]
+        if pd.api.types.is_datetime64_any_dtype(series) or (_DATE_NAME_RE.search(str(name)) and not pd.api.types.is_float_dtype(series)):
+            dates.append(name)
+        elif pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+            dimensions.append(name)
+        elif not _ID_NAME_RE.search(str(name)):
+            measures.append(name)
+    measure = _label(measures[0]) if measures else "sales"
+    present = " ".join(_label(c) for c in df.columns) + " " + question.lower()
+    suggestions = []
+    if dates:
+        suggestions.append(f"How does {measure} compare with the same period last year?")
+    if dimensions:
+        dimension = _label(dimensions[0])
+        suggestions.append(f"Which {dimension} had the lowest {measure}?" if len(df) > 1 else f"What is the {measure} trend by month for this {dimension}?")
+        if len(df) > 10:
+            suggestions.append(f"Show only the top 10 {dimension} values by {measure}")
+    elif not dates:
+        suggestions.append(f"What is the {measure} trend by month?")
+    for breakdown in ("sales channel", "department", "product"):
+        if breakdown.split()[-1] not in present:
+            suggestions.append(f"Can you break {measure} down by {breakdown}?")
+    if len(measures) > 1:
+        suggestions.append(f"How does {measure} relate to {_label(measures[1])}?")
+    return list(dict.fromkeys(suggestions))[:limit]
+
+
+def is_repairable(error) -> bool:
+    """Whether a failed execution is worth a new query: SQL errors yes; timeouts, cancels and a busy database no."""
+    return bool(error) and not _TRANSIENT_ERROR_RE.search(str(error))
+
+
+class ModelRouter:
+    """Sends each SQL request to a model tier by complexity, and keeps per-route latency and success rates.
+
+    Questions scoring up to `simple_max` go to the fast tier and get template follow-ups instead of
+    an LLM call; up to `standard_max` to the standard tier; the rest to the strong tier. A query that
+    fails to execute is retried once on the strong tier (see `escalate`). `clients` maps a tier to a
+    callable(system_prompt) -> model (e.g. a StubModel's `with_system_instruction`); tiers without one
+    use the Gemini model named in `models`. A tier with neither (e.g. SQL_MODEL_FAST="") falls back to
+    the nearest tier that has one, the stronger on a tie. With `enabled` False every request takes
+    the standard tier and LLM follow-ups."""
+
+    def __init__(self, models=None, clients=None, suggestion_client=None, simple_max: int = 1, standard_max: int = 4,
+                 enabled: bool = True, max_samples: int = 1000):
+        self.models = dict(DEFAULT_MODELS, **(models or {}))
+        self.clients = clients or {}
+        self.suggestion_client = suggestion_client
+        self.simple_max = simple_max
+        self.standard_max = standard_max
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(simple_max=int(os.getenv("ROUTE_SIMPLE_MAX_SCORE", "1")), standard_max=int(os.getenv("ROUTE_STANDARD_MAX_SCORE", "4")),
+                   enabled=os.getenv("MODEL_ROUTING", "1") == "1", **kwargs)
+
+    def route(self, question, matched_tables=(), history_turns: int = 0) -> dict:
+        """{"tier", "model", "suggestions" ("template" or "llm"), "escalated", "signals"} for a question."""
+        signals = complexity(question, matched_tables, history_turns)
+        simple = self.enabled and signals["score"] <= self.simple_max
+        if not self.enabled:
+            tier = "standard"
+        elif simple:
+            tier = "fast"
+        else:
+            tier = "standard" if signals["score"] <= self.standard_max else "strong"
+        tier = self.available_tier(tier)
+        return {"tier": tier, "model": self.models.get(tier), "suggestions": "template" if simple else "llm", "escalated": False, "signals": signals}
+
+    def escalate(self, route, error):
+        """The strong-tier route to retry a query that failed with `error`, or None (not repairable, already
+        escalated, or no tier stronger than the one that failed)."""
+        if not self.enabled or route is None or route["escalated"] or route["tier"] not in TIERS or not is_repairable(error):
+            return None
+        strong = self.available_tier("strong")
+        if TIERS.index(strong) <= TIERS.index(route["tier"]):
+            return None
+        return dict(route, tier=strong, model=self.models.get(strong), escalated=True)
+
+    def available_tier(self, tier):
+        """`tier` if it has a client or a model name, else the nearest tier that does (the stronger on a tie)."""
+        position = TIERS.index(tier)
+        for candidate in sorted(TIERS, key=lambda t: (abs(TIERS.index(t) - position), -TIERS.index(t))):
+            if self.clients.get(candidate) is not None or self.models.get(candidate):
+                return candidate
+        raise ValueError("no SQL model is configured for any tier")
+
+    def model(self, route, system_prompt):
+        client = self.clients.get(route["tier"])
+        return client(system_prompt) if client is not None else get_sql_model(system_prompt, route["model"])
+
+    def suggestion_model(self):
+        # Three short strings do not need more than the fast tier.
+        if self.suggestion_client is not None:
+            return self.suggestion_client
+        return get_suggestion_model((self.models.get(self.available_tier("fast")) if self.enabled else None) or SQL_MODEL_NAME)
+
+    @staticmethod
+    def name(route) -> str:
+        return f"sql:{route['tier']}" + (" (escalated)" if route["escalated"] else "")
+
+    def record(self, name, seconds=None, ok=None):
+        """Adds a latency sample and/or an outcome to a route's statistics."""
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "ok": 0, "failed": 0, "seconds": deque(maxlen=self.max_samples)})
+            if seconds is not None:
+                stats["calls"] += 1
+                stats["seconds"].append(seconds)
+            if ok is not None:
+                stats["ok" if ok else "failed"] += 1
+
+    def stats(self) -> dict:
+        """Per route: calls, ok, failed, success_rate and latency p50/p95 in ms."""
+        with self._lock:
+            snapshot = {name: dict(stats, seconds=list(stats["seconds"])) for name, stats in self._stats.items()}
+        rows = {}
+        for name, stats in sorted(snapshot.items()):
+            latencies = np.asarray(stats["seconds"]) * 1000
+            outcomes = stats["ok"] + stats["failed"]
+            rows[name] = {"calls": stats["calls"], "ok": stats["ok"], "failed": stats["failed"], "success_rate": stats["ok"] / outcomes if outcomes else None,
+                          "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+                          "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None}
+        return rows
+
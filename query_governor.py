@@ -0,0 +1,185 @@
+import math
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+from result_cache import normalize_sql
+
+_SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+_SCAN_OPS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+_ROW_LIMIT_RE = re.compile(r"\btop\s*\(?\s*\d+|\boffset\b.+\bfetch\b|\blimit\s+\d+", re.DOTALL)
+_TABLE_REF_RE = re.compile(r"(?:\bfrom|\bjoin|,)\s*((?:[\w\[\]\"]+\.)*[\w\[\]\"]+)(?:\s+(?:as\s+)?(?!(?:from|where|on|join|inner|left|right|full|cross|outer|group|order|with|union|having|limit|as)\b)(\w+))?")
+
+
+def _base_name(name: str) -> str:
+    return name.split(".")[-1].strip('[]"').lower()
+
+
+def table_row_estimates(snapshot) -> dict:
+    """{table name (lower-case, unqualified): row estimate} from a schema snapshot."""
+    if not snapshot:
+        return {}
+    return {_base_name(name): t["row_estimate"] for name, t in snapshot["tables"].items() if t.get("row_estimate") is not None}
+
+
+def _mssql_plan(raw_conn, sql, table_rows):
+    cursor = raw_conn.cursor()
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        cursor.execute(sql)
+        documents = []
+        while True:
+            if cursor.description:
+                documents.extend(row[0] for row in cursor.fetchall())
+            if not cursor.nextset():
+                break
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+    plan = {"estimated_rows": 0.0, "estimated_cost": 0.0, "scans": [], "has_top": False, "no_join_predicate": False}
+    for document in documents:
+        root = ET.fromstring(document)
+        for stmt in root.iterfind(".//sp:StmtSimple", _SHOWPLAN_NS):
+            plan["estimated_rows"] = max(plan["estimated_rows"], float(stmt.get("StatementEstRows", 0)))
+            plan["estimated_cost"] += float(stmt.get("StatementSubTreeCost", 0))
+        for relop in root.iterfind(".//sp:RelOp", _SHOWPLAN_NS):
+            if relop.get("PhysicalOp") == "Top":
+                plan["has_top"] = True
+            if relop.find("sp:Warnings[@NoJoinPredicate='true']", _SHOWPLAN_NS) is not None:
+                plan["no_join_predicate"] = True
+            if relop.get("PhysicalOp") in _SCAN_OPS:
+                obj = relop.find(".//sp:Object", _SHOWPLAN_NS)
+                if obj is not None and obj.get("Table"):
+                    table = _base_name(obj.get("Table"))
+                    rows = relop.get("TableCardinality") or relop.get("EstimatedRowsRead") or table_rows.get(table)
+                    plan["scans"].append({"table": table, "rows": None if rows is None else int(float(rows))})
+    return plan
+
+
+def _sqlite_plan(raw_conn, sql, table_rows):
+    # SQLite reports neither costs nor cardinalities: full scans are sized from the schema's row
+    # estimates, and only a cross join gets a row estimate (the product of the scanned tables).
+    aliases = {}
+    for table, alias in _TABLE_REF_RE.findall(normalize_sql(sql)):
+        aliases[_base_name(table)] = _base_name(table)
+        if alias:
+            aliases[alias] = _base_name(table)
+    cursor = raw_conn.cursor()
+    details = [row[-1] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+    cursor.close()
+    plan = {"estimated_rows": None, "estimated_cost": None, "scans": [], "has_top": False, "no_join_predicate": False}
+    for detail in details:
+        match = re.match(r"SCAN (\w+)", detail)
+        if match and match.group(1).lower() in aliases:
+            table = aliases[match.group(1).lower()]
+            plan["scans"].append({"table": table, "rows": table_rows.get(table)})
+    searches = sum(detail.startswith("SEARCH") for detail in details)
+    plan["no_join_predicate"] = len(plan["scans"]) > 1 and not searches
+    known = [scan["rows"] for scan in plan["scans"] if scan["rows"] is not None]
+    if plan["no_join_predicate"] and known:
+        plan["estimated_rows"] = float(math.prod(known))
+    return plan
+
+
+_PLANNERS = {"mssql": _mssql_plan, "sqlite": _sqlite_plan}
+
+
+class QueryGovernor:
+    """Pre-flight check of generated SQL against its estimated execution plan.
+
+    `check(sql)` returns a plan summary whose "verdict" is "allow", "confirm" or "block", with
+    the reasons behind it. Verdicts are cached per normalized SQL for `ttl_seconds`. A plan that
+    cannot be fetched (unsupported dialect, invalid SQL) is allowed and left to execution to report."""
+
+    def __init__(self, engine, table_rows=None, big_table_rows: int = 1_000_000, confirm_cost: float = 50, block_cost: float = 1000,
+                 confirm_rows: int = 1_000_000, block_rows: int = 100_000_000, ttl_seconds: float = 3600, max_entries: int = 512):
+        self.engine = engine
+        self.table_rows = table_rows or {}
+        self.big_table_rows = big_table_rows
+        self.confirm_cost = confirm_cost
+        self.block_cost = block_cost
+        self.confirm_rows = confirm_rows
+        self.block_rows = block_rows
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._verdicts = OrderedDict()  # normalized sql -> (summary, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {"checks": 0, "cache_hits": 0, "allow": 0, "confirm": 0, "block": 0, "errors": 0, "plan_seconds": 0.0}
+
+    def _judge(self, plan, sql):
+        has_top = plan["has_top"] or bool(_ROW_LIMIT_RE.search(normalize_sql(sql)))
+        rows, cost = plan["estimated_rows"], plan["estimated_cost"]
+        big_scans = [s for s in plan["scans"] if (s["rows"] or 0) >= self.big_table_rows]
+        block, confirm = [], []
+        if plan["no_join_predicate"]:
+            (block if big_scans else confirm).append("Join without a join predicate (cross join)" + (f" involving {', '.join(sorted({s['table'] for s in big_scans}))}" if big_scans else ""))
+        if cost is not None and cost >= self.block_cost:
+            block.append(f"Estimated cost {cost:,.0f} exceeds the limit of {self.block_cost:,.0f}")
+        elif cost is not None and cost >= self.confirm_cost:
+            confirm.append(f"Estimated cost {cost:,.0f} is above {self.confirm_cost:,.0f}")
+        if rows is not None and rows >= self.block_rows:
+            block.append(f"Estimated {rows:,.0f} rows exceeds the limit of {self.block_rows:,}")
+        elif rows is not None and rows >= self.confirm_rows and not has_top:
+            confirm.append(f"Estimated {rows:,.0f} rows with no TOP (N)")
+        if big_scans and not has_top:
+            confirm.extend(f"Full scan of {s['table']} (~{s['rows']:,} rows) with no TOP (N)" for s in big_scans)
+        verdict = "block" if block else "confirm" if confirm else "allow"
+        return dict(plan, has_top=has_top, verdict=verdict, reasons=block + confirm)
+
+    def check(self, sql: str) -> dict:
+        key = normalize_sql(sql)
+        with self._lock:
+            self._stats["checks"] += 1
+            entry = self._verdicts.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._verdicts.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return dict(entry[0], cached=True)
+        started = time.perf_counter()
+        planner = _PLANNERS.get(self.engine.dialect.name)
+        summary = {"estimated_rows": None, "estimated_cost": None, "scans": [], "has_top": False, "no_join_predicate": False,
+                   "verdict": "allow", "reasons": [], "error": None}
+        if planner is None:
+            summary["error"] = f"No plan support for {self.engine.dialect.name}"
+        else:
+            raw_conn = None
+            try:
+                raw_conn = self.engine.raw_connection()
+                summary = dict(self._judge(planner(raw_conn, sql, self.table_rows), sql), error=None)
+            except Exception as e:
+                summary["error"] = str(e)
+                # A failed statement may leave SHOWPLAN switched on; never return that connection to the pool.
+                if raw_conn is not None:
+                    raw_conn.invalidate()
+            finally:
+                if raw_conn is not None:
+                    raw_conn.close()
+        summary["plan_seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self._stats["plan_seconds"] += summary["plan_seconds"]
+            self._stats["errors" if summary["error"] else summary["verdict"]] += 1
+            if summary["error"] is None:
+                self._verdicts[key] = (summary, time.time() + self.ttl_seconds)
+                while len(self._verdicts) > self.max_entries:
+                    self._verdicts.popitem(last=False)
+        return dict(summary, cached=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._verdicts))
+
+
+def format_plan_summary(summary: dict) -> str:
+    """One-line description of a plan summary for the chat."""
+    parts = []
+    if summary.get("error"):
+        return f"🔍 Plan unavailable: {summary['error'][:120]}"
+    if summary["estimated_rows"] is not None:
+        parts.append(f"~{summary['estimated_rows']:,.0f} rows")
+    if summary["estimated_cost"] is not None:
+        parts.append(f"cost {summary['estimated_cost']:,.1f}")
+    if summary["scans"]:
+        parts.append("scans " + ", ".join(f"{s['table']}" + (f" (~{s['rows']:,})" if s["rows"] is not None else "") for s in summary["scans"]))
+    parts.append("TOP ✓" if summary["has_top"] else "no TOP")
+    return f"🔍 Plan ({summary['verdict']}{', cached' if summary.get('cached') else ''}): " + " · ".join(parts)
@@ -0,0 +1,192 @@
+import threading
+import time
+
+import pandas as pd
+
+
+def interrupt_statement(cursor, dbapi_conn):
+    """Stops the statement running on `cursor` from another thread."""
+    # pyodbc cursors support cancel(); sqlite3 (test stand-in) only interrupts per connection.
+    try:
+        if cursor is not None and hasattr(cursor, "cancel"):
+            cursor.cancel()
+        elif dbapi_conn is not None and hasattr(dbapi_conn, "interrupt"):
+            dbapi_conn.interrupt()
+    except Exception:
+        pass
+
+
+class QueryJob:
+    """Runs one statement on a background thread, fetching it in chunks so callers can render
+    the first rows early, enforce row/byte ceilings and cancel the statement mid-flight.
+
+    With an `admission` queue (see query_service.FairQueue) the job first waits, as `user`, for a
+    free slot; the statement timeout only starts once it is admitted."""
+
+    def __init__(self, engine, sql, chunk_rows: int = 5000, max_rows: int = 100_000, max_bytes: int = 256 * 1024 ** 2, timeout_seconds: float = 120,
+                 admission=None, user=None):
+        self.engine = engine
+        self.sql = sql
+        self.admission = admission
+        self.user = user
+        self.chunk_rows = chunk_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.timeout_seconds = timeout_seconds
+        self.chunks = []
+        self.columns = []
+        self.rows = 0
+        self.bytes = 0
+        self.status = "pending"  # pending, queued, running, done, truncated, cancelled, timeout, failed
+        self.error = None
+        self.started_at = None
+        self.queued_seconds = 0.0
+        self.admitted_at = None
+        self.first_row_at = None
+        self.finished_at = None
+        self._cancel_reason = None
+        self._ticket = None
+        self._cursor = None
+        self._dbapi_conn = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.status = "queued" if self.admission is not None else "running"
+        if self.admission is None:
+            self.admitted_at = self.started_at
+        self._thread = threading.Thread(target=self._run, name="query-job", daemon=True)
+        self._thread.start()
+        return self
+
+    def _interrupt(self):
+        with self._lock:
+            cursor, dbapi_conn = self._cursor, self._dbapi_conn
+        interrupt_statement(cursor, dbapi_conn)
+
+    def cancel(self, reason: str = "cancelled"):
+        if self._done.is_set() or self._cancel_reason:
+            return
+        self._cancel_reason = reason
+        self._interrupt()
+
+    def _wait_for_slot(self):
+        ticket = self.admission.enqueue(self.user)
+        if ticket is None:
+            raise RuntimeError("the database is busy (too many queries queued), try again shortly")
+        self._ticket = ticket
+        deadline = time.perf_counter() + self.admission.queue_timeout
+        while not ticket.wait(0.2):
+            if self._cancel_reason or time.perf_counter() > deadline:
+                self._ticket = None
+                self.admission.abandon(ticket)
+                raise RuntimeError(f"no database slot became free within {self.admission.queue_timeout:.0f}s")
+        self.admitted_at = ticket.admitted_at
+        self.queued_seconds = ticket.admitted_at - ticket.enqueued_at
+        self.status = "running"
+
+    def _run(self):
+        timer = threading.Timer(self.timeout_seconds, self.cancel, kwargs={"reason": "timeout"}) if self.timeout_seconds else None
+        raw_conn = None
+        try:
+            if self.admission is not None:
+                self._wait_for_slot()
+            raw_conn = self.engine.raw_connection()
+            cursor = raw_conn.cursor()
+            with self._lock:
+                self._cursor = cursor
+                self._dbapi_conn = getattr(raw_conn, "driver_connection", None) or getattr(raw_conn, "dbapi_connection", None)
+            if timer:
+                timer.daemon = True
+                timer.start()
+            cursor.execute(self.sql)
+            # Skip row counts from leading SET/INSERT statements to reach the first result set.
+            while cursor.description is None and hasattr(cursor, "nextset") and cursor.nextset():
+                pass
+            self.columns = [col[0] for col in cursor.description] if cursor.description else []
+            while not self._cancel_reason:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                if self.rows + len(rows) > self.max_rows:
+                    rows = rows[:self.max_rows - self.rows]
+                    self._cancel_reason = "truncated"
+                chunk = pd.DataFrame.from_records([tuple(row) for row in rows], columns=self.columns, coerce_float=True)
+                if self.first_row_at is None:
+                    self.first_row_at = time.perf_counter()
+                self.chunks.append(chunk)
+                self.rows += len(chunk)
+                self.bytes += int(chunk.memory_usage(deep=True).sum())
+                if self.bytes >= self.max_bytes or self.rows >= self.max_rows:
+                    self._cancel_reason = "truncated"
+            self.status = self._cancel_reason or "done"
+            if self._cancel_reason == "truncated" and hasattr(cursor, "cancel"):
+                # Stop the server from producing rows nobody will read.
+                cursor.cancel()
+            cursor.close()
+        except Exception as e:
+            if self._cancel_reason:
+                self.status = self._cancel_reason
+            else:
+                self.status = "failed"
+                self.error = str(e)
+        finally:
+            if timer:
+                timer.cancel()
+            if raw_conn is not None:
+                try:
+                    # An interrupted or cut-off connection may carry a pending cancel; never hand it back to the pool.
+                    if self.status in ("cancelled", "timeout", "truncated"):
+                        raw_conn.invalidate()
+                    raw_conn.close()
+                except Exception:
+                    pass
+            if self._ticket is not None:
+                self.admission.release(self._ticket)
+            self.finished_at = time.perf_counter()
+            self._done.set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def queue_position(self) -> int:
+        """Place in the admission queue while waiting for a slot, otherwise 0."""
+        ticket = self._ticket
+        return self.admission.position(ticket) if ticket is not None and self.status == "queued" else 0
+
+    @property
+    def time_to_first_row(self):
+        # From admission: time spent waiting in the fair queue is reported as queued_seconds.
+        return None if self.first_row_at is None else self.first_row_at - self.admitted_at
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def preview(self, max_rows: int = 200):
+        return self.chunks[0].head(max_rows) if self.chunks else None
+
+    def result(self):
+        """(df, error) once finished. Truncated and cancelled jobs return the rows fetched so far."""
+        if self.status == "failed":
+            return None, f"Query failed: {self.error}"
+        if self.status == "timeout":
+            return None, f"Query failed: statement timed out after {self.timeout_seconds:.0f}s"
+        df = pd.concat(self.chunks, ignore_index=True) if self.chunks else pd.DataFrame(columns=self.columns)
+        if self.status in ("truncated", "cancelled"):
+            df.attrs["partial_result"] = self.status
+        return df, None
+
+
+def run_query(engine, sql, **limits):
+    """Blocking convenience wrapper around QueryJob."""
+    job = QueryJob(engine, sql, **limits).start()
+    job.wait()
+    return job
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from query_runner import QueryJob, interrupt_statement
+
+
+def create_pooled_engine(url: str, pool_size: int = 6, max_overflow: int = 2, pool_recycle: int = 1800, pool_timeout: float = 30, **kwargs):
+    """Engine with a bounded pool: connections are pinged before use and recycled before the
+    server or a firewall drops them."""
+    return create_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle, pool_timeout=pool_timeout,
+                         pool_pre_ping=True, **kwargs)
+
+
+class AdmissionTicket:
+    __slots__ = ("user", "enqueued_at", "admitted_at", "_admitted")
+
+    def __init__(self, user):
+        self.user = user
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at = None
+        self._admitted = threading.Event()
+
+    def wait(self, timeout=None) -> bool:
+        return self._admitted.wait(timeout)
+
+    @property
+    def admitted(self) -> bool:
+        return self._admitted.is_set()
+
+
+class FairQueue:
+    """Global concurrency limit with round-robin admission across users.
+
+    Each user has their own FIFO; a free slot goes to the user at the head of the rotation, who then
+    moves to the back. A user with a 50-question batch therefore takes one slot per round instead of
+    starving everyone who asks a single question behind it."""
+
+    def __init__(self, max_concurrent: int = 4, max_queued: int = 200, queue_timeout: float = 300):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._waiting = OrderedDict()  # user -> deque of tickets, in rotation order
+        self._queued = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "rejected": 0, "abandoned": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent and self._waiting:
+            user, tickets = self._waiting.popitem(last=False)
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting[user] = tickets
+            self._queued -= 1
+            self._running += 1
+            ticket.admitted_at = time.perf_counter()
+            waited = ticket.admitted_at - ticket.enqueued_at
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            ticket._admitted.set()
+
+    def enqueue(self, user):
+        """A ticket that is admitted (see `ticket.wait`) when a slot is free, or None when the queue is full."""
+        with self._lock:
+            if self._queued >= self.max_queued:
+                self._stats["rejected"] += 1
+                return None
+            ticket = AdmissionTicket(user)
+            self._waiting.setdefault(user, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+            return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    def abandon(self, ticket):
+        """Withdraws a ticket that no longer wants its slot (cancelled or timed out while queued)."""
+        with self._lock:
+            if not ticket.admitted:
+                tickets = self._waiting[ticket.user]
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._waiting[ticket.user]
+                self._queued -= 1
+                self._stats["abandoned"] += 1
+                return
+        self.release(ticket)
+
+    def position(self, ticket) -> int:
+        """1-based place in the admission order, 0 once admitted."""
+        with self._lock:
+            if ticket.admitted:
+                return 0
+            position = 0
+            for depth in range(max((len(t) for t in self._waiting.values()), default=0)):
+                for tickets in self._waiting.values():
+                    if depth < len(tickets):
+                        position += 1
+                        if tickets[depth] is ticket:
+                            return position
+            return position
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, running=self._running, max_concurrent=self.max_concurrent, queued=self._queued,
+                         queued_users=len(self._waiting))
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+        return stats
+
+
+class QueryService:
+    """Single way into the database for every session: queries wait in a fair queue for one of
+    `max_concurrent` slots and then run as a QueryJob on the shared, bounded connection pool."""
+
+    def __init__(self, engine, max_concurrent: int = 4, max_queued: int = 200, queue_timeout: float = 300):
+        self.engine = engine
+        self.queue = FairQueue(max_concurrent, max_queued, queue_timeout)
+
+    def submit(self, sql, user, **limits) -> QueryJob:
+        return QueryJob(self.engine, sql, admission=self.queue, user=user, **limits).start()
+
+    def run(self, sql, user, **limits) -> QueryJob:
+        job = self.submit(sql, user, **limits)
+        job.wait()
+        return job
+
+    def stream(self, sql, user, chunk_rows: int = 50_000, max_rows=None, timeout_seconds=None):
+        """Yields the result of `sql` as DataFrames of `chunk_rows` rows, holding one admission slot
+        until the generator is exhausted or closed; for exports larger than the interactive caps.
+
+        Like a QueryJob, the statement is interrupted once `timeout_seconds` have passed since it
+        was admitted, and the generator then raises RuntimeError."""
+        ticket = self.queue.enqueue(user)
+        if ticket is None:
+            raise RuntimeError("the database is busy (too many queries queued), try again shortly")
+        if not ticket.wait(self.queue.queue_timeout):
+            self.queue.abandon(ticket)
+            raise RuntimeError(f"no database slot became free within {self.queue.queue_timeout:.0f}s")
+        raw_conn = cursor = timer = None
+        timed_out = threading.Event()
+        rows_sent, exhausted = 0, False
+        try:
+            raw_conn = self.engine.raw_connection()
+            cursor = raw_conn.cursor()
+            if timeout_seconds:
+                dbapi_conn = getattr(raw_conn, "driver_connection", None) or getattr(raw_conn, "dbapi_connection", None)
+                timer = threading.Timer(timeout_seconds, lambda: (timed_out.set(), interrupt_statement(cursor, dbapi_conn)))
+                timer.daemon = True
+                timer.start()
+            try:
+                cursor.execute(sql)
+                while cursor.description is None and hasattr(cursor, "nextset") and cursor.nextset():
+                    pass
+                columns = [col[0] for col in cursor.description] if cursor.description else []
+                while (max_rows is None or rows_sent < max_rows) and not timed_out.is_set():
+                    rows = cursor.fetchmany(chunk_rows if max_rows is None else min(chunk_rows, max_rows - rows_sent))
+                    if not rows:
+                        exhausted = not timed_out.is_set()
+                        break
+                    rows_sent += len(rows)
+                    yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns, coerce_float=True)
+            except Exception:
+                if not timed_out.is_set():
+                    raise
+            if timed_out.is_set():
+                raise RuntimeError(f"statement timed out after {timeout_seconds:.0f}s ({rows_sent:,} rows read)")
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if cursor is not None:
+                try:
+                    if not exhausted and not timed_out.is_set() and hasattr(cursor, "cancel"):
+                        cursor.cancel()  # stopped early: do not let the server keep producing rows
+                    cursor.close()
+                except Exception:
+                    pass
+            if raw_conn is not None:
+                try:
+                    # Same rule as QueryJob: an interrupted or cut-off connection never goes back to the pool.
+                    if not exhausted:
+                        raw_conn.invalidate()
+                    raw_conn.close()
+                except Exception:
+                    pass
+            self.queue.release(ticket)
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        pool_stats = {"pool_size": getattr(pool, "size", lambda: None)(), "checked_out": getattr(pool, "checkedout", lambda: None)(),
+                      "overflow": getattr(pool, "overflow", lambda: None)(), "pool_status": pool.status()}
+        return dict(self.queue.stats(), **pool_stats)
@@ -0,0 +1,128 @@
+import datetime
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_STRING_OR_CODE_RE = re.compile(r"('(?:[^']|'')*')|([^']+)")
+_NOW_FUNCTIONS_RE = re.compile(r"\b(getdate|sysdatetime|getutcdate|sysutcdatetime|sysdatetimeoffset)\s*\(\s*\)|\bcurrent_timestamp\b")
+_DAY_TRUNCATED_RE = re.compile(
+    r"(try_)?cast\s*\(\s*(getdate|sysdatetime|getutcdate|sysutcdatetime)\s*\(\s*\)\s+as\s+date\s*\)"
+    r"|(try_)?convert\s*\(\s*date\s*,\s*(getdate|sysdatetime|getutcdate|sysutcdatetime)\s*\(\s*\)\s*\)")
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form used as the cache key: no comments, collapsed whitespace, lower-case outside literals."""
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    parts = []
+    for literal, code in _STRING_OR_CODE_RE.findall(sql):
+        parts.append(literal if literal else re.sub(r"\s+", " ", code.lower()))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _seconds_until_midnight(now: datetime.datetime) -> float:
+    tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+def ttl_for_sql(normalized_sql: str, default_ttl: float = 3600, relative_day_ttl: float = 900, volatile_ttl: float = 60, now=None) -> float:
+    """TTL rules for relative dates.
+
+    Queries on fixed date ranges keep `default_ttl`. Queries anchored on the current day
+    (e.g. CAST(GETDATE() AS DATE) for "yesterday") keep `relative_day_ttl` but never outlive
+    midnight, when "yesterday" changes meaning. Queries that use the current time of day get
+    `volatile_ttl`.
+    """
+    if not _NOW_FUNCTIONS_RE.search(normalized_sql):
+        return default_ttl
+    until_midnight = _seconds_until_midnight(now or datetime.datetime.now())
+    if _NOW_FUNCTIONS_RE.search(_DAY_TRUNCATED_RE.sub(" ", normalized_sql)):
+        return min(volatile_ttl, until_midnight)
+    return min(relative_day_ttl, until_midnight)
+
+
+class ResultCache:
+    """Process-wide LRU cache of query results with per-entry TTL and a global memory budget.
+
+    `variant` tells apart frames of the same query that were post-processed differently (e.g.
+    compacted or not); each variant is a separate entry."""
+
+    def __init__(self, max_bytes: int = 512 * 1024 ** 2, max_entry_fraction: float = 0.25, default_ttl: float = 3600, relative_day_ttl: float = 900, volatile_ttl: float = 60):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = int(max_bytes * max_entry_fraction)
+        self.default_ttl = default_ttl
+        self.relative_day_ttl = relative_day_ttl
+        self.volatile_ttl = volatile_ttl
+        self._entries = OrderedDict()  # (key, variant) -> (df, nbytes, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "bypassed": 0}
+
+    @staticmethod
+    def key_for(sql: str) -> str:
+        return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def get(self, sql: str, variant: str = ""):
+        """Returns the cached DataFrame (treat as read-only) or None."""
+        key = (self.key_for(sql), variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[2] < time.time():
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, sql: str, df, variant: str = ""):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_entry_bytes:
+            return
+        normalized = normalize_sql(sql)
+        ttl = ttl_for_sql(normalized, self.default_ttl, self.relative_day_ttl, self.volatile_ttl)
+        if ttl <= 0:
+            return
+        cached_df = df.copy(deep=False)
+        cached_df.attrs["result_cache_stored_at"] = time.time()
+        key = (self.key_for(sql), variant)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (cached_df, nbytes, time.time() + ttl)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, sql: str = None):
+        """Drops one query's entries (every variant), or everything when `sql` is None."""
+        with self._lock:
+            if sql is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            sql_key = self.key_for(sql)
+            for key in [key for key in self._entries if key[0] == sql_key]:
+                self._drop(key)
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,216 @@
+import csv
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "exports")
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+EXCEL_MAX_ROWS = 1_048_575  # one row of the sheet is the header
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")  # BOM so Excel opens UTF-8 correctly
+        self._header = True
+
+    def write(self, chunk):
+        chunk.to_csv(self._file, header=self._header, index=False, quoting=csv.QUOTE_MINIMAL)
+        self._header = False
+        return len(chunk)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+        self._schema = None
+
+    def write(self, chunk):
+        table = pa.Table.from_pandas(chunk, preserve_index=False).replace_schema_metadata(None)
+        if self._writer is None:
+            # A column that is all NULL in the first chunk would otherwise be typed null for the whole file.
+            self._schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+            self._writer = pq.ParquetWriter(self.path, self._schema, compression="zstd")
+        if table.schema != self._schema:
+            table = table.cast(self._schema, safe=False)
+        self._writer.write_table(table)
+        return len(chunk)
+
+    def close(self):
+        if self._writer is None:
+            pq.write_table(pa.table({}), self.path)
+        else:
+            self._writer.close()
+
+
+class _ExcelWriter:
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self.path = path
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Result")
+        self._rows = 0
+
+    def write(self, chunk):
+        if self._rows == 0:
+            self._sheet.append([str(c) for c in chunk.columns])
+        chunk = chunk.iloc[:EXCEL_MAX_ROWS - self._rows]
+        # Cells take Python scalars; NaN/NaT become empty cells.
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            self._sheet.append(row)
+        self._rows += len(chunk)
+        return len(chunk)
+
+    @property
+    def full(self):
+        return self._rows >= EXCEL_MAX_ROWS
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+_WRITERS = {"csv": _CsvWriter, "parquet": _ParquetWriter, "xlsx": _ExcelWriter}
+
+
+def write_chunks(chunks, extension, path, on_progress=None, should_stop=None) -> dict:
+    """Streams DataFrame chunks into one file; memory stays at about one chunk plus the writer's buffer.
+
+    Excel sheets stop at EXCEL_MAX_ROWS (reported as `truncated`)."""
+    writer = _WRITERS[extension](path)
+    rows, truncated = 0, False
+    try:
+        for chunk in chunks:
+            if should_stop is not None and should_stop():
+                raise RuntimeError("export cancelled")
+            rows += writer.write(chunk)
+            if on_progress is not None:
+                on_progress(rows)
+            if getattr(writer, "full", False):
+                truncated = True
+                break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()  # releases a database cursor that is still streaming
+        writer.close()
+    return {"rows": rows, "truncated": truncated, "bytes": os.path.getsize(path)}
+
+
+def export_file_name(title, extension) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", (title or "result").lower()).strip("_")[:60] or "result"
+    return f"{slug}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+class ExportJob:
+    def __init__(self, session_id, label, extension, path, file_name):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.label = label
+        self.extension = extension
+        self.path = path
+        self.file_name = file_name
+        self.status = "running"  # running, done, failed, cancelled
+        self.rows = 0
+        self.truncated = False
+        self.bytes = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancelled = False
+        self.future = None
+
+    def cancel(self):
+        self._cancelled = True
+        if self.future is not None and self.future.cancel():
+            self.status, self.finished_at = "cancelled", time.time()
+
+    def _run(self, chunks_fn):
+        try:
+            info = write_chunks(chunks_fn(), self.extension, self.path, on_progress=lambda rows: setattr(self, "rows", rows),
+                                should_stop=lambda: self._cancelled)
+            self.rows, self.truncated, self.bytes = info["rows"], info["truncated"], info["bytes"]
+            self.status = "done"
+        except Exception as e:
+            self.status = "cancelled" if self._cancelled else "failed"
+            self.error = str(e)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        finally:
+            self.finished_at = time.time()
+
+
+class ExportManager:
+    """Writes exports on its own small pool (they can take minutes) into `root/<session>/` and keeps
+    the jobs so that later reruns can show progress and a download for them. Files older than `ttl`
+    are removed."""
+
+    def __init__(self, root: str = DEFAULT_EXPORT_DIR, max_workers: int = 2, ttl: float = 3600):
+        self.root = root
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._jobs = {}  # session -> [ExportJob]
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def submit(self, session_id, label, extension, chunks_fn, title=None) -> ExportJob:
+        """`chunks_fn()` returns the iterator of DataFrame chunks; it is called on the export thread."""
+        self._expire()
+        directory = os.path.join(self.root, session_id)
+        os.makedirs(directory, exist_ok=True)
+        file_name = export_file_name(title, extension)
+        job = ExportJob(session_id, label, extension, os.path.join(directory, f"{uuid.uuid4().hex}.{extension}"), file_name)
+        with self._lock:
+            self._jobs.setdefault(session_id, []).append(job)
+        job.future = self._executor.submit(job._run, chunks_fn)
+        return job
+
+    def jobs(self, session_id) -> list:
+        with self._lock:
+            return list(self._jobs.get(session_id, []))
+
+    def remove(self, job):
+        job.cancel()
+        with self._lock:
+            if job in self._jobs.get(job.session_id, []):
+                self._jobs[job.session_id].remove(job)
+        if job.status != "running" and os.path.exists(job.path):
+            os.remove(job.path)
+
+    def drop_session(self, session_id):
+        with self._lock:
+            jobs = self._jobs.pop(session_id, [])
+        for job in jobs:
+            job.cancel()
+        shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for session_id, jobs in list(self._jobs.items()):
+                for job in [j for j in jobs if j.finished_at and j.finished_at < cutoff]:
+                    jobs.remove(job)
+                    if os.path.exists(job.path):
+                        os.remove(job.path)
+                if not jobs:
+                    del self._jobs[session_id]
+
+
+def read_file(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
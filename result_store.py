@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pyarrow as pa
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results")
+
+
+class ResultStore:
+    """Keeps result DataFrames out of session state.
+
+    Every result is written through to an Arrow IPC file under `root/<instance>/<session>/` and callers only
+    hold the returned handle. Recently used frames stay in memory within a per-session and a global
+    byte budget (LRU); evicted ones are reloaded from the memory-mapped file on demand. Sessions
+    idle for longer than `session_ttl` are swept along with their files."""
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR, max_bytes: int = 1024 ** 3, session_max_bytes: int = 128 * 1024 ** 2, session_ttl: float = 12 * 3600):
+        # One directory per store instance so that several app processes can share `root`.
+        self.root = os.path.join(root, uuid.uuid4().hex)
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.session_ttl = session_ttl
+        self._meta = {}  # handle -> {session, path, nbytes, rows, columns, attrs}
+        self._memory = OrderedDict()  # handle -> DataFrame, in LRU order
+        self._memory_bytes = 0
+        self._session_bytes = {}
+        self._last_seen = {}
+        self._last_sweep = time.time()
+        self._stats = {"spills": 0, "loads": 0, "evictions": 0, "expired_sessions": 0}
+        self._lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+        # Directories left behind by processes that are gone have no owner any more.
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.path != self.root and time.time() - entry.stat().st_mtime > session_ttl:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _touch(self, session_id):
+        now = time.time()
+        self._last_seen[session_id] = now
+        if now - self._last_sweep > 60:
+            self._last_sweep = now
+            for stale in [s for s, seen in self._last_seen.items() if now - seen > self.session_ttl]:
+                self.drop_session(stale)
+                self._stats["expired_sessions"] += 1
+
+    def _forget(self, handle):
+        self._memory.pop(handle)
+        meta = self._meta[handle]
+        self._memory_bytes -= meta["nbytes"]
+        self._session_bytes[meta["session"]] -= meta["nbytes"]
+
+    def _enforce_budgets(self, session_id, keep=None):
+        # Frames that could not be spilled (no path) are never evicted: memory is their only copy.
+        for handle in [h for h in self._memory if self._meta[h]["session"] == session_id]:
+            if self._session_bytes.get(session_id, 0) <= self.session_max_bytes:
+                break
+            if handle != keep and self._meta[handle]["path"]:
+                self._forget(handle)
+                self._stats["evictions"] += 1
+        for handle in list(self._memory):
+            if self._memory_bytes <= self.max_bytes:
+                break
+            if handle != keep and self._meta[handle]["path"]:
+                self._forget(handle)
+                self._stats["evictions"] += 1
+
+    def _remember(self, handle, df):
+        meta = self._meta[handle]
+        self._memory[handle] = df
+        self._memory_bytes += meta["nbytes"]
+        self._session_bytes[meta["session"]] = self._session_bytes.get(meta["session"], 0) + meta["nbytes"]
+        self._enforce_budgets(meta["session"], keep=handle)
+
+    def put(self, session_id: str, df) -> str:
+        handle = f"{session_id}/{uuid.uuid4().hex}"
+        path = os.path.join(self.root, session_id, f"{handle.split('/')[-1]}.arrow")
+        meta = {"session": session_id, "path": None, "nbytes": int(df.memory_usage(deep=True).sum()), "rows": len(df),
+                "columns": [str(c) for c in df.columns], "attrs": json.loads(json.dumps(df.attrs, default=str))}
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            meta["path"] = path
+            os.utime(self.root)  # keeps this instance's directory from looking abandoned to other processes
+            self._stats["spills"] += 1
+        except (pa.ArrowException, OSError, ValueError, TypeError) as e:
+            # Columns Arrow cannot represent keep the frame pinned in memory instead.
+            print(f"Result store could not spill {handle} to disk, keeping it in memory: {e}")
+        with self._lock:
+            self._touch(session_id)
+            self._meta[handle] = meta
+            self._remember(handle, df)
+        return handle
+
+    def get(self, handle: str):
+        """The DataFrame behind a handle, or None once it has been dropped."""
+        with self._lock:
+            meta = self._meta.get(handle)
+            if meta is None:
+                return None
+            self._touch(meta["session"])
+            if handle in self._memory:
+                self._memory.move_to_end(handle)
+                return self._memory[handle]
+            if meta["path"] is None:
+                return None
+        with pa.memory_map(meta["path"], "r") as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        df.attrs.update(meta["attrs"])
+        with self._lock:
+            self._stats["loads"] += 1
+            if handle in self._meta and handle not in self._memory:
+                self._remember(handle, df)
+        return df
+
+    def iter_chunks(self, handle: str, rows: int = 50_000):
+        """The result as DataFrames of at most `rows` rows, for exports: slices of the in-memory frame,
+        or of the memory-mapped Arrow file, so no second full copy is built."""
+        with self._lock:
+            meta = self._meta.get(handle)
+            df = self._memory.get(handle)
+        if meta is None:
+            return
+        if df is not None:
+            for start in range(0, len(df), rows):
+                yield df.iloc[start:start + rows]
+            return
+        with pa.memory_map(meta["path"], "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            for start in range(0, table.num_rows, rows):
+                yield table.slice(start, rows).to_pandas()
+
+    def info(self, handle: str):
+        """Rows and columns of a result without loading it."""
+        meta = self._meta.get(handle)
+        return None if meta is None else {"rows": meta["rows"], "columns": meta["columns"], "nbytes": meta["nbytes"]}
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            for handle in [h for h, m in self._meta.items() if m["session"] == session_id]:
+                if handle in self._memory:
+                    self._forget(handle)
+                del self._meta[handle]
+            self._session_bytes.pop(session_id, None)
+            self._last_seen.pop(session_id, None)
+        shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, results=len(self._meta), in_memory=len(self._memory), memory_bytes=self._memory_bytes,
+                        max_bytes=self.max_bytes, sessions=len(self._last_seen),
+                        disk_bytes=sum(os.path.getsize(m["path"]) for m in self._meta.values() if m["path"] and os.path.exists(m["path"])))
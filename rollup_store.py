@@ -0,0 +1,322 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_ROLLUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "rollups")
+
+# Part 2-D metrics: (expression, additive across days). Orders have a single OrderDate, so daily
+# distinct order counts add up over any period; customers come back on other days, so they do not.
+MEASURES = {
+    "gross_sales": ("SUM(sol.TotalNetAmt)", True),
+    "quantity": ("SUM(sol.QTY)", True),
+    "order_count": ("COUNT(DISTINCT so.OrderID)", True),
+    "unique_customers": ("COUNT(DISTINCT so.CustomerID)", False),
+}
+MEASURE_LABELS = {"gross_sales": "GrossSales", "quantity": "Quantity", "order_count": "OrderCount", "unique_customers": "UniqueCustomers"}
+DIMENSIONS = {
+    "channel": ("sc.Name", "Channel", "LEFT JOIN {schema}.Sales_MstSalesChannels sc{hint} ON sc.SalesChannelID = sol.SalesChannelID"),
+    "department": ("d.Name", "Department", "LEFT JOIN {schema}.System_MstDepartments d{hint} ON d.DepartmentID = so.DepartmentID"),
+}
+# One rollup per slice: distinct counts cannot be re-aggregated across channels or departments.
+ROLLUPS = {"daily": None, "daily_channel": "channel", "daily_department": "department"}
+# Part 2-C filters applied to every query (aliases so = orders, sol = order lines). The system prompt
+# ships them with placeholder columns, so deployments set ROLLUP_FILTERS to the conditions their
+# prompt actually uses; rollups built with other filters are rebuilt and never served.
+BASE_FILTERS = "so.StatusID NOT IN (17, 20, 21) AND so.CancelDate IS NULL AND COALESCE(sol.ItemStatusID, 0) NOT IN (20) AND sol.ProductID > 0"
+_DAY_EXPR = {"mssql": "CAST(so.OrderDate AS DATE)", "sqlite": "DATE(so.OrderDate)"}
+_TABLE_HINT = {"mssql": " WITH (NOLOCK)", "sqlite": ""}
+
+
+def source_sql(dialect, schema, measures, dimension=None, start=None, end=None, by_day=True, order=False, filters=BASE_FILTERS) -> str:
+    """Aggregate over the raw order lines; used to fill partitions and shown as the equivalent query."""
+    hint, day = _TABLE_HINT.get(dialect, ""), _DAY_EXPR.get(dialect, "CAST(so.OrderDate AS DATE)")
+    select, group = [], []
+    if by_day:
+        select.append(f"{day} AS Day")
+        group.append(day)
+    if dimension:
+        expression, label, _ = DIMENSIONS[dimension]
+        select.append(f"{expression} AS {label}")
+        group.append(expression)
+    select += [f"{MEASURES[m][0]} AS {MEASURE_LABELS[m]}" for m in measures]
+    joins = [DIMENSIONS[dimension][2].format(schema=schema, hint=hint)] if dimension else []
+    where = [filters] + ([f"so.OrderDate >= '{start}'"] if start else []) + ([f"so.OrderDate < '{end}'"] if end else [])
+    sql = (f"SELECT {', '.join(select)}\nFROM {schema}.Sales_SalesOrderLines sol{hint}\n"
+           f"JOIN {schema}.Sales_SalesOrders so{hint} ON so.OrderID = sol.OrderID\n" + "".join(f"{j}\n" for j in joins) +
+           f"WHERE {' AND '.join(where)}" + (f"\nGROUP BY {', '.join(group)}" if group else ""))
+    if order:
+        sql += "\nORDER BY " + ("Day" if by_day else f"{MEASURE_LABELS[measures[0]]} DESC")
+    return sql
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _next_month(day: datetime.date) -> datetime.date:
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def _months(start: datetime.date, end: datetime.date):
+    month = _month_start(start)
+    while month <= end:
+        yield month
+        month = _next_month(month)
+
+
+class RollupStore:
+    """Daily aggregates of the hot metrics as one Parquet file per rollup and month under `root`.
+
+    `refresh` rebuilds only the month partitions that are missing plus the most recent
+    `recent_months` (late orders and cancellations land there); a manifest records when each
+    partition was built. Reads are served from memory after the first load of a partition."""
+
+    def __init__(self, root: str = DEFAULT_ROLLUP_DIR, filters: str = BASE_FILTERS):
+        self.root = root
+        self.filters = filters
+        self._frames = {}  # (rollup, month) -> (mtime, DataFrame)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, "manifest.json")
+
+    def manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _partition_path(self, rollup, month):
+        return os.path.join(self.root, rollup, f"{month:%Y-%m}.parquet")
+
+    def refresh(self, engine, schema: str, recent_months: int = 2, full: bool = False, today=None) -> dict:
+        with self._refresh_lock:
+            started = time.perf_counter()
+            today = today or datetime.date.today()
+            manifest = {} if full else self.manifest()
+            if manifest.get("schema") not in (None, schema) or manifest.get("filters") not in (None, self.filters):
+                manifest = {}
+            dialect = engine.dialect.name
+            with engine.connect() as conn:
+                first_day = pd.read_sql(f"SELECT MIN(so.OrderDate) AS first_day FROM {schema}.Sales_SalesOrders so", conn)["first_day"].iloc[0]
+                if first_day is None or pd.isna(first_day):
+                    return {"partitions": 0, "seconds": round(time.perf_counter() - started, 3)}
+                months = list(_months(pd.Timestamp(first_day).date(), today))
+                recent = set(months[-recent_months:]) if recent_months else set()
+                built = manifest.get("partitions", {})
+                refreshed = 0
+                for rollup, dimension in ROLLUPS.items():
+                    for month in months:
+                        if month not in recent and f"{month:%Y-%m}" in built.get(rollup, {}) and os.path.exists(self._partition_path(rollup, month)):
+                            continue
+                        sql = source_sql(dialect, schema, list(MEASURES), dimension, f"{month:%Y-%m-%d}", f"{_next_month(month):%Y-%m-%d}", filters=self.filters)
+                        df = pd.read_sql(sql, conn)
+                        df["Day"] = pd.to_datetime(df["Day"])
+                        path = self._partition_path(rollup, month)
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        df.to_parquet(f"{path}.tmp", index=False)
+                        os.replace(f"{path}.tmp", path)
+                        built.setdefault(rollup, {})[f"{month:%Y-%m}"] = time.time()
+                        refreshed += 1
+            manifest = {"schema": schema, "filters": self.filters, "dialect": dialect, "partitions": built, "first_month": f"{months[0]:%Y-%m}",
+                        "refreshed_at": time.time(), "last_refresh": {"partitions": refreshed, "seconds": round(time.perf_counter() - started, 3)}}
+            with open(f"{self.manifest_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+            return manifest["last_refresh"]
+
+    def start_scheduler(self, engine, schema: str, interval_seconds: float, recent_months: int = 2):
+        """Refreshes in a daemon thread every `interval_seconds`, for deployments without an external scheduler."""
+        def _loop():
+            while True:
+                try:
+                    print(f"Rollup refresh: {self.refresh(engine, schema, recent_months)}")
+                except Exception as e:
+                    print(f"Rollup refresh failed: {e}")
+                time.sleep(interval_seconds)
+
+        threading.Thread(target=_loop, name="rollup-refresh", daemon=True).start()
+
+    def _partition(self, rollup, month):
+        path = self._partition_path(rollup, month)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._frames.get((rollup, month))
+            if cached and cached[0] == mtime:
+                return cached[1]
+        df = pd.read_parquet(path)
+        with self._lock:
+            self._frames[(rollup, month)] = (mtime, df)
+        return df
+
+    def load(self, rollup: str, start: datetime.date, end: datetime.date):
+        """Rows of `rollup` with start <= Day < end, or None when a partition in that range was never built."""
+        frames = []
+        for month in _months(start, end - datetime.timedelta(days=1)):
+            df = self._partition(rollup, month)
+            if df is None:
+                return None
+            frames.append(df)
+        if not frames:
+            return None
+        df = pd.concat(frames, ignore_index=True)
+        return df[(df["Day"] >= pd.Timestamp(start)) & (df["Day"] < pd.Timestamp(end))]
+
+
+_MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+_PERIOD_PATTERNS = [
+    ("fy", re.compile(r"\b(?:fy|fiscal year)\s?'?(\d{2}|\d{4})\b")),
+    ("month", re.compile(r"\b(" + "|".join(m[:3] for m in _MONTHS) + r")[a-z]*\.?\s+(\d{4})\b")),
+    ("year", re.compile(r"\b(?:year\s+)?(20\d{2})\b")),
+]
+_SLICE_PATTERNS = [
+    ("channel", re.compile(r"\b(?:by|per|for each|across)\s+(?:sales\s+)?(?:channel|source)s?\b|\b(?:channel|source)[- ]wise\b")),
+    ("department", re.compile(r"\b(?:by|per|for each|across)\s+departments?\b|\bdepartment[- ]wise\b")),
+    ("day", re.compile(r"\bdaily\b|\b(?:by|per|each|every)\s+day\b|\bday[- ]wise\b|\bday by day\b")),
+]
+_MEASURE_PATTERNS = [
+    ("unique_customers", re.compile(r"\b(?:unique|distinct)\s+customers?\b|\bcustomer count\b|\bnumber of customers\b")),
+    ("order_count", re.compile(r"\border count\b|\bnumber of orders\b|\b(?:total\s+)?orders\b")),
+    ("quantity", re.compile(r"\bquantity\b|\bqty\b|\bunits sold\b|\bvolume\b")),
+    ("gross_sales", re.compile(r"\bgross sales\b|\brevenue\b|\bsales amount\b|\bsales\b")),
+]
+# Words that may remain once the metric, slice and period are recognised; anything else
+# (a product, a channel name, "top", "compare"...) means the question needs the LLM.
+_FILLER = {"what", "were", "was", "is", "are", "the", "total", "show", "me", "give", "get", "in", "for", "of", "and", "during",
+           "how", "many", "much", "did", "do", "we", "have", "our", "with", "a", "an", "list", "all", "each", "please", "tell",
+           "what's", "whats", "overall", "number", "count", "value", "make", "made", "there", "&", "breakdown", "split", "up"}
+
+
+def fiscal_year_bounds(year: int, start_month: int = 4, named_by_start: bool = True):
+    first_year = year if named_by_start else year - 1
+    return datetime.date(first_year, start_month, 1), datetime.date(first_year + 1, start_month, 1)
+
+
+class RollupRouter:
+    """Answers plain metric questions ("gross sales by channel in FY2024") from the rollups.
+
+    Routing is deliberately conservative: every word must be part of a recognised measure, slice or
+    period, or filler. Anything else, and rollups older than `max_age_seconds`, return None so the
+    question goes through the LLM and SQL Server as usual."""
+
+    def __init__(self, store: RollupStore, max_age_seconds: float = 6 * 3600, fy_named_by_start: bool = True, dialect: str = "mssql"):
+        self.store = store
+        self.max_age_seconds = max_age_seconds
+        self.fy_named_by_start = fy_named_by_start
+        self.dialect = dialect
+        self._stats = {"routed": 0, "declined": 0}
+        self._lock = threading.Lock()
+
+    def parse(self, question: str):
+        text = " " + re.sub(r"[?!.,;:]+(\s|$)", " ", question.lower()) + " "
+        period = None
+        for kind, pattern in _PERIOD_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                if kind == "fy":
+                    year = int(match.group(1))
+                    period = fiscal_year_bounds(year + 2000 if year < 100 else year, named_by_start=self.fy_named_by_start)
+                elif kind == "month":
+                    month = datetime.date(int(match.group(2)), [m[:3] for m in _MONTHS].index(match.group(1)) + 1, 1)
+                    period = (month, _next_month(month))
+                else:
+                    period = (datetime.date(int(match.group(1)), 1, 1), datetime.date(int(match.group(1)) + 1, 1, 1))
+                text = text[:match.start()] + " " + text[match.end():]
+                break
+        slices = []
+        for name, pattern in _SLICE_PATTERNS:
+            if pattern.search(text):
+                slices.append(name)
+                text = pattern.sub(" ", text)
+        measures = []
+        for name, pattern in _MEASURE_PATTERNS:
+            if pattern.search(text):
+                measures.append(name)
+                text = pattern.sub(" ", text)
+        leftover = [word for word in text.split() if word not in _FILLER]
+        if period is None or not measures or leftover or len([s for s in slices if s != "day"]) > 1:
+            return None
+        measures.sort(key=lambda m: list(MEASURES).index(m))
+        return {"measures": measures, "dimension": next((s for s in slices if s != "day"), None), "by_day": "day" in slices,
+                "start": period[0], "end": period[1]}
+
+    def route(self, question: str):
+        """{"df", "sql", "explanation", "refreshed_at"} for a question the rollups can answer, else None."""
+        started = time.perf_counter()
+        manifest = self.store.manifest()
+        parsed = self.parse(question)
+        answer = None
+        if parsed and manifest.get("refreshed_at", 0) > time.time() - self.max_age_seconds and manifest.get("filters") == self.store.filters:
+            answer = self._answer(parsed, manifest)
+        with self._lock:
+            self._stats["routed" if answer else "declined"] += 1
+        if answer:
+            answer["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return answer
+
+    def _answer(self, parsed, manifest):
+        multi_day = parsed["end"] - parsed["start"] > datetime.timedelta(days=1)
+        if not parsed["by_day"] and multi_day and not all(MEASURES[m][1] for m in parsed["measures"]):
+            return None
+        rollup = next(name for name, dimension in ROLLUPS.items() if dimension == parsed["dimension"])
+        df = self.store.load(rollup, parsed["start"], parsed["end"])
+        if df is None:
+            return None
+        keys = (["Day"] if parsed["by_day"] else []) + ([DIMENSIONS[parsed["dimension"]][1]] if parsed["dimension"] else [])
+        labels = [MEASURE_LABELS[m] for m in parsed["measures"]]
+        if keys:
+            result = df.groupby(keys, dropna=False, sort=False)[labels].sum().reset_index()
+        else:
+            result = pd.DataFrame({label: [df[label].sum()] for label in labels})
+        result = result.sort_values("Day" if parsed["by_day"] else labels[0], ascending=parsed["by_day"]).reset_index(drop=True)
+        if parsed["by_day"]:
+            result["Day"] = result["Day"].dt.date
+        result[labels] = result[labels].round(2)
+        schema = manifest["schema"]
+        sql = source_sql(self.dialect, schema, parsed["measures"], parsed["dimension"], f"{parsed['start']:%Y-%m-%d}", f"{parsed['end']:%Y-%m-%d}",
+                         by_day=parsed["by_day"], order=True, filters=self.store.filters)
+        slice_text = " and ".join(filter(None, ["day" if parsed["by_day"] else None, parsed["dimension"]]))
+        explanation = (f"{', '.join(MEASURE_LABELS[m] for m in parsed['measures'])}" + (f" by {slice_text}" if slice_text else "") +
+                       f" from {parsed['start']:%Y-%m-%d} up to {parsed['end']:%Y-%m-%d}, applying the standard order filters.")
+        return {"df": result, "sql": sql, "explanation": explanation, "rollup": rollup, "refreshed_at": manifest["refreshed_at"]}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+def main(argv=None):
+    """Scheduled refresh, e.g. hourly from cron or Task Scheduler: `python rollup_store.py --db-url ... --schema your_schema`."""
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv("Secrets.env")  # before the defaults below read DB_URL, ROLLUP_SCHEMA, ROLLUP_DIR
+    parser = argparse.ArgumentParser(description="Refresh the local metric rollups by month partition.")
+    parser.add_argument("--db-url", default=os.getenv("DB_URL"), help="SQLAlchemy URL of the database")
+    parser.add_argument("--schema", default=os.getenv("ROLLUP_SCHEMA", "your_schema"))
+    parser.add_argument("--root", default=os.getenv("ROLLUP_DIR", DEFAULT_ROLLUP_DIR))
+    parser.add_argument("--filters", default=os.getenv("ROLLUP_FILTERS", BASE_FILTERS), help="Part 2-C order filters, as in the system prompt")
+    parser.add_argument("--recent-months", type=int, default=2, help="trailing months rebuilt on every run")
+    parser.add_argument("--full", action="store_true", help="rebuild every partition")
+    args = parser.parse_args(argv)
+    if not args.db_url:
+        parser.error("--db-url (or DB_URL) is required")
+    print(RollupStore(args.root, args.filters).refresh(create_engine(args.db_url), args.schema, recent_months=args.recent_months, full=args.full))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
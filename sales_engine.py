@@ -0,0 +1,707 @@
+import datetime
+import html
+import os
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import background_tasks
+from chat_history import HistoryManager
+from example_library import ExampleLibrary, DEFAULT_LIBRARY_PATH, format_examples
+from frame_compaction import compact_frame
+from model_router import ModelRouter, template_follow_ups
+from query_governor import QueryGovernor, table_row_estimates
+from query_service import QueryService, create_pooled_engine
+from result_cache import ResultCache
+from result_store import ResultStore, DEFAULT_STORE_DIR
+from rollup_store import RollupStore, RollupRouter, BASE_FILTERS, DEFAULT_ROLLUP_DIR
+from schema_index import SchemaIndex, estimate_tokens, filter_schema_hint, format_schema_section
+from schema_snapshot import DEFAULT_SNAPSHOT_PATH, load_snapshot, refresh_snapshot, schema_column_map
+from sql_cache import SqlCache, DEFAULT_CACHE_PATH
+from sql_generation import parse_sql_reply, read_sql_stream, generate_follow_up_questions
+from system_prompt import PromptArtifacts, DEFAULT_PROMPT_DIR, FY_NAMED_BY_START, SCHEMA_PLACEHOLDER
+from tracing import Tracer, DEFAULT_TRACE_PATH
+
+load_dotenv("Secrets.env")
+SCHEMAS_TO_INCLUDE = ['your_schema_name'] # Your DB schema names
+# Business terms from Part 2 of the system prompt and the tables that implement them; feeds the schema pruning index.
+BUSINESS_TERM_TABLES = {
+    "quantity qty volume sold top selling best selling": ["Sales_SalesOrderLines"],
+    "total net amount gross sales revenue sales product": ["Sales_SalesOrderLines"],
+    "source channel sales channel tv web mobile fpc": ["Sales_MstSalesChannels"],
+    "discount": ["Discount_Discounts"],
+    "target daily hourly": ["Sales_SaleTargets"],
+    "mobile target": ["Sales_MobileTargets"],
+    "target price auction duration": ["Auction_TVAuctionPrice"],
+    "department mobile": ["Sales_SalesOrders", "System_MstDepartments"],
+    "order count unique customers new customers customer acquisition cash sales": ["Sales_SalesOrders"],
+    "budget pay pnp gcpm margin loss": ["System_MstBudgetPay"],
+}
+CORE_TABLES = ["Sales_SalesOrderLines", "Sales_SalesOrders"] # Always sent, even when pruning
+PRUNE_SCHEMA = os.getenv("PRUNE_SCHEMA", "1") == "1"
+FOLLOW_UP_PHRASES = ["for the same", "how about", "what about", "also"]
+QUERY_LIMITS = {
+    "chunk_rows": int(os.getenv("QUERY_CHUNK_ROWS", "5000")),
+    "max_rows": int(os.getenv("QUERY_MAX_ROWS", "100000")),
+    "max_bytes": int(float(os.getenv("QUERY_MAX_MB", "256")) * 1024 ** 2),
+    "timeout_seconds": float(os.getenv("QUERY_TIMEOUT_SECONDS", "120")),
+}
+GOVERN_QUERIES = os.getenv("GOVERN_QUERIES", "1") == "1" # Estimated-plan check before generated SQL runs
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "1") == "1" # Answer plain metric questions from the local rollups (see rollup_store.py)
+FEW_SHOT_EXAMPLES = int(os.getenv("FEW_SHOT_EXAMPLES", "3")) # Closest answered questions sent with each new one (0 disables)
+COMPACT_RESULTS = os.getenv("COMPACT_RESULTS", "1") == "1" # Default for new conversations: smaller dtypes for fetched results
+STREAM_SQL = os.getenv("STREAM_SQL", "1") == "1" # Read the reply as it is written and run the SQL as soon as its block closes
+SUGGESTION_TIMEOUT_SECONDS = float(os.getenv("SUGGESTION_TIMEOUT_SECONDS", "60"))
+
+
+def database_engine_from_env():
+    """The pooled SQLAlchemy engine: DB_URL when set (any dialect), else SQL Server over ODBC with DB_UID/DB_PWD."""
+    url = os.getenv("DB_URL")
+    if not url:
+        params = urllib.parse.quote_plus(
+            "DRIVER={ODBC Driver 17 for SQL Server};"
+            "SERVER=Connection_String;" # Your DB Connection String
+            "DATABASE=Database;" # Your Database Name
+            f"UID={os.getenv('DB_UID')};"
+            f"PWD={os.getenv('DB_PWD')}"
+        )
+        url = f"mssql+pyodbc:///?odbc_connect={params}"
+    return create_pooled_engine(url, pool_size=int(os.getenv("DB_POOL_SIZE", "6")), max_overflow=int(os.getenv("DB_POOL_OVERFLOW", "2")),
+                                pool_recycle=int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800")), pool_timeout=float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30")))
+
+
+def explain_schema(snapshot) -> str:
+    from schema_manager import get_llm_explanation # Your LLM explanation (schema_manager.py)
+    return get_llm_explanation(schema_column_map(snapshot))
+
+
+def is_follow_up(question) -> bool:
+    return any(phrase in question.lower() for phrase in FOLLOW_UP_PHRASES)
+
+
+def validate_question(question):
+    detected_issues = []
+    question_padded = f" {question.lower()} "
+    known_terms = {
+        "volume": ["Sold Quantity", "Cancelled Quantity", "Quantity"], # Placeholder columns
+        "date": ["OrderDate", "DispatchDate", "DeliveryDate", "CancelDate", "CreatedDate"], # Placeholder columns
+        "price": ["UnitPrice", "NetPrice", "PriceAfterDiscount"], # Placeholder columns
+        "top product": ["Highest TotalNetAmount", "Highest Quantity"], # Placeholder columns
+    }
+    for term, options in known_terms.items():
+        if f" {term.strip()} " in question_padded:
+            detected_issues.append({'type': 'ambiguity', 'term': term.strip(), 'options': options})
+            return detected_issues
+
+    time_spec_found = False
+    if "year"or"last" in question_padded:
+        time_spec_found = True
+    if not time_spec_found:
+        potential_years = re.findall(r'\b\d{4}\b', question)
+        if potential_years:
+            current_year = datetime.datetime.now().year
+            for year_str in potential_years:
+                year = int(year_str)
+                if 2019 < year <= current_year + 1: # Placeholder year range
+                    time_spec_found = True
+                    break
+    if not time_spec_found:
+        detected_issues.append({'type': 'year', 'message': "No time period specified. Please specify the 'YEAR' or 'FY' (e.g., 2025)."})
+    return detected_issues
+
+
+def sql_expander_html(sql_query):
+    return f"""<div style="display: flex; justify-content: left; align-items: left;">
+<details>
+    <summary>View Generated SQL</summary>
+    <pre><code class="language-sql">{html.escape(sql_query)}</code></pre>
+</details>
+</div>"""
+
+
+def execution_status(df, error) -> str:
+    """The chat line reporting how a query went."""
+    if error:
+        return f"❌ Query execution failed: {error}"
+    if df.empty:
+        return "✅ Query executed successfully, but returned no results."
+    if df.attrs.get("partial_result") == "cancelled":
+        return f"⛔ Query cancelled. Showing the {len(df):,} rows received before cancelling."
+    if df.attrs.get("partial_result") == "truncated":
+        return f"⚠️ Result capped at {len(df):,} rows to protect the app. Add filters or a TOP (N) to narrow it down."
+    if "result_cache_stored_at" in df.attrs:
+        cached_at = datetime.datetime.fromtimestamp(df.attrs["result_cache_stored_at"]).strftime("%H:%M:%S")
+        return f"✅ Query executed successfully! (cached result from {cached_at})"
+    return "✅ Query executed successfully!"
+
+
+def result_variant(compact) -> str:
+    """ResultCache variant of a frame: compacted and raw results of one query are cached apart."""
+    return "compact" if compact else ""
+
+
+def compact_result(df, enabled):
+    """Downcasts numbers and encodes text columns (see frame_compaction.py); the saving is kept in df.attrs."""
+    if not enabled or df is None or df.empty:
+        return df
+    compacted, report = compact_frame(df)
+    compacted.attrs["compaction"] = {"before_bytes": report["before_bytes"], "after_bytes": report["after_bytes"]}
+    return compacted
+
+
+class Conversation:
+    """One chat: its messages (the dicts the UI renders and the history is built from), the Gemini
+    chat reused across turns and the state of the turn in progress.
+
+    Not thread-safe; callers run one turn of a conversation at a time. `id` names the conversation's
+    results in the result store, `user` is its key in the database's fair queue."""
+
+    def __init__(self, conversation_id=None, user=None, compact_results=COMPACT_RESULTS):
+        self.id = conversation_id or uuid.uuid4().hex
+        self.user = user or self.id
+        self.messages = [{"role": "assistant", "content": "Hello, How can I help you?"}]
+        self.question = ""
+        self.clarification = None  # the first issue validate_question found in `question`
+        self.chat = None
+        self.trace_id = None
+        self.trace_started = None
+        self.attempts_since_answer = 0
+        self.used_examples = False
+        self.compact_results = compact_results
+        self.result_handle = None
+        self.pending = None  # SQL waiting for a plan confirmation: {"sql", "suggestions"}
+        self.route = None  # ModelRouter route of the turn in progress
+        self.unrecorded_route = None  # route name whose generated SQL has not run yet
+        self.repair = None  # {"sql", "error"} of a failed query the escalated model should fix
+        self.sql_cache_hit = None  # (question, prompt hash) when the turn's SQL came from the SQL cache
+        self.last_prompt_stats = None
+        self.last_history_stats = None
+        self.last_compaction = None
+        self.created_at = self.last_active = time.time()
+
+
+class SalesEngine:
+    """The question -> SQL -> result pipeline, without any UI.
+
+    Holds what every conversation shares (database engine, caches, result store, query queue,
+    tracer, example library, rollups and the compiled prompt); the per-chat state lives in
+    Conversation objects. The Streamlit app drives it one phase per rerun; `ask` runs a whole turn
+    for the HTTP API, load tests and other services. `sql_model` and `suggestion_model` replace
+    Gemini on every tier (e.g. with stub_llm.StubModel); `router` sets a client per tier instead."""
+
+    def __init__(self, db_engine, schemas=SCHEMAS_TO_INCLUDE, explain=explain_schema, sql_model=None, suggestion_model=None, router=None):
+        self.db_engine = db_engine
+        self.schemas = schemas
+        self.explain = explain
+        clients = {tier: sql_model.with_system_instruction for tier in ("fast", "standard", "strong")} if sql_model is not None else None
+        self.router = router or ModelRouter.from_env(clients=clients, suggestion_client=suggestion_model)
+        # Spans go to a JSON lines log (TRACING=0 keeps them in memory only) and a ring buffer for the admin panel.
+        trace_path = os.getenv("TRACE_PATH", DEFAULT_TRACE_PATH) if os.getenv("TRACING", "1") == "1" else None
+        self.tracer = Tracer(trace_path, sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1")))
+        self.sql_cache = SqlCache(os.getenv("SQL_CACHE_PATH", DEFAULT_CACHE_PATH), max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "2000")),
+                                  ttl_seconds=float(os.getenv("SQL_CACHE_TTL_HOURS", "168")) * 3600)
+        self.result_cache = ResultCache(max_bytes=int(float(os.getenv("RESULT_CACHE_MB", "512")) * 1024 ** 2),
+                                        default_ttl=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600")))
+        self.result_store = ResultStore(os.getenv("RESULT_STORE_DIR", DEFAULT_STORE_DIR), max_bytes=int(float(os.getenv("RESULT_STORE_MB", "1024")) * 1024 ** 2),
+                                        session_max_bytes=int(float(os.getenv("RESULT_STORE_SESSION_MB", "128")) * 1024 ** 2),
+                                        session_ttl=float(os.getenv("RESULT_STORE_SESSION_TTL_HOURS", "12")) * 3600)
+        # Keep DB_MAX_CONCURRENT below the pool size: schema refreshes and plan checks need connections too.
+        self.query_service = QueryService(db_engine, max_concurrent=int(os.getenv("DB_MAX_CONCURRENT", "4")), max_queued=int(os.getenv("DB_MAX_QUEUED", "200")),
+                                          queue_timeout=float(os.getenv("DB_QUEUE_TIMEOUT_SECONDS", "300")))
+        self.example_library = ExampleLibrary(os.getenv("EXAMPLE_LIBRARY_PATH", DEFAULT_LIBRARY_PATH), max_entries=int(os.getenv("EXAMPLE_LIBRARY_MAX_ENTRIES", "5000")))
+        self.prompt_artifacts = PromptArtifacts(os.getenv("PROMPT_DIR", DEFAULT_PROMPT_DIR))
+        self.history_manager = HistoryManager(token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")), keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", "4")))
+        self.schema_refresh_seconds = float(os.getenv("SCHEMA_REFRESH_SECONDS", "3600"))
+        self._snapshot = None
+        self._snapshot_loaded = 0.0
+        self._schema_lock = threading.Lock()
+        self._index = None
+        self._pruned_prompts = OrderedDict()  # (prompt key, selected tables) -> pruned prompt
+        self._governor = None
+        self._rollup_router = None
+        self._lazy_lock = threading.Lock()
+
+    # --- Shared resources ---
+
+    def schema(self):
+        """Bulk catalog queries plus an on-disk snapshot, refreshed every SCHEMA_REFRESH_SECONDS; refreshes only re-read tables whose modify_date moved."""
+        with self._schema_lock:
+            if self._snapshot is None or time.time() - self._snapshot_loaded > self.schema_refresh_seconds:
+                snapshot_path = os.getenv("SCHEMA_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+                with self.tracer.span("schema_load") as span:
+                    try:
+                        self._snapshot = refresh_snapshot(self.db_engine, self.schemas, snapshot_path)
+                        span.update(tables=len(self._snapshot["tables"]), reread=self._snapshot["last_refresh"]["reread"])
+                    except Exception as e:
+                        print(f"Could not refresh schema snapshot, falling back to the last one on disk: {e}")
+                        span["fallback"] = str(e)[:200]
+                        self._snapshot = load_snapshot(snapshot_path) or self._snapshot
+                self._snapshot_loaded = time.time()
+            return self._snapshot
+
+    def schema_index(self, snapshot):
+        index = self._index
+        if index is None or index[0] != snapshot["fingerprint"]:
+            index = (snapshot["fingerprint"], SchemaIndex(snapshot["tables"], business_terms=BUSINESS_TERM_TABLES, always_include=CORE_TABLES))
+            self._index = index
+        return index[1]
+
+    def prompt(self) -> dict:
+        """The compiled system prompt for the current schema (see system_prompt.py), or None without a schema."""
+        snapshot = self.schema()
+        if not snapshot or not snapshot["tables"]:
+            return None
+        return self.prompt_artifacts.get(snapshot, self.explain)
+
+    @property
+    def governor(self):
+        # SQL Server plans carry their own cardinalities; the snapshot's row estimates size SQLite scans.
+        with self._lazy_lock:
+            if self._governor is None:
+                self._governor = QueryGovernor(self.db_engine, table_rows=table_row_estimates(self.schema()),
+                                               big_table_rows=int(os.getenv("GOVERNOR_BIG_TABLE_ROWS", "1000000")),
+                                               confirm_cost=float(os.getenv("GOVERNOR_CONFIRM_COST", "50")), block_cost=float(os.getenv("GOVERNOR_BLOCK_COST", "1000")),
+                                               confirm_rows=int(os.getenv("GOVERNOR_CONFIRM_ROWS", "1000000")), block_rows=int(os.getenv("GOVERNOR_BLOCK_ROWS", "100000000")),
+                                               ttl_seconds=float(os.getenv("GOVERNOR_TTL_SECONDS", "3600")))
+            return self._governor
+
+    @property
+    def rollup_router(self):
+        # Refreshed by `python rollup_store.py` on a schedule, or in-process when ROLLUP_REFRESH_MINUTES is set.
+        with self._lazy_lock:
+            if self._rollup_router is None:
+                store = RollupStore(os.getenv("ROLLUP_DIR", DEFAULT_ROLLUP_DIR), os.getenv("ROLLUP_FILTERS", BASE_FILTERS))
+                refresh_minutes = float(os.getenv("ROLLUP_REFRESH_MINUTES", "0"))
+                if refresh_minutes > 0:
+                    store.start_scheduler(self.db_engine, self.schemas[0], refresh_minutes * 60)
+                self._rollup_router = RollupRouter(store, max_age_seconds=float(os.getenv("ROLLUP_MAX_AGE_HOURS", "6")) * 3600,
+                                                   fy_named_by_start=FY_NAMED_BY_START, dialect=self.db_engine.dialect.name)
+            return self._rollup_router
+
+    # --- Conversation state ---
+
+    def take_message(self, conversation, text, validate=True):
+        """Applies a chat message: a follow-up or suggestion runs as it is, a reply to a missing-year
+        question completes the pending one, anything else starts a new question. Returns the
+        clarification still needed, or None when `conversation.question` is ready to run."""
+        pending = conversation.clarification
+        conversation.clarification = None
+        conversation.last_active = time.time()
+        if not validate or is_follow_up(text):
+            conversation.question = text
+            conversation.messages.append({"role": "user", "content": text})
+            return None
+        if pending and pending["type"] == "year":
+            conversation.question = f"{conversation.question} {text}"
+            if conversation.messages and conversation.messages[-1]["role"] == "user":
+                conversation.messages[-1]["content"] = conversation.question
+        else:
+            conversation.question = text
+            conversation.messages.append({"role": "user", "content": text})
+        return self._validate(conversation)
+
+    def resolve_ambiguity(self, conversation, choice):
+        """Replaces the ambiguous term of the pending question with the chosen meaning."""
+        conversation.question = conversation.question.replace(conversation.clarification["term"], choice)
+        conversation.clarification = None
+        return self._validate(conversation)
+
+    def _validate(self, conversation):
+        issues = validate_question(conversation.question)
+        conversation.clarification = issues[0] if issues else None
+        return conversation.clarification
+
+    def start_trace(self, conversation):
+        conversation.trace_id = self.tracer.new_trace()
+        conversation.trace_started = time.time()
+        conversation.route = conversation.unrecorded_route = conversation.repair = None
+
+    def finish_trace(self, conversation, outcome):
+        trace_id = conversation.trace_id
+        if trace_id is None:
+            return
+        self.tracer.record("request", time.time() - conversation.trace_started, trace_id, question=conversation.question[:200], outcome=outcome)
+        self.tracer.end_trace(trace_id)
+        conversation.trace_id = None
+
+    def reset(self, conversation):
+        """Drops the conversation's stored results and anything it still has running."""
+        self.finish_trace(conversation, "reset")
+        self.result_store.drop_session(conversation.id)
+        if conversation.pending is not None:
+            background_tasks.discard(conversation.pending["suggestions"])
+            conversation.pending = None
+
+    # --- Pipeline stages ---
+
+    def build_question_prompt(self, conversation, question):
+        """System prompt carrying only the tables relevant to this question (top-K plus FK neighbours)."""
+        artifact = self.prompt()
+        if artifact is None:
+            return ""
+        if not PRUNE_SCHEMA:
+            return artifact["system_prompt"]
+        snapshot = self.schema()
+        # Earlier questions keep follow-ups such as "what about last year?" on the same tables.
+        context = " ".join(msg["content"] for msg in conversation.messages if msg["role"] == "user" and msg["content"] != question)
+        with self.tracer.span("prompt_build", conversation.trace_id) as span:
+            selected = self.schema_index(snapshot).select(question, context=" ".join(context.split()[-60:]))
+            if not selected:
+                return artifact["system_prompt"]
+            key = (artifact["key"], tuple(selected))
+            pruned_prompt = self._pruned_prompts.get(key)
+            if pruned_prompt is None:
+                hint = filter_schema_hint(artifact["schema_hint"], selected)
+                pruned_prompt = artifact["template"].replace(SCHEMA_PLACEHOLDER, format_schema_section({name: snapshot["tables"][name] for name in selected}, hint))
+                self._pruned_prompts[key] = pruned_prompt
+                while len(self._pruned_prompts) > 256:
+                    self._pruned_prompts.popitem(last=False)
+            span.update(tables=len(selected), prompt_tokens=estimate_tokens(pruned_prompt))
+        conversation.last_prompt_stats = {"full_tokens": estimate_tokens(artifact["system_prompt"]), "pruned_tokens": estimate_tokens(pruned_prompt),
+                                          "tables": len(selected), "total_tables": len(snapshot["tables"])}
+        return pruned_prompt
+
+    def route_question(self, conversation, question):
+        """The model route for `question`: tables it matches, metric formulas it names and the conversation's length."""
+        snapshot = self.schema()
+        matched = self.schema_index(snapshot).score(question) if snapshot else {}
+        earlier_turns = sum(1 for msg in conversation.messages if msg["role"] == "user") - 1
+        return self.router.route(question, [name for name in matched if name not in CORE_TABLES], max(earlier_turns, 0))
+
+    def escalate(self, conversation, sql, error):
+        """After `sql` failed to run, switches the turn to the strong model with the error to fix; False
+        when the failure is not the query's fault or the turn already escalated."""
+        route = self.router.escalate(conversation.route, error)
+        if route is None:
+            return False
+        conversation.route = route
+        conversation.repair = {"sql": sql, "error": str(error)[:1000]}
+        conversation.messages.append({"role": "assistant", "content": f"🔁 Retrying with a stronger model ({route['model'] or route['tier']})."})
+        self.tracer.record("model_escalate", 0.0, conversation.trace_id, model=route["model"])
+        return True
+
+    def _record_route_outcome(self, conversation, ok):
+        if conversation.unrecorded_route is not None:
+            self.router.record(conversation.unrecorded_route, ok=ok)
+            conversation.unrecorded_route = None
+
+    def generate_sql(self, conversation, question, on_explanation=None):
+        """(explanation, sql, error). `on_explanation` gets the explanation as it streams in."""
+        try:
+            explanation, sql, error = self._generate_sql(conversation, question, on_explanation)
+            if error or not sql:
+                self._record_route_outcome(conversation, False)
+            return explanation, sql, error
+        finally:
+            conversation.attempts_since_answer += 1
+            self.example_library.record_attempt(conversation.used_examples)
+
+    def _generate_sql(self, conversation, question, on_explanation):
+        # Follow-ups depend on the conversation, so only standalone questions are served from the cache.
+        conversation.used_examples = False
+        repair, conversation.repair = conversation.repair, None
+        if conversation.route is None or repair is None:
+            conversation.route = self.route_question(conversation, question)
+        route = conversation.route
+        artifact = self.prompt()
+        prompt_hash = self.sql_cache.hash_prompt(artifact["system_prompt"] if artifact else "")
+        cacheable = not is_follow_up(question)
+        conversation.sql_cache_hit = None
+        if cacheable and repair is None:
+            cached = self.sql_cache.get(question, prompt_hash)
+            if cached:
+                conversation.sql_cache_hit = (question, prompt_hash)
+                self.tracer.record("sql_cache_hit", 0.0, conversation.trace_id)
+                return cached[0], cached[1], None
+        with self.tracer.span("history_build", conversation.trace_id):
+            gemini_history, conversation.last_history_stats = self.history_manager.build(conversation.messages, question)
+        # Examples ride along with the message, not the system prompt, so the per-prompt model cache still hits.
+        examples = self.example_library.search(question, k=FEW_SHOT_EXAMPLES) if FEW_SHOT_EXAMPLES else []
+        conversation.used_examples = bool(examples)
+        message = format_examples(examples) + question
+        if repair is not None:
+            message += f"\n\nThis query failed:\n```sql\n{repair['sql']}\n```\nError: {repair['error']}\nWrite a corrected query."
+        route_name = self.router.name(route)
+        started = time.perf_counter()
+        try:
+            model = self.router.model(route, self.build_question_prompt(conversation, question))
+            with self.tracer.span("llm_generate", conversation.trace_id, history_tokens=conversation.last_history_stats["history_tokens"], examples=len(examples),
+                                  tier=route["tier"], model=route["model"], escalated=route["escalated"], complexity=route["signals"]["score"]) as span:
+                chat = conversation.chat
+                if chat is None or chat.model is not model:
+                    chat = model.start_chat(history=gemini_history)
+                    conversation.chat = chat
+                else:
+                    chat.history = gemini_history
+                if STREAM_SQL:
+                    # The rest of the reply (validation notes) is dropped; the next turn resets chat.history anyway.
+                    explanation, sql, response = read_sql_stream(chat.send_message(message, stream=True), on_explanation)
+                    span["streamed"] = True
+                else:
+                    response = chat.send_message(message)
+                    explanation, sql = parse_sql_reply(response.text)
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    span.update(prompt_tokens=usage.prompt_token_count, response_tokens=usage.candidates_token_count)
+        except Exception as e:
+            self.router.record(route_name, time.perf_counter() - started)
+            conversation.unrecorded_route = route_name
+            return None, None, f"Gemini failed: {e}"
+        self.router.record(route_name, time.perf_counter() - started)
+        conversation.unrecorded_route = route_name
+        if sql and cacheable:
+            # Cached only once it has run (see `_settle_sql_cache`).
+            self.sql_cache.hold(question, prompt_hash, explanation, sql, gen_seconds=time.perf_counter() - started)
+        return explanation, sql, None
+
+    def route_rollup(self, conversation, question):
+        """The rollup answer to a plain metric question (see RollupRouter.route), or None."""
+        if not USE_ROLLUPS:
+            return None
+        with self.tracer.span("rollup_route", conversation.trace_id) as span:
+            routed = self.rollup_router.route(question)
+            span["routed"] = routed is not None
+        return routed
+
+    def answer_from_rollup(self, conversation, routed):
+        """Records a rollup answer like a query result; its equivalent SQL is what Refresh and follow-ups see.
+        Returns the follow-up suggestions future."""
+        refreshed_at = datetime.datetime.fromtimestamp(routed["refreshed_at"]).strftime("%Y-%m-%d %H:%M")
+        conversation.messages.append({"role": "assistant", "content": f"{routed['explanation']}\n\n{sql_expander_html(routed['sql'])}"})
+        conversation.messages.append({"role": "assistant", "content": f"⚡ Answered from the local rollup in {routed['ms']:.0f} ms (data as of {refreshed_at})."})
+        conversation.result_handle = self.result_store.put(conversation.id, routed["df"])
+        conversation.messages.append({"role": "dataframe", "handle": conversation.result_handle, "sql": routed["sql"], "result_id": uuid.uuid4().hex})
+        conversation.attempts_since_answer = 0
+        conversation.route = {"tier": "rollup", "model": None, "suggestions": "template", "escalated": False, "signals": {}}
+        return self.suggest_follow_ups(conversation, conversation.question, routed["sql"])
+
+    def add_sql_message(self, conversation, explanation, sql):
+        conversation.messages.append({"role": "assistant", "content": f"{explanation}\n\n{sql_expander_html(sql)}"})
+
+    def suggest_follow_ups(self, conversation, question, sql):
+        """Suggestions only need the question and the SQL, so they are generated while the query runs.
+        None for simple routes: `collect_follow_ups` then builds them from the result's columns."""
+        if conversation.route is not None and conversation.route["suggestions"] == "template":
+            return None
+        return background_tasks.submit(self._suggest_traced, conversation.trace_id, question, sql)
+
+    def _suggest_traced(self, trace_id, question, sql):
+        started = time.perf_counter()
+        with self.tracer.span("suggestions", trace_id, source="llm"):
+            suggestions = generate_follow_up_questions(question, sql, model=self.router.suggestion_model())
+        self.router.record("suggestions:llm", time.perf_counter() - started, ok=bool(suggestions))
+        return suggestions
+
+    def collect_follow_ups(self, conversation, future, timeout=SUGGESTION_TIMEOUT_SECONDS) -> list:
+        """The suggestions of `future`, or when it is None the template ones for the stored result."""
+        if future is not None:
+            return future.result(timeout=timeout)
+        started = time.perf_counter()
+        with self.tracer.span("suggestions", conversation.trace_id, source="template"):
+            suggestions = template_follow_ups(conversation.question, self.result_store.get(conversation.result_handle) if conversation.result_handle else None)
+        self.router.record("suggestions:template", time.perf_counter() - started, ok=bool(suggestions))
+        return suggestions
+
+    def check_plan(self, conversation, sql):
+        """Pre-flight check on the estimated plan, attached to the SQL message; None when queries are not governed."""
+        if not GOVERN_QUERIES:
+            return None
+        with self.tracer.span("plan_check", conversation.trace_id) as span:
+            plan = self.governor.check(sql)
+            span.update(verdict=plan["verdict"], cached=plan["cached"])
+        sql_message = next((msg for msg in reversed(conversation.messages) if msg["role"] == "assistant"), None)
+        if sql_message is not None:
+            sql_message["plan"] = plan
+        return plan
+
+    def block_query(self, conversation, plan, sql):
+        self._settle_sql_cache(conversation, sql, ok=False)
+        reasons = "\n".join(f"- {reason}" for reason in plan["reasons"])
+        conversation.messages.append({"role": "assistant", "content": f"🛑 Query blocked: it would put too much load on the database.\n{reasons}\n\nTry a narrower date range, more filters or a TOP (N)."})
+        self.finish_trace(conversation, "not_run")
+
+    def cached_result(self, conversation, sql):
+        df = self.result_cache.get(sql, result_variant(conversation.compact_results))
+        if df is not None:
+            self.tracer.record("result_cache_hit", 0.0, conversation.trace_id, rows=len(df))
+        return df
+
+    def submit_query(self, conversation, sql, use_cache=True):
+        """Starts the query as a QueryJob in the fair queue; pass it to `finish_query` once it is done."""
+        if not use_cache:
+            self.result_cache.record_bypass()
+        return self.query_service.submit(sql, conversation.user, **QUERY_LIMITS)
+
+    def finish_query(self, conversation, job):
+        """(df, error) of a finished job: records its spans, compacts the frame and caches it."""
+        if job.queued_seconds:
+            self.tracer.record("queue_wait", job.queued_seconds, conversation.trace_id)
+        self.tracer.record("sql_execute", job.elapsed - job.queued_seconds, conversation.trace_id, rows=job.rows, bytes=job.bytes,
+                           status=job.status, first_row_ms=round(job.time_to_first_row * 1000, 1) if job.time_to_first_row else None, sql=job.sql[:500])
+        df, error = job.result()
+        if error:
+            return None, error
+        if conversation.compact_results:
+            with self.tracer.span("compact", conversation.trace_id) as span:
+                df = compact_result(df, True)
+                span.update(df.attrs.get("compaction", {}))
+        if df.attrs.get("partial_result") != "cancelled":
+            self.result_cache.put(job.sql, df, result_variant(conversation.compact_results))
+        return df, None
+
+    def execute(self, conversation, sql, use_cache=True):
+        """Blocking run of `sql` for the conversation: the result cache, else the database."""
+        if use_cache:
+            df = self.cached_result(conversation, sql)
+            if df is not None:
+                return df, None
+        job = self.submit_query(conversation, sql, use_cache)
+        job.wait()
+        return self.finish_query(conversation, job)
+
+    def execute_sql(self, sql, user, use_cache=True, compact=COMPACT_RESULTS):
+        """Untraced run outside any conversation (batch workers, refreshes)."""
+        if use_cache:
+            cached_df = self.result_cache.get(sql, result_variant(compact))
+            if cached_df is not None:
+                return cached_df, None
+        else:
+            self.result_cache.record_bypass()
+        df, error = self.query_service.run(sql, user, **QUERY_LIMITS).result()
+        if error:
+            return None, error
+        df = compact_result(df, compact)
+        if df.attrs.get("partial_result") != "cancelled":
+            self.result_cache.put(sql, df, result_variant(compact))
+        return df, None
+
+    def export_chunks(self, sql, user, chunk_rows, max_rows, timeout_seconds):
+        """Streams the full result of `sql` for an export, after the same plan check as an interactive
+        run; raises RuntimeError when the governor blocks it or the statement times out."""
+        if GOVERN_QUERIES:
+            plan = self.governor.check(sql)
+            if plan["verdict"] == "block":
+                raise RuntimeError("Blocked by the query cost governor: " + "; ".join(plan["reasons"]))
+        yield from self.query_service.stream(sql, user, chunk_rows, max_rows=max_rows, timeout_seconds=timeout_seconds)
+
+    def record_result(self, conversation, sql, df, error):
+        """Adds the outcome to the chat and stores the frame; True when there are rows to show."""
+        conversation.messages.append({"role": "assistant", "content": execution_status(df, error)})
+        conversation.result_handle = self.result_store.put(conversation.id, df) if df is not None else None
+        conversation.last_compaction = df.attrs.get("compaction") if df is not None else None
+        self._record_route_outcome(conversation, error is None)
+        self._settle_sql_cache(conversation, sql, ok=error is None)
+        if df is None or df.empty:
+            return False
+        standalone = not is_follow_up(conversation.question)
+        conversation.messages.append({"role": "dataframe", "handle": conversation.result_handle, "sql": sql, "result_id": uuid.uuid4().hex,
+                                      "question": conversation.question if standalone else None})
+        if standalone and df.attrs.get("partial_result") != "cancelled":
+            self.example_library.add(conversation.question, sql)
+        self.example_library.record_answer(conversation.used_examples, conversation.attempts_since_answer)
+        conversation.attempts_since_answer = 0
+        return True
+
+    def _settle_sql_cache(self, conversation, sql, ok):
+        """Caches generated SQL that ran; forgets SQL that failed or was blocked, including a cached entry that served it."""
+        if ok:
+            self.sql_cache.confirm(sql)
+            return
+        self.sql_cache.discard(sql)
+        if conversation.sql_cache_hit is not None:
+            self.sql_cache.invalidate(*conversation.sql_cache_hit)
+            conversation.sql_cache_hit = None
+
+    # --- Whole turns, for callers without a UI ---
+
+    def ask(self, conversation, text=None, choice=None, use_cache=True) -> dict:
+        """One chat turn end to end (see `take_message`); `choice` answers an ambiguity clarification instead of `text`."""
+        if conversation.pending is not None:
+            background_tasks.discard(conversation.pending["suggestions"])
+            conversation.pending = None
+        issue = self.resolve_ambiguity(conversation, choice) if choice is not None and conversation.clarification else self.take_message(conversation, text)
+        if issue:
+            return self._turn(conversation, "clarify", clarification=issue)
+        question = conversation.question
+        self.start_trace(conversation)
+        routed = self.route_rollup(conversation, question)
+        if routed is not None:
+            suggestions = self.answer_from_rollup(conversation, routed)
+            self.finish_trace(conversation, "rollup")
+            return self._turn(conversation, "answered", source="rollup", sql=routed["sql"], explanation=routed["explanation"],
+                              suggestions=self._collect(conversation, suggestions))
+        return self._generate_and_run(conversation, question, use_cache)
+
+    def _generate_and_run(self, conversation, question, use_cache):
+        explanation, sql, error = self.generate_sql(conversation, question)
+        if error or not sql:
+            conversation.messages.append({"role": "assistant", "content": f"❌ {error or explanation or 'The model did not generate a SQL query.'}"})
+            self.finish_trace(conversation, "generation_failed")
+            return self._turn(conversation, "failed", explanation=explanation, error=error or "no SQL generated")
+        self.add_sql_message(conversation, explanation, sql)
+        return self._run(conversation, sql, self.suggest_follow_ups(conversation, question, sql), use_cache, explanation=explanation)
+
+    def confirm(self, conversation, run=True, use_cache=True) -> dict:
+        """Runs (or drops) the query that `ask` held back for an expensive plan."""
+        pending, conversation.pending = conversation.pending, None
+        if pending is None:
+            return self._turn(conversation, "idle")
+        if not run:
+            background_tasks.discard(pending["suggestions"])
+            conversation.messages.append({"role": "assistant", "content": "Query not run. Narrow the question (date range, filters, TOP N) and ask again."})
+            self.finish_trace(conversation, "not_run")
+            return self._turn(conversation, "not_run", sql=pending["sql"])
+        return self._run(conversation, pending["sql"], pending["suggestions"], use_cache, approved=True)
+
+    def _run(self, conversation, sql, suggestions, use_cache, approved=False, explanation=None):
+        plan = None if approved else self.check_plan(conversation, sql)
+        if plan is not None and plan["verdict"] == "block":
+            background_tasks.discard(suggestions)
+            self.block_query(conversation, plan, sql)
+            return self._turn(conversation, "blocked", sql=sql, explanation=explanation, reasons=plan["reasons"])
+        if plan is not None and plan["verdict"] == "confirm":
+            conversation.pending = {"sql": sql, "suggestions": suggestions}
+            return self._turn(conversation, "needs_confirmation", sql=sql, explanation=explanation, reasons=plan["reasons"])
+        df, error = self.execute(conversation, sql, use_cache)
+        if not self.record_result(conversation, sql, df, error):
+            background_tasks.discard(suggestions)
+            if error and self.escalate(conversation, sql, error):
+                return self._generate_and_run(conversation, conversation.question, use_cache)
+            self.finish_trace(conversation, "failed" if error else "no_rows")
+            return self._turn(conversation, "failed" if error else "no_rows", sql=sql, explanation=explanation, error=error)
+        suggestions = self._collect(conversation, suggestions)
+        self.finish_trace(conversation, "done")
+        return self._turn(conversation, "answered", source="llm", sql=sql, explanation=explanation, suggestions=suggestions,
+                          model=conversation.route["model"], escalated=conversation.route["escalated"])
+
+    def _collect(self, conversation, future):
+        try:
+            return self.collect_follow_ups(conversation, future)
+        except Exception as e:
+            print(f"Could not generate follow-up questions: {e}")
+            return []
+
+    def _turn(self, conversation, status, **fields):
+        turn = {"conversation_id": conversation.id, "status": status, "question": conversation.question}
+        if status in ("answered", "no_rows", "failed"):
+            turn["message"] = next((msg["content"] for msg in reversed(conversation.messages) if msg["role"] == "assistant"), None)
+        if status == "answered":
+            info = self.result_store.info(conversation.result_handle)
+            turn["result"] = dict(info, handle=conversation.result_handle) if info else None
+        turn.update(fields)
+        return turn
+
+    def stats(self) -> dict:
+        stats = {"sql_cache": self.sql_cache.stats(), "result_cache": self.result_cache.stats(), "database": self.query_service.stats(),
+                 "result_store": self.result_store.stats(), "examples": self.example_library.stats(), "prompts": self.prompt_artifacts.stats(),
+                 "model_routes": self.router.stats()}
+        if self._governor is not None:
+            stats["governor"] = self._governor.stats()
+        if self._rollup_router is not None:
+            stats["rollups"] = self._rollup_router.stats()
+        return stats
@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "give", "how", "i", "in", "is",
+    "it", "me", "of", "on", "or", "per", "show", "the", "this", "to", "was", "what", "which", "with", "id", "name",
+}
+
+
+def tokenize(text: str):
+    """Splits identifiers and prose alike: snake_case, CamelCase and plurals collapse to the same tokens."""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    text = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1 \2", text)
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in _STOPWORDS or token.isdigit():
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English/SQL with Gemini's tokenizer; good enough for before/after ratios.
+    return (len(text or "") + 3) // 4
+
+
+class SchemaIndex:
+    """Local BM25 index over tables, scoring each question against table/column tokens, aliases and business terms."""
+
+    def __init__(self, tables: dict, business_terms: dict = None, always_include=(), k1: float = 1.2, b: float = 0.75):
+        self.tables = tables
+        self.k1, self.b = k1, b
+        self.docs = {}
+        self.always_include = [t for t in map(self._resolve, always_include) if t]
+        for name, info in tables.items():
+            base = name.split(".")[-1]
+            alias = "".join(w[0] for w in base.split("_") if w).lower()
+            doc = Counter()
+            # Table-name tokens weigh more than column tokens: "channel" should find Sales_MstSalesChannels first.
+            for token in tokenize(base):
+                doc[token] += 3
+            doc[alias] += 1
+            for column in info["columns"]:
+                doc.update(tokenize(column["name"]))
+            self.docs[name] = doc
+        for term, targets in (business_terms or {}).items():
+            for target in targets:
+                table = self._resolve(target)
+                if table:
+                    for token in tokenize(term):
+                        self.docs[table][token] += 3
+        self.avg_len = sum(sum(d.values()) for d in self.docs.values()) / max(len(self.docs), 1)
+        df = Counter(token for doc in self.docs.values() for token in doc)
+        n = len(self.docs)
+        self.idf = {token: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for token, freq in df.items()}
+        self.neighbours = defaultdict(set)
+        for name, info in tables.items():
+            for fk in info.get("foreign_keys", []):
+                if fk["ref_table"] in tables and fk["ref_table"] != name:
+                    self.neighbours[name].add(fk["ref_table"])
+                    self.neighbours[fk["ref_table"]].add(name)
+
+    def _resolve(self, target: str):
+        """Accepts "schema.Table" or a bare table name, case-insensitively."""
+        target = target.lower()
+        return next((n for n in self.tables if n.lower() == target or n.lower().endswith("." + target)), None)
+
+    def score(self, question: str, context: str = "", context_weight: float = 0.5) -> dict:
+        query = Counter(tokenize(question))
+        for token in tokenize(context):
+            query[token] += context_weight
+        scores = {}
+        for name, doc in self.docs.items():
+            doc_len = sum(doc.values())
+            total = 0.0
+            for token, q_weight in query.items():
+                tf = doc.get(token)
+                if tf:
+                    total += q_weight * self.idf[token] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_len / self.avg_len))
+            if total > 0:
+                scores[name] = total
+        return scores
+
+    def select(self, question: str, context: str = "", top_k: int = 6, max_neighbours: int = 6):
+        """Top-K tables plus their FK neighbours; an empty list means nothing matched and the caller should not prune."""
+        scores = self.score(question, context)
+        if not scores:
+            return []
+        selected = [name for name, _ in sorted(scores.items(), key=lambda kv: -kv[1])[:top_k]]
+        neighbours = {n for name in selected for n in self.neighbours[name]} - set(selected)
+        # Prefer neighbours the question also hints at, then the bigger (fact-like) tables.
+        ranked = sorted(neighbours, key=lambda n: (-scores.get(n, 0.0), -(self.tables[n].get("row_estimate") or 0), n))
+        selected += ranked[:max_neighbours]
+        selected += [t for t in self.always_include if t not in selected]
+        return selected
+
+
+def filter_schema_hint(hint: str, table_names) -> str:
+    """Keeps the paragraphs of the LLM schema summary that mention a selected table."""
+    if not hint:
+        return hint
+    bases = {name.split(".")[-1].lower() for name in table_names}
+    paragraphs = re.split(r"\n\s*\n", hint)
+    mentions_any = [p for p in paragraphs if re.search(r"\b\w+_\w+\b", p)]
+    if not mentions_any:
+        return hint
+    kept = [p for p in paragraphs if any(base in p.lower() for base in bases)]
+    return "\n\n".join(kept)
+
+
+def format_schema_section(tables: dict, one_big_llm_hint: str = "") -> str:
+    """Part 1 of the system prompt: one block per table with alias, row estimate, columns and keys."""
+    formatted = []
+    for table, info in sorted(tables.items()):
+        base = table.split('.')[-1]
+        alias = ''.join([w[0] for w in base.split('_') if w]).lower()
+        row_estimate = f", ~{info['row_estimate']:,} rows" if info.get("row_estimate") is not None else ""
+        formatted.append(f"Table: {table} (alias: {alias}{row_estimate})")
+        columns = ", ".join(f"`{c['name']}` {c['type']}" for c in info["columns"])
+        formatted.append(f"    Columns: ({columns})")
+        if info.get("primary_key"):
+            primary_key = ", ".join(f"`{c}`" for c in info["primary_key"])
+            formatted.append(f"    Primary key: ({primary_key})")
+        for fk in info.get("foreign_keys", []):
+            formatted.append(f"    Foreign key: ({', '.join(fk['columns'])}) -> {fk['ref_table']} ({', '.join(fk['ref_columns'])})")
+    if one_big_llm_hint:
+        formatted.append("\n### 🧠 LLM Schema Summary:\n")
+        formatted.append(one_big_llm_hint)
+    return "\n".join(formatted)
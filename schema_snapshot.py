@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import time
+
+from sqlalchemy import bindparam, text
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "schema_snapshot.json")
+SNAPSHOT_VERSION = 1
+_MAX_ID_PARAMS = 1000  # SQL Server allows 2100 parameters per statement
+
+_MSSQL_TABLES = """
+SELECT s.name AS schema_name, t.name AS table_name, t.object_id,
+       CONVERT(varchar(33), t.modify_date, 126) AS change_token,
+       (SELECT SUM(p.rows) FROM sys.partitions p WHERE p.object_id = t.object_id AND p.index_id IN (0, 1)) AS row_estimate
+FROM sys.tables t WITH (NOLOCK)
+JOIN sys.schemas s WITH (NOLOCK) ON s.schema_id = t.schema_id
+WHERE s.name IN :schemas
+"""
+
+_MSSQL_COLUMNS = """
+SELECT s.name AS schema_name, t.name AS table_name, c.name AS column_name, ty.name AS type_name,
+       c.max_length, c.precision, c.scale, c.is_nullable,
+       CASE WHEN pk.column_id IS NULL THEN 0 ELSE 1 END AS is_pk
+FROM sys.tables t WITH (NOLOCK)
+JOIN sys.schemas s WITH (NOLOCK) ON s.schema_id = t.schema_id
+JOIN sys.columns c WITH (NOLOCK) ON c.object_id = t.object_id
+JOIN sys.types ty WITH (NOLOCK) ON ty.user_type_id = c.user_type_id
+LEFT JOIN (
+    SELECT ic.object_id, ic.column_id
+    FROM sys.indexes i WITH (NOLOCK)
+    JOIN sys.index_columns ic WITH (NOLOCK) ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    WHERE i.is_primary_key = 1
+) pk ON pk.object_id = c.object_id AND pk.column_id = c.column_id
+WHERE s.name IN :schemas {object_filter}
+ORDER BY s.name, t.name, c.column_id
+"""
+
+_MSSQL_FOREIGN_KEYS = """
+SELECT ps.name AS schema_name, pt.name AS table_name, fk.name AS fk_name, pc.name AS column_name,
+       rs.name AS ref_schema, rt.name AS ref_table, rc.name AS ref_column
+FROM sys.foreign_keys fk WITH (NOLOCK)
+JOIN sys.foreign_key_columns fkc WITH (NOLOCK) ON fkc.constraint_object_id = fk.object_id
+JOIN sys.tables pt WITH (NOLOCK) ON pt.object_id = fk.parent_object_id
+JOIN sys.schemas ps WITH (NOLOCK) ON ps.schema_id = pt.schema_id
+JOIN sys.columns pc WITH (NOLOCK) ON pc.object_id = fkc.parent_object_id AND pc.column_id = fkc.parent_column_id
+JOIN sys.tables rt WITH (NOLOCK) ON rt.object_id = fk.referenced_object_id
+JOIN sys.schemas rs WITH (NOLOCK) ON rs.schema_id = rt.schema_id
+JOIN sys.columns rc WITH (NOLOCK) ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+WHERE ps.name IN :schemas {object_filter}
+ORDER BY ps.name, pt.name, fk.name, fkc.constraint_column_id
+"""
+
+
+def format_column_type(type_name, max_length=None, precision=None, scale=None) -> str:
+    type_name = (type_name or "").lower()
+    if type_name in ("varchar", "char", "varbinary", "binary", "nvarchar", "nchar"):
+        if max_length == -1:
+            return f"{type_name}(max)"
+        length = max_length // 2 if type_name in ("nvarchar", "nchar") and max_length else max_length
+        return f"{type_name}({length})" if length else type_name
+    if type_name in ("decimal", "numeric") and precision:
+        return f"{type_name}({precision},{scale or 0})"
+    return type_name
+
+
+def _empty_table(change_token, row_estimate=None):
+    return {"change_token": change_token, "row_estimate": row_estimate, "columns": [], "primary_key": [], "foreign_keys": []}
+
+
+def _add_foreign_key(tables, full_name, fk_name, column, ref_table, ref_column):
+    if full_name not in tables:
+        return
+    fks = tables[full_name]["foreign_keys"]
+    if fks and fks[-1]["name"] == fk_name:
+        fks[-1]["columns"].append(column)
+        fks[-1]["ref_columns"].append(ref_column)
+    else:
+        fks.append({"name": fk_name, "columns": [column], "ref_table": ref_table, "ref_columns": [ref_column]})
+
+
+def _mssql_catalog(conn, schemas):
+    rows = conn.execute(text(_MSSQL_TABLES).bindparams(bindparam("schemas", expanding=True)), {"schemas": schemas}).fetchall()
+    return {f"{r.schema_name}.{r.table_name}": (r.change_token, r.object_id, None if r.row_estimate is None else int(r.row_estimate)) for r in rows}
+
+
+def _mssql_details(conn, schemas, catalog, names):
+    tables = {name: _empty_table(catalog[name][0], catalog[name][2]) for name in names}
+    params = {"schemas": schemas}
+    binds = [bindparam("schemas", expanding=True)]
+    object_filter = ""
+    if len(names) <= _MAX_ID_PARAMS and len(names) < len(catalog):
+        object_filter = "AND t.object_id IN :object_ids"
+        params["object_ids"] = [catalog[name][1] for name in names]
+        binds.append(bindparam("object_ids", expanding=True))
+    for r in conn.execute(text(_MSSQL_COLUMNS.format(object_filter=object_filter)).bindparams(*binds), params):
+        table = tables.get(f"{r.schema_name}.{r.table_name}")
+        if table is None:
+            continue
+        table["columns"].append({"name": r.column_name, "type": format_column_type(r.type_name, r.max_length, r.precision, r.scale), "nullable": bool(r.is_nullable)})
+        if r.is_pk:
+            table["primary_key"].append(r.column_name)
+    fk_filter = object_filter.replace("t.object_id", "pt.object_id")
+    for r in conn.execute(text(_MSSQL_FOREIGN_KEYS.format(object_filter=fk_filter)).bindparams(*binds), params):
+        _add_foreign_key(tables, f"{r.schema_name}.{r.table_name}", r.fk_name, r.column_name, f"{r.ref_schema}.{r.ref_table}", r.ref_column)
+    return tables
+
+
+def _sqlite_catalog(conn, schemas):
+    """SQLite stand-in: schemas are attached databases, the DDL hash plays the role of modify_date."""
+    catalog = {}
+    for schema in schemas:
+        stats = {}
+        if conn.exec_driver_sql(f"SELECT 1 FROM \"{schema}\".sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            stats = {tbl: int(stat.split()[0]) for tbl, stat in conn.exec_driver_sql(f"SELECT tbl, stat FROM \"{schema}\".sqlite_stat1")}
+        for name, ddl in conn.exec_driver_sql(f"SELECT name, sql FROM \"{schema}\".sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+            catalog[f"{schema}.{name}"] = (hashlib.sha1((ddl or "").encode("utf-8")).hexdigest(), name, stats.get(name))
+    return catalog
+
+
+def _sqlite_details(conn, schemas, catalog, names):
+    tables = {name: _empty_table(catalog[name][0], catalog[name][2]) for name in names}
+    for schema in schemas:
+        column_sql = (f"SELECT m.name, p.name, p.type, p.\"notnull\", p.pk FROM \"{schema}\".sqlite_master m "
+                      f"JOIN pragma_table_info(m.name, '{schema}') p WHERE m.type = 'table' ORDER BY m.name, p.cid")
+        for table_name, column, type_name, notnull, pk in conn.exec_driver_sql(column_sql):
+            table = tables.get(f"{schema}.{table_name}")
+            if table is None:
+                continue
+            table["columns"].append({"name": column, "type": (type_name or "").lower(), "nullable": not notnull})
+            if pk:
+                table["primary_key"].append(column)
+        fk_sql = (f"SELECT m.name, f.id, f.\"from\", f.\"table\", f.\"to\" FROM \"{schema}\".sqlite_master m "
+                  f"JOIN pragma_foreign_key_list(m.name, '{schema}') f WHERE m.type = 'table' ORDER BY m.name, f.id, f.seq")
+        for table_name, fk_id, column, ref_table, ref_column in conn.exec_driver_sql(fk_sql):
+            _add_foreign_key(tables, f"{schema}.{table_name}", f"fk_{table_name}_{fk_id}", column, f"{schema}.{ref_table}", ref_column)
+    return tables
+
+
+_DIALECTS = {"mssql": (_mssql_catalog, _mssql_details), "sqlite": (_sqlite_catalog, _sqlite_details)}
+
+
+def snapshot_fingerprint(tables: dict) -> str:
+    """Hash of the table structure only; row estimates do not change it."""
+    structure = {name: [t["columns"], t["primary_key"], t["foreign_keys"]] for name, t in sorted(tables.items())}
+    return hashlib.sha256(json.dumps(structure, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_snapshot(path: str = DEFAULT_SNAPSHOT_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return snapshot if snapshot.get("version") == SNAPSHOT_VERSION else None
+
+
+def save_snapshot(snapshot: dict, path: str = DEFAULT_SNAPSHOT_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def refresh_snapshot(engine, schemas, path: str = DEFAULT_SNAPSHOT_PATH) -> dict:
+    """Loads the on-disk snapshot and re-reads only the tables whose change token moved."""
+    started = time.perf_counter()
+    catalog_fn, details_fn = _DIALECTS[engine.dialect.name]
+    previous = load_snapshot(path)
+    if previous and (previous.get("dialect") != engine.dialect.name or previous.get("schemas") != list(schemas)):
+        previous = None
+    old_tables = previous["tables"] if previous else {}
+    with engine.connect() as conn:
+        catalog = catalog_fn(conn, list(schemas))
+        stale = [name for name, (token, _, _) in catalog.items() if old_tables.get(name, {}).get("change_token") != token]
+        fresh = details_fn(conn, list(schemas), catalog, stale) if stale else {}
+    tables = {}
+    for name, (_, _, row_estimate) in sorted(catalog.items()):
+        table = fresh.get(name) or dict(old_tables[name])
+        table["row_estimate"] = row_estimate
+        tables[name] = table
+    snapshot = {
+        "version": SNAPSHOT_VERSION, "dialect": engine.dialect.name, "schemas": list(schemas),
+        "created": time.time(), "fingerprint": snapshot_fingerprint(tables), "tables": tables,
+        "last_refresh": {"full": previous is None, "reread": len(stale), "removed": len(set(old_tables) - set(catalog)),
+                         "seconds": round(time.perf_counter() - started, 3)},
+    }
+    if previous is None or stale or snapshot["last_refresh"]["removed"] or any(
+            old_tables[n].get("row_estimate") != t["row_estimate"] for n, t in tables.items() if n in old_tables):
+        save_snapshot(snapshot, path)
+    return snapshot
+
+
+def schema_column_map(snapshot: dict) -> dict:
+    """Legacy {"schema.table": [column names]} view of a snapshot."""
+    column_map = {}
+    schemas = snapshot.get("schemas", [])
+    for idx, schema in enumerate(schemas):
+        for name, table in snapshot["tables"].items():
+            if name.split(".", 1)[0] == schema:
+                column_map[name] = [c["name"] for c in table["columns"]]
+        if idx < len(schemas) - 1:
+            column_map[f"--- GAP ({schema} done) ---"] = []
+    return column_map
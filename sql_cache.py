@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sql_cache.sqlite3")
+
+# Literals that may differ between two otherwise identical questions. Order matters: the
+# more specific patterns must win over the bare number pattern.
+_LITERAL_PATTERNS = [
+    ("fy", r"\bfy\s?'?(\d{2}|\d{4})\b"),
+    ("date", r"\b\d{4}-\d{2}-\d{2}\b"),
+    ("string", r"'[^']+'|\"[^\"]+\""),
+    ("number", r"\b\d+(?:\.\d+)?\b"),
+]
+_LITERAL_RE = re.compile("|".join(f"(?P<{kind}>{pattern})" for kind, pattern in _LITERAL_PATTERNS), re.IGNORECASE)
+_SQL_STRING_RE = re.compile(r"'((?:[^']|'')*)'")  # contents of a SQL string literal ('' is an escaped quote)
+
+
+def normalize_question(question: str) -> str:
+    q = question.strip().lower()
+    q = re.sub(r"\s+", " ", q)
+    return q.rstrip("?.! ")
+
+
+def question_template(question: str):
+    """Splits a normalized question into a literal-free template and its ordered literals."""
+    literals = []
+
+    def _placeholder(match):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "fy":
+            year = int(re.search(r"\d+", value).group())
+            value = str(year + 2000 if year < 100 else year)
+        elif kind == "string":
+            value = value[1:-1]
+        literals.append((kind, value))
+        return f"<{kind}>"
+
+    return _LITERAL_RE.sub(_placeholder, normalize_question(question)), literals
+
+
+def _is_year(value: str) -> bool:
+    return value.isdigit() and len(value) == 4 and 1900 < int(value) < 2100
+
+
+def _map_sql(sql: str, in_string, outside) -> str:
+    """Applies `in_string` to the contents of each SQL string literal and `outside` to the text between them."""
+    parts, last = [], 0
+    for match in _SQL_STRING_RE.finditer(sql):
+        parts.append(outside(sql[last:match.start()]))
+        parts.append("'" + in_string(match.group(1)) + "'")
+        last = match.end()
+    parts.append(outside(sql[last:]))
+    return "".join(parts)
+
+
+def _number_re(value: str) -> str:
+    return rf"(?<![\w.]){re.escape(value)}(?![\w.])"
+
+
+def _year_in_string_re(year: str) -> str:
+    return rf"(?<!\d){year}(?!\d)"  # '2024-01-01', '%2024%'
+
+
+def _mentions_year(sql: str, year: str) -> bool:
+    return bool(re.search(_number_re(year), _SQL_STRING_RE.sub("''", sql))
+                or any(re.search(_year_in_string_re(year), literal) for literal in _SQL_STRING_RE.findall(sql)))
+
+
+def _year_span(kind: str, year: str) -> list:
+    """Years that move together with a year literal: a calendar year is filtered as a half-open range up
+    to the next year's start, a fiscal year (April to March) spans two calendar years."""
+    return [int(year) - 1, int(year), int(year) + 1] if kind == "fy" else [int(year), int(year) + 1]
+
+
+def rewrite_explanation(explanation: str, old_literals, new_literals) -> str:
+    """The cached explanation with the new question's literals, date bounds shifted as in `substitute_literals`."""
+    changes = {}
+    for (kind, old), (_, new) in zip(old_literals, new_literals):
+        if old == new:
+            continue
+        if kind == "fy" or (kind == "number" and _is_year(old) and _is_year(new)):
+            changes.update((str(year), str(year + int(new) - int(old))) for year in _year_span(kind, old))
+        else:
+            changes[old] = new
+    if not changes:
+        return explanation
+    pattern = "|".join(rf"(?<![\d.]){re.escape(old)}(?!\.?\d)" for old in sorted(changes, key=len, reverse=True))
+    return re.sub(pattern, lambda match: changes[match.group()], explanation)
+
+
+def substitute_literals(sql: str, old_literals, new_literals):
+    """Rewrites cached SQL for a template hit; returns None when a literal cannot be mapped safely.
+
+    Quoted literals from the question are only replaced inside SQL string literals, never in
+    identifiers such as table or column names; numbers only outside them. A year moves every bound
+    of its date range with it."""
+    years, replacements = {}, []
+    for (kind, old), (_, new) in zip(old_literals, new_literals):
+        if old == new:
+            continue
+        if kind == "fy" or (kind == "number" and _is_year(old) and _is_year(new)):
+            span = _year_span(kind, old)
+            if not any(_mentions_year(sql, str(year)) for year in span):
+                return None
+            delta = int(new) - int(old)
+            for year in span:
+                if years.setdefault(year, year + delta) != year + delta:
+                    return None  # two literals would move the same year differently
+        elif kind == "number":
+            # Bare numbers such as TOP (N) are only rewritten when they are unambiguous.
+            if len(re.findall(_number_re(old), _SQL_STRING_RE.sub("''", sql))) != 1:
+                return None
+            replacements.append(("number", old, new))
+        else:
+            old = old.replace("'", "''")
+            if not any(old in literal for literal in _SQL_STRING_RE.findall(sql)):
+                return None
+            replacements.append(("string", old, new.replace("'", "''")))
+    replacements.extend(("year", str(old), str(new)) for old, new in years.items())
+
+    # Two-phase replace so that an already substituted value is never rewritten again.
+    for i, (kind, old, _) in enumerate(replacements):
+        sql = _replace(sql, kind, old, f"\x00{chr(0xE000 + i)}\x00")
+    for i, (_, _, new) in enumerate(replacements):
+        sql = sql.replace(f"\x00{chr(0xE000 + i)}\x00", new)
+    return sql
+
+
+def _replace(sql: str, kind: str, old: str, new: str) -> str:
+    """Strings are replaced inside SQL string literals, numbers outside them, years in both."""
+    keep = lambda text: text
+    if kind == "string":
+        return _map_sql(sql, lambda text: text.replace(old, new), keep)
+    outside = lambda text: re.sub(_number_re(old), new, text)
+    if kind == "year":
+        return _map_sql(sql, lambda text: re.sub(_year_in_string_re(old), new, text), outside)
+    return _map_sql(sql, keep, outside)
+
+
+class SqlCache:
+    """Disk-backed question -> (explanation, SQL) cache with LRU/TTL eviction, shared across sessions."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 2000, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "template_hits": 0, "misses": 0, "seconds_saved": 0.0}
+        self._held = OrderedDict()  # sql -> put() arguments, until the SQL has run
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sql_cache (
+                    key TEXT PRIMARY KEY, template_key TEXT, question TEXT, literals TEXT,
+                    explanation TEXT, sql TEXT, gen_seconds REAL, created REAL, last_used REAL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_sql_cache_template ON sql_cache (template_key, last_used)")
+
+    @staticmethod
+    def hash_prompt(system_prompt: str) -> str:
+        return hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _key(text: str, prompt_hash: str) -> str:
+        return hashlib.sha256(f"{prompt_hash}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, question: str, prompt_hash: str):
+        """Returns (explanation, sql) for an exact or template hit, else None."""
+        now = time.time()
+        template, literals = question_template(question)
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM sql_cache WHERE created < ?", (now - self.ttl_seconds,))
+                row = self._conn.execute(
+                    "SELECT key, explanation, sql, gen_seconds FROM sql_cache WHERE key = ?",
+                    (self._key(normalize_question(question), prompt_hash),)).fetchone()
+                if row:
+                    self._conn.execute("UPDATE sql_cache SET last_used = ? WHERE key = ?", (now, row[0]))
+                    self._stats["hits"] += 1
+                    self._stats["seconds_saved"] += row[3] or 0.0
+                    return row[1], row[2]
+
+                candidates = self._conn.execute(
+                    "SELECT key, literals, explanation, sql, gen_seconds FROM sql_cache WHERE template_key = ? ORDER BY last_used DESC LIMIT 5",
+                    (self._key(template, prompt_hash),)).fetchall()
+                for key, cached_literals, explanation, sql, gen_seconds in candidates:
+                    old_literals = [tuple(lit) for lit in json.loads(cached_literals)]
+                    new_sql = substitute_literals(sql, old_literals, literals)
+                    if new_sql is None:
+                        continue
+                    self._conn.execute("UPDATE sql_cache SET last_used = ? WHERE key = ?", (now, key))
+                    self._stats["hits"] += 1
+                    self._stats["template_hits"] += 1
+                    self._stats["seconds_saved"] += gen_seconds or 0.0
+                    return rewrite_explanation(explanation, old_literals, literals), new_sql
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, question: str, prompt_hash: str, explanation: str, sql: str, gen_seconds: float = 0.0):
+        now = time.time()
+        template, literals = question_template(question)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(normalize_question(question), prompt_hash), self._key(template, prompt_hash),
+                 normalize_question(question), json.dumps(literals), explanation, sql, gen_seconds, now, now))
+            # LRU eviction beyond the entry budget.
+            self._conn.execute(
+                "DELETE FROM sql_cache WHERE key IN (SELECT key FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def hold(self, question: str, prompt_hash: str, explanation: str, sql: str, gen_seconds: float = 0.0):
+        """Keeps freshly generated SQL aside until it has run: `confirm(sql)` caches it, `discard(sql)` drops it."""
+        with self._lock:
+            self._held[sql] = (question, prompt_hash, explanation, sql, gen_seconds)
+            while len(self._held) > 256:
+                self._held.popitem(last=False)
+
+    def confirm(self, sql: str):
+        with self._lock:
+            held = self._held.pop(sql, None)
+        if held is not None:
+            self.put(*held)
+
+    def discard(self, sql: str):
+        with self._lock:
+            self._held.pop(sql, None)
+
+    def invalidate(self, question: str, prompt_hash: str):
+        """Drops the entry for `question`, e.g. when its cached SQL failed to run."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sql_cache WHERE key = ?", (self._key(normalize_question(question), prompt_hash),))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sql_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+            stats = dict(self._stats, entries=entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
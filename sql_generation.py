@@ -0,0 +1,135 @@
+import functools
+import os
+import re
+import time
+
+SQL_MODEL_NAME = "gemini-2.5-flash"
+
+
+@functools.lru_cache(maxsize=1)
+def _genai():
+    # Imported on first use (~0.6 s), so the engine, the API server and stub-driven tools start without it.
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GOOGLE_API"))
+    return genai
+
+
+def parse_sql_reply(assistant_reply: str):
+    """Splits a model reply into (explanation, sql); sql is None when the reply carries no query."""
+    sql, explanation = None, assistant_reply
+    if "```sql" in assistant_reply:
+        parts = assistant_reply.split("```sql")
+        explanation = parts[0].strip()
+        sql = parts[1].split("```")[0].strip()
+    elif assistant_reply.lower().startswith("select"):
+        sql = assistant_reply.strip()
+    return explanation, sql
+
+
+class SqlReplyStream:
+    """Incremental parse_sql_reply: `feed` returns True once the ```sql block has closed, so the
+    query can run while the model is still writing whatever follows it (e.g. its validation notes)."""
+
+    def __init__(self):
+        self.text = ""
+        self.sql = None
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        start = self.text.find("```sql")
+        if start >= 0:
+            end = self.text.find("```", start + 6)
+            if end >= 0:
+                self.sql = self.text[start + 6:end].strip()
+        return self.sql is not None
+
+    @property
+    def explanation(self) -> str:
+        """The explanation received so far, without a half-received fence."""
+        start = self.text.find("```sql")
+        if start >= 0:
+            return self.text[:start].strip()
+        partial = next((n for n in range(min(len("```sql"), len(self.text)), 0, -1) if self.text.endswith("```sql"[:n])), 0)
+        return self.text[:len(self.text) - partial].strip()
+
+    def result(self):
+        return (self.explanation, self.sql) if self.sql is not None else parse_sql_reply(self.text)
+
+
+def read_sql_stream(response, on_explanation=None):
+    """Consumes a `stream=True` reply up to the end of its SQL block: (explanation, sql, last chunk).
+
+    `on_explanation` gets the explanation text after every chunk, for incremental display."""
+    parser, last = SqlReplyStream(), None
+    for chunk in response:
+        last = chunk
+        try:
+            text = chunk.text
+        except ValueError:
+            text = ""  # chunks carrying only a finish reason or safety ratings
+        if parser.feed(text):
+            break
+        if on_explanation is not None:
+            on_explanation(parser.explanation)
+    explanation, sql = parser.result()
+    return explanation, sql, last
+
+
+@functools.lru_cache(maxsize=64)
+def get_sql_model(system_prompt: str, model_name: str = SQL_MODEL_NAME):
+    # One model per distinct (pruned) system prompt, shared by every session and worker thread.
+    genai = _genai()
+    return genai.GenerativeModel(model_name, system_instruction=system_prompt, generation_config=genai.types.GenerationConfig(temperature=0.2, top_p=0.93, top_k=40))
+
+
+@functools.lru_cache(maxsize=4)
+def get_suggestion_model(model_name: str = SQL_MODEL_NAME):
+    return _genai().GenerativeModel(model_name)
+
+
+def generate_sql(question, system_prompt, history=None, sql_cache=None, prompt_hash=None, model=None, stream=False):
+    """Headless, thread-safe generation for a standalone question: (explanation, sql, error).
+
+    `prompt_hash` keys the SQL cache; pass the hash of the full rules prompt when
+    `system_prompt` is a pruned variant of it. New SQL is only held in the cache: the caller
+    confirms it (`sql_cache.confirm(sql)`) once it has run. `model` replaces the Gemini model (e.g. a stub).
+    With `stream` the call returns as soon as the SQL block is complete."""
+    if sql_cache is not None:
+        prompt_hash = prompt_hash or sql_cache.hash_prompt(system_prompt)
+        cached = sql_cache.get(question, prompt_hash)
+        if cached:
+            return cached[0], cached[1], None
+    started = time.perf_counter()
+    try:
+        chat = (model or get_sql_model(system_prompt)).start_chat(history=history or [])
+        if stream:
+            explanation, sql, _ = read_sql_stream(chat.send_message(question, stream=True))
+        else:
+            explanation, sql = parse_sql_reply(chat.send_message(question).text)
+    except Exception as e:
+        return None, None, f"Gemini failed: {e}"
+    if sql and sql_cache is not None:
+        sql_cache.hold(question, prompt_hash, explanation, sql, gen_seconds=time.perf_counter() - started)
+    return explanation, sql, None
+
+
+def generate_follow_up_questions(original_question, sql_query, df_columns=None, model=None):
+    """Generates contextual follow-up questions using a cost-effective LLM.
+
+    Runs in the background while the query executes, so it must not touch Streamlit; errors
+    propagate to whoever collects the result. Without `df_columns` the model reads them off the SQL."""
+    columns_text = ', '.join(df_columns) if df_columns else "(not known yet; infer them from the final SELECT list of the SQL)"
+    prompt = f"""
+    Based on the user's last question and the data columns from the result, suggest 3 insightful and relevant follow-up questions a data analyst might ask next.
+    The goal is to explore the data further, such as breaking it down by another dimension, comparing time periods, or focusing on top/bottom performers.
+
+    PREVIOUS QUESTION: "{original_question}"
+    GENERATED SQL QUERY: "{sql_query}"
+    RESULTING DATA COLUMNS: {columns_text}
+
+    Return ONLY a Python-style list of 3 short, clear question strings.
+    Example: ["Can you break this down by sales channel?", "How does this compare to the previous year?", "What are the top 5 products in this category?"]
+    """
+    response = (model or get_suggestion_model()).generate_content(prompt, generation_config={"temperature": 0.7})
+    suggestions = re.findall(r'"(.*?)"', response.text)
+    return suggestions[:3]
@@ -0,0 +1,112 @@
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from schema_index import estimate_tokens
+
+
+class StubResponse:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=estimate_tokens(text),
+                                              total_token_count=prompt_tokens + estimate_tokens(text))
+
+
+class StubStream:
+    """Iterates a reply in chunks of `chunk_chars`, like a `stream=True` GenerateContentResponse:
+    the first chunk arrives after the model latency, each later one after its tokens are "generated"."""
+
+    def __init__(self, text, prompt_tokens, first_delay, seconds_per_token, chunk_chars=40):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.first_delay = first_delay
+        self.seconds_per_token = seconds_per_token
+        self.chunk_chars = chunk_chars
+        self.chunks_sent = 0
+
+    def __iter__(self):
+        time.sleep(self.first_delay)
+        for start in range(0, len(self.text), self.chunk_chars):
+            piece = self.text[start:start + self.chunk_chars]
+            time.sleep(self.seconds_per_token * estimate_tokens(piece))
+            self.chunks_sent += 1
+            yield StubResponse(piece, self.prompt_tokens)
+
+    def resolve(self):
+        for _ in self:
+            pass
+
+
+class StubChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        turns = "\n".join(part for message in self.history for part in message["parts"])
+        response = self.model._respond(content, context=f"{self.model.system_instruction}\n{turns}", stream=stream)
+        self.history += [{"role": "user", "parts": [content]}, {"role": "model", "parts": [response.text]}]
+        return response
+
+
+class StubModel:
+    """Offline stand-in for genai.GenerativeModel: scripted replies after a simulated delay.
+
+    `replies` is a list of (regex, reply); the first pattern found in the prompt wins, else
+    `default_reply`. Each call sleeps `latency` (±`jitter`, seeded) plus `seconds_per_token` for
+    every token of the reply, so a benchmark sees realistic time-to-answer without network calls.
+    With `stream=True` the same delays are spread over the chunks of a StubStream."""
+
+    def __init__(self, replies=(), default_reply="", latency: float = 0.5, jitter: float = 0.0, seconds_per_token: float = 0.0,
+                 seed: int = 0, system_instruction: str = ""):
+        self.replies = [(re.compile(pattern, re.IGNORECASE), reply) for pattern, reply in replies]
+        self.default_reply = default_reply
+        self.latency = latency
+        self.jitter = jitter
+        self.seconds_per_token = seconds_per_token
+        self.system_instruction = system_instruction
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+
+    @classmethod
+    def from_recordings(cls, path, **kwargs):
+        """Replies recorded as a JSON list of {"pattern": ..., "reply": ...}."""
+        with open(path, encoding="utf-8") as f:
+            recordings = json.load(f)
+        return cls([(r["pattern"], r["reply"]) for r in recordings], **kwargs)
+
+    def with_system_instruction(self, system_instruction: str):
+        """A model sharing this one's replies and counters, as get_sql_model gives one per prompt."""
+        clone = StubModel(latency=self.latency, jitter=self.jitter, seconds_per_token=self.seconds_per_token, system_instruction=system_instruction)
+        clone.replies, clone.default_reply, clone._random, clone._lock = self.replies, self.default_reply, self._random, self._lock
+        clone._parent = self
+        return clone
+
+    def _reply_for(self, prompt: str) -> str:
+        return next((reply for pattern, reply in self.replies if pattern.search(prompt)), self.default_reply)
+
+    def _respond(self, prompt, context="", stream=False):
+        text = self._reply_for(prompt)
+        response = StubResponse(text, estimate_tokens(context) + estimate_tokens(prompt))
+        counters = getattr(self, "_parent", self)
+        with self._lock:
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            counters.calls += 1
+            counters.prompt_tokens += response.usage_metadata.prompt_token_count
+            counters.response_tokens += response.usage_metadata.candidates_token_count
+        if stream:
+            return StubStream(text, response.usage_metadata.prompt_token_count, delay, self.seconds_per_token)
+        time.sleep(delay + self.seconds_per_token * response.usage_metadata.candidates_token_count)
+        return response
+
+    def start_chat(self, history=None):
+        return StubChat(self, history)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        return self._respond(contents if isinstance(contents, str) else "\n".join(map(str, contents)), context=self.system_instruction, stream=stream)
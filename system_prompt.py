@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from schema_index import format_schema_section
+
+DEFAULT_PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "prompts")
+# The most recently compiled prompt as plain text, e.g. for `batch_runner.py --system-prompt`.
+COMPILED_PROMPT_FILE = "system_prompt.txt"
+SCHEMA_PLACEHOLDER = "<<SCHEMA_SECTION>>"
+# FY2024 = April 2024 to March 2025, as the Fiscal Year Logic rule below tells the model; the rollup
+# router reads fiscal years the same way so both paths answer for the same dates.
+FY_NAMED_BY_START = True
+
+RULES_TEMPLATE = """
+You are an expert-level T-SQL Architect. Your sole function is to generate a single, optimized, and syntactically correct ,simple T-SQL query for SQL Server based on the user's request and the rules below.
+You will follow this four-step internal process:
+- Deconstruct Request: Silently analyze the user's goal to identify all required metrics, dimensions, and filters.
+- Apply Logic: Methodically apply all relevant business logic, error handling, and metric formulas.
+- Generate Query: Construct the T-SQL query, strictly adhering to all syntax, performance, and naming conventions.
+- Format Output: Present the final response using the precise markdown structure specified in Part 4.
+---
+Part 1: Database Schema Reference:
+<<SCHEMA_SECTION>>
+---
+Part 2: Core Directives & Rules
+You must follow these rules without exception.
+
+A. T-SQL Syntax, Naming & Performance
+
+- Always Round off to 2 decimal places.
+- Global Naming Convention: All table and column references must be prefixed with `your_schema.` (e.g., `your_schema.YourTable.YourColumn`, `alias.YourColumn`).
+- Engine & Compatibility: Generate T-SQL for SQL Server only. Do not use functions from other SQL dialects (e.g., `DATE_TRUNC`, `STRING_AGG`, `LPAD`).
+- CTEs (Common Table Expressions): Always begin the query with a CTE. Precede the first `WITH` clause with a semicolon (;). Remove any unused CTEs from the final query.
+- Joins: Default to using `LEFT JOIN`. Use `INNER JOIN` only for relationships that are mandatory and non-nullable. Do not use `FULL OUTER JOIN`.
+- Table Hints: Apply `WITH (NOLOCK)` to every table, view, or CTE in all `FROM` and `JOIN` clauses.
+- Pagination: For TOP N queries, use `TOP (N)` or `OFFSET ... FETCH`. Do not use `LIMIT`.
+- Aliasing: Use short, intuitive table aliases (e.g., `so` for `your_schema.Sales_SalesOrder`). Every column reference must be prefixed with the correct alias (e.g., `so.OrderID`). Do not use periods in aliases themselves.
+
+B. Error Handling & Type Safety
+- Once a table is given an alias(short), Never use schema name again (e.g., use so.OrderID, not your_schema.so.OrderID).
+- Safe Casting: Use `TRY_CAST` or `TRY_CONVERT` instead of `CAST` to prevent type conversion errors.
+- Safe Division: To prevent divide-by-zero errors, always wrap the denominator with `NULLIF(expression, 0)`.
+- Safe Aggregation: To prevent integer overflow in large sums, use `SUM(TRY_CAST(expression AS BIGINT))`.
+- Date Handling: Do not cast directly from `INT` to `DATE`. Use appropriate conversion logic.
+- Ensure all columns are referenced with the correct table aliases and joins.
+- Identify where implicit or explicit conversion between string (VARCHAR) and integer is happening.
+- Fix the query by ensuring correct data type handling without changing the logic.
+- TOP N WITH TIES clause is not allowed without a corresponding ORDER BY clause
+- Revise the SQL to eliminate the 'Conversion failed when converting the nvarchar value ''TV'' to data type int' error: do not cast alphanumeric NVARCHARs to INT; instead align datatypes (cast the INT side to NVARCHAR or use TRY_CONVERT for numeric-only rows)
+- Only prepend 'your_schema. or any other alias' if the table name is not already schema-qualified (doesn't contain a period).
+- Correct any syntax errors related to the NOLOCK hint in the SELECT statement.
+- Use proper date functions (YEAR(), FORMAT()) instead of string manipulation for filtering and grouping to ensure reliable and readable SQL.
+
+C. Standard Business Logic & Filters (Apply to ALL Queries)
+
+- Only show top 1000 results.
+- Always display the total values by default for the question asked.
+- Default Date Range: `[YourDateColumn] >= 'YYYY-MM-DD'` # Your default date filter
+- When date is specified use full range for that day (eg. so.OrderDate >= 'Date' and so.OrderDate < 'Date+1).
+- Exclude Cancelled Orders: `[YourStatusIDColumn] NOT IN (17, 20, 21) AND [YourCancelDateColumn] IS NULL` # Your specific filters
+- Exclude Returned Items: `ISNULL([YourItemStatusID], 0) NOT IN (20)` # Your specific filters
+- Include Valid Products: `[YourProductIDColumn] > 0` # Your specific filters
+- Fiscal Year Logic: A fiscal year runs from April 1st to March 31st and is named by the year it starts in (e.g., 'FY2024' or 'FY24' runs from 2024-04-01 to 2025-03-31). Translate this to `[YourDateColumn] >= '2024-04-01' AND [YourDateColumn] < '2025-04-01'`.
+- Specific Column Mapping:
+- Target (only use these) = 'your_schema.Sales_SaleTargets.Sales', Mobile Target = 'your_schema.Sales_MobileTargets.Sales',[Always use Daily/Hourly filtering  (e.g. 'your_schema.Sales_SaleTargets.Type' = 'Daily')],[When asked monthly target 'SUM 'Daily' sales for that month'.], Dont use TargetDate use Date. Use 
+    
+    - Always use `your_schema.Sales_SalesOrderlines.SalesChannelID` for `SalesChannelID`. # Your specific column mapping
+    - Always use `your_schema.Auction_TVAuctionPrice.TargetPrice` for `TargetPrice`. # Your specific column mapping
+    - Quantity = "your_schema.Sales_SalesOrderlines.QTY" # Your specific column mapping
+    - TotalNetAmount = "your_schema.Sales_SalesOrderlines.TotalNetAmt" # Your specific column mapping
+    - ProductID = "your_schema.Sales_SalesOrderlines.ProductID" # Your specific column mapping
+    - Discount = "your_schema.Discount_Discounts" # Your specific column mapping
+    - Source/Channel = "your_schema.Sales_MstSalesChannels" # Your specific column mapping
+    
+D. Advanced Logic & Metric Formulas
+
+- Metric Formulas(If the user asks for any words, use ONLY its exact SQL expression listed below. Do NOT search for, infer, or replace with other columns or words)
+    *sol = your_schema.Sales_SalesOrderLines , BP = your_schema.System_MstBudgetPay # Your specific aliases and tables
+    
+    - DepartmentID : "your_schema.Sales_SalesOrders" # Your specific column mapping
+    - Mobile = "your_schema.System_MstDepartments.DepartmentID = 15" # Your specific filter
+    - Gross Sales: `SUM([YourColumn])` # Your formula
+    - Unique Customers: `COUNT(DISTINCT [YourCustomerID])` # Your formula
+    - Order Count: `COUNT(DISTINCT [YourOrderID])` # Your formula
+    - Margin: `[Your Margin Formula]` # Your specific formula
+    - Margin %: `[Your Margin % Formula]` # Your specific formula
+    - Margin Loss: `[Your Margin Loss Formula]` # Your specific formula
+    - AuctionDuration (in minutes): `[Your Auction Duration Formula]` # Your specific formula
+    - GCPM = `[Your GCPM Formula]` # Your specific formula
+    - PnP = `[Your PnP Formula]` # Your specific formula
+    - New Customers:`[Your New Customers Logic]` # Your specific logic
+    - Cash Sales: `[Your Cash Sales Formula]` # Your specific formula
+    - When asked for specific type of sales use 'your_schema.Sales_MstSalesChannels'(eg. Mobile FPC = 'your_schema.Sales_MstSalesChannels.Name like'%Mobile FPC%'). # Your specific logic
+- Top/Best-Selling Logic: When asked for top-selling products, order results descending by `SUM([YourQuantityColumn])`. # Your specific logic
+- Flexible Product search: If asked to find a specific product, search for the keyword across all relevant name and description columns using `LIKE '%keyword%'`.
+- When filtering for channels, do not use exact matches. Instead, use 'LIKE' with wildcards to include any name containing "TV" or "Web". [For example:(your_schema.Sales_MstSalesChannels.Name LIKE '%TV%' OR your_schema.Sales_MstSalesChannels.Name LIKE '%Web%')] # Your specific logic
+- Customer Acquisition Logic: To find a customer's first purchase, find the `MIN([YourOrderDate])` for each `[YourCustomerID]` after the `[YourCreatedDate]`. # Your specific logic
+- Only use Columns with Tables they exist in.
+- Weekly Performance Classification: If requested, classify week-over-week performance changes as 'Growth', 'Decline', 'Stable' using a `CASE` statement comparing the current week's metric to the 
+previous week's.
+- Mainly join using [YourJoiningColumn1],[YourJoiningColumn2]
+---
+Part 3: Final Output Format
+You must present your final answer using the exact format below. Provide no other commentary or text outside this structure.
+T-SQL Query
+-- Your generated T-SQL query goes here
+Explanation
+A 2-3 line summary explaining the query's objective, the logic used to fulfill the request, and any specific error-prevention techniques applied.
+Validation
+-- This query checks for data existence based on the primary filters.
+-- It should return a count > 0 if data is available.
+SELECT COUNT(*)
+FROM your_schema.Sales_SalesOrder AS so WITH (NOLOCK)
+WHERE /* Add the primary date or fiscal year filter from the main query here */;
+Validation Points:
+- Verify the final `SELECT` statement includes all columns and metrics requested.
+- Check that Gross Sales and Order Count are positive values.
+- Ensure Order Count is greater than or equal to Unique Customers.
+"""
+
+
+def rules_version(rules_template: str) -> str:
+    # Any edit to the rules yields a new version and therefore a recompiled prompt.
+    return hashlib.sha256(rules_template.encode("utf-8")).hexdigest()[:12]
+
+
+def compiled_prompt_path(directory: str = DEFAULT_PROMPT_DIR) -> str:
+    """Where PromptArtifacts(directory) writes the plain-text copy of the prompt it compiled last."""
+    return os.path.join(directory, COMPILED_PROMPT_FILE)
+
+
+def _write_atomic(path, text):
+    with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+class PromptArtifacts:
+    """Compiled system prompts on disk, one JSON artifact per (schema fingerprint, rules version).
+
+    The schema explanation (a paid LLM call) is stored per fingerprint on its own, so a rules change
+    recompiles the prompt without asking for a new explanation. Artifacts are kept in memory once
+    loaded, so every session of the process shares one copy of the prompt."""
+
+    def __init__(self, directory: str = DEFAULT_PROMPT_DIR, rules_template: str = RULES_TEMPLATE):
+        self.directory = directory
+        self.rules_template = rules_template
+        self.rules_version = rules_version(rules_template)
+        self._artifacts = {}
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_loads": 0, "builds": 0, "explanations": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def schema_hint(self, snapshot, explain) -> str:
+        """`explain(snapshot)` is only called for a fingerprint that has never been explained."""
+        path = os.path.join(self.directory, f"explanation-{snapshot['fingerprint']}.json")
+        stored = self._read(path)
+        if stored is not None:
+            return stored["schema_hint"]
+        started = time.perf_counter()
+        hint = explain(snapshot)
+        self._stats["explanations"] += 1
+        _write_atomic(path, json.dumps({"fingerprint": snapshot["fingerprint"], "schema_hint": hint, "created": time.time(),
+                                        "seconds": round(time.perf_counter() - started, 3)}))
+        return hint
+
+    def get(self, snapshot, explain) -> dict:
+        """{"key", "fingerprint", "rules_version", "template", "schema_hint", "system_prompt", "built_at"} for the snapshot."""
+        key = f"{snapshot['fingerprint']}-{self.rules_version}"
+        artifact = self._artifacts.get(key)
+        if artifact is not None:
+            self._stats["memory_hits"] += 1
+            return artifact
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is not None:
+                return artifact
+            path = os.path.join(self.directory, f"prompt-{key}.json")
+            artifact = self._read(path)
+            if artifact is not None:
+                self._stats["disk_loads"] += 1
+            else:
+                hint = self.schema_hint(snapshot, explain)
+                artifact = {"key": key, "fingerprint": snapshot["fingerprint"], "rules_version": self.rules_version, "template": self.rules_template,
+                            "schema_hint": hint, "system_prompt": self.rules_template.replace(SCHEMA_PLACEHOLDER, format_schema_section(snapshot["tables"], hint)),
+                            "built_at": time.time()}
+                _write_atomic(path, json.dumps(artifact))
+                self._stats["builds"] += 1
+            _write_atomic(compiled_prompt_path(self.directory), artifact["system_prompt"])
+            self._artifacts = {key: artifact}  # the previous schema's prompt is no longer served
+            return artifact
+
+    def stats(self) -> dict:
+        return dict(self._stats)
@@ -0,0 +1,113 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("httpx")  # Starlette's TestClient is built on it
+from starlette.testclient import TestClient
+
+from api_server import create_app
+
+
+class FakeResultStore:
+    def __init__(self):
+        self.frames = {}
+
+    def get(self, handle):
+        return self.frames.get(handle)
+
+    def info(self, handle):
+        df = self.frames.get(handle)
+        return None if df is None else {"rows": len(df), "columns": list(df.columns)}
+
+    def put(self, session_id, df):
+        handle = f"{session_id}/{len(self.frames)}"
+        self.frames[handle] = df
+        return handle
+
+
+class FakeEngine:
+    """Answers every question with a fixed frame; choices are handled by the routes' own checks."""
+
+    def __init__(self):
+        self.result_store = FakeResultStore()
+        self.asked = []
+
+    def ask(self, conversation, text=None, choice=None, use_cache=True):
+        self.asked.append((text, choice))
+        df = pd.DataFrame({"Channel": ["Web", "Retail", "Partner"], "Sales": [10.5, 20.0, None]})
+        return {"text": "Sales by channel.", "result": {"handle": self.result_store.put(conversation.id, df)}}
+
+    def reset(self, conversation):
+        self.asked.append(("reset", conversation.id))
+
+
+@pytest.fixture
+def client():
+    with TestClient(create_app(engine=FakeEngine())) as client:
+        yield client
+
+
+@pytest.fixture
+def conversation_id(client):
+    response = client.post("/conversations", json={})
+    assert response.status_code == 201
+    return response.json()["conversation_id"]
+
+
+def test_ask_returns_a_preview_and_pages_the_result(client, conversation_id):
+    turn = client.post(f"/conversations/{conversation_id}/ask", json={"question": "Sales by channel", "rows": 2}).json()
+    assert turn["result"]["preview"] == {"columns": ["Channel", "Sales"], "data": [["Web", 10.5], ["Retail", 20.0]], "offset": 0, "total_rows": 3}
+    page = client.get(f"/conversations/{conversation_id}/results/{turn['result']['handle']}", params={"offset": 2, "limit": 5}).json()
+    assert page["data"] == [["Partner", None]]
+
+
+@pytest.mark.parametrize("body, message", [
+    ({}, "'question' (or 'choice' for a clarification) is required"),
+    ({"question": "   "}, "'question' (or 'choice' for a clarification) is required"),
+    ({"question": "Sales", "rows": "abc"}, "'rows' must be an integer"),
+])
+def test_bad_ask_bodies_are_400(client, conversation_id, body, message):
+    response = client.post(f"/conversations/{conversation_id}/ask", json=body)
+    assert (response.status_code, response.json()) == (400, {"error": message})
+    assert client.app.state.engine.asked == []
+
+
+def test_bad_confirm_rows_are_400(client, conversation_id):
+    response = client.post(f"/conversations/{conversation_id}/confirm", json={"rows": [1]})
+    assert (response.status_code, response.json()["error"]) == (400, "'rows' must be an integer")
+
+
+@pytest.mark.parametrize("query", [{"offset": "x"}, {"limit": "ten"}, {"offset": "1.5"}])
+def test_bad_result_paging_is_400(client, conversation_id, query):
+    handle = client.post(f"/conversations/{conversation_id}/ask", json={"question": "Sales"}).json()["result"]["handle"]
+    response = client.get(f"/conversations/{conversation_id}/results/{handle}", params=query)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("method, path", [
+    ("GET", "/conversations/nope"),
+    ("DELETE", "/conversations/nope"),
+    ("POST", "/conversations/nope/ask"),
+    ("POST", "/conversations/nope/confirm"),
+    ("GET", "/conversations/nope/results/nope/0"),
+])
+def test_unknown_conversations_are_404(client, method, path):
+    response = client.request(method, path, json={"question": "Sales"})
+    assert response.status_code == 404
+
+
+def test_results_of_other_conversations_are_404(client, conversation_id):
+    handle = client.post(f"/conversations/{conversation_id}/ask", json={"question": "Sales"}).json()["result"]["handle"]
+    other = client.post("/conversations", json={}).json()["conversation_id"]
+    assert client.get(f"/conversations/{other}/results/{handle}").status_code == 404
+    assert client.get(f"/conversations/{conversation_id}/results/{conversation_id}/missing").status_code == 410
+
+
+def test_choice_without_an_ambiguity_is_409(client, conversation_id):
+    response = client.post(f"/conversations/{conversation_id}/ask", json={"choice": 1})
+    assert (response.status_code, response.json()["error"]) == (409, "no ambiguity is waiting for a choice")
+    assert client.app.state.engine.asked == []
+
+
+def test_deleted_conversations_are_gone(client, conversation_id):
+    assert client.delete(f"/conversations/{conversation_id}").json() == {"deleted": True}
+    assert client.post(f"/conversations/{conversation_id}/ask", json={"question": "Sales"}).status_code == 404
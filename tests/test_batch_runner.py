@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from batch_runner import BatchRun
+
+
+def _run(errors, max_attempts=3):
+    """One question whose generation fails with `errors` in turn, then succeeds."""
+    replies = list(errors)
+    generate = lambda question: (None, None, replies.pop(0)) if replies else ("Total.", "SELECT 1", None)
+    run = BatchRun(["q"], generate_fn=generate, execute_fn=lambda sql: (pd.DataFrame({"x": [1]}), None),
+                   llm_per_minute=0, max_attempts=max_attempts, backoff_seconds=0)
+    return run.run()[0]
+
+
+@pytest.mark.parametrize("error", [
+    "Gemini failed: 429 Resource has been exhausted (e.g. check quota).",
+    "Gemini failed: 503 The service is currently unavailable.",
+    "Gemini failed: 504 Deadline Exceeded",
+    "Gemini failed: HTTPSConnectionPool: Read timed out.",
+])
+def test_transient_llm_errors_are_retried(error):
+    result = _run([error])
+    assert result["status"] == "done" and result["attempts"] == 2
+
+
+@pytest.mark.parametrize("error", [
+    "Gemini failed: 400 API key not valid. Please pass a valid API key.",
+    "Gemini failed: 400 Request payload size exceeds the limit: 5000 bytes.",
+    "Gemini failed: Invalid operation: the response was blocked by safety filters.",
+])
+def test_other_llm_errors_fail_at_once(error):
+    result = _run([error])
+    assert result["status"] == "failed" and result["attempts"] == 1 and result["error"] == error
+
+
+def test_retries_stop_at_max_attempts():
+    result = _run(["Gemini failed: 500 An internal error has occurred."] * 5, max_attempts=3)
+    assert result["status"] == "failed" and result["attempts"] == 3
+
+
+def _run_db(errors, max_attempts=3):
+    """One question whose execution fails with `errors` in turn, then succeeds; returns (result, executions)."""
+    replies, executions = list(errors), []
+
+    def execute(sql):
+        executions.append(sql)
+        return (None, replies.pop(0)) if replies else (pd.DataFrame({"x": [1]}), None)
+
+    run = BatchRun(["q"], generate_fn=lambda question: ("Total.", "SELECT 1", None), execute_fn=execute,
+                   llm_per_minute=0, max_attempts=max_attempts, backoff_seconds=0)
+    return run.run()[0], len(executions)
+
+
+def test_deadlocks_are_retried():
+    result, executions = _run_db(["Query failed: Transaction was deadlocked on lock resources (1205)"])
+    assert result["status"] == "done" and executions == 2
+
+
+def test_statement_timeouts_are_not_retried():
+    result, executions = _run_db(["Query failed: statement timed out after 120s"])
+    assert result["status"] == "failed" and executions == 1
+
+
+def test_no_backoff_after_the_last_db_attempt(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("batch_runner.time.sleep", sleeps.append)
+    result, executions = _run_db(["Query failed: ('08S01', 'Communication link failure')"] * 5, max_attempts=3)
+    assert result["status"] == "failed" and executions == 3
+    assert len(sleeps) == 2
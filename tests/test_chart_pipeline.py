@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from chart_pipeline import lttb_indices, prepare_chart_data
+
+
+def test_lttb_keeps_endpoints_and_the_requested_count():
+    x = np.arange(1000)
+    y = np.sin(x / 20.0)
+    keep = lttb_indices(x, y, 100)
+    assert len(keep) == 100 and keep[0] == 0 and keep[-1] == 999
+    assert (np.diff(keep) > 0).all()
+
+
+def test_lttb_keeps_a_lone_spike():
+    y = np.zeros(1000)
+    y[537] = 50.0
+    assert 537 in lttb_indices(np.arange(1000), y, 50)
+
+
+@pytest.mark.parametrize("threshold", [2, 10, 20])
+def test_lttb_passes_short_series_through(threshold):
+    assert lttb_indices(np.arange(10), np.arange(10), threshold).tolist() == list(range(10))
+
+
+def _sales(rows=20_000):
+    rng = np.random.default_rng(1)
+    return pd.DataFrame({
+        "OrderDate": pd.date_range("2024-01-01", periods=rows, freq="h"),
+        "Channel": rng.choice(["Web", "Retail", "Partner"], rows),
+        "Product": [f"P{i % 40}" for i in range(rows)],
+        "Sales": rng.uniform(1, 100, rows),
+    })
+
+
+def test_small_frames_pass_through():
+    df = _sales(100)
+    assert prepare_chart_data(df, "Line", "OrderDate", "Sales") == (df, [], False)
+
+
+def test_bars_are_aggregated_by_x_and_color():
+    df = _sales()
+    plot_df, notes, webgl = prepare_chart_data(df, "Bar", "Product", "Sales", color_col="Channel")
+    assert len(plot_df) == 120 and not webgl and notes[0].startswith("Aggregated 20,000 rows to 120")
+    assert plot_df["Sales"].sum() == pytest.approx(df["Sales"].sum())
+
+
+def test_pies_fold_small_slices_into_other():
+    df = _sales()
+    plot_df, _, _ = prepare_chart_data(df, "Pie", "Product", "Sales")
+    assert len(plot_df) == 20 and plot_df["Product"].iloc[-1] == "Other"
+    assert plot_df["Sales"].sum() == pytest.approx(df["Sales"].sum())
+
+
+def test_lines_are_downsampled_per_series():
+    df = _sales()
+    plot_df, notes, webgl = prepare_chart_data(df, "Line", "OrderDate", "Sales", color_col="Channel", max_points=600)
+    assert webgl and "LTTB" in notes[0]
+    assert plot_df.groupby("Channel").size().tolist() == [200, 200, 200]
+    for _, series in plot_df.groupby("Channel"):
+        original = df[df["Channel"] == series["Channel"].iloc[0]]["OrderDate"]
+        assert series["OrderDate"].iloc[0] == original.min() and series["OrderDate"].iloc[-1] == original.max()
+
+
+def test_lines_over_a_categorical_x_are_aggregated():
+    plot_df, notes, _ = prepare_chart_data(_sales(), "Line", "Product", "Sales", max_points=100)
+    assert len(plot_df) == 40 and "per Product" in notes[0]
+
+
+def test_boxes_are_sampled_per_group_and_keep_the_x_column():
+    df = _sales()
+    df.loc[:99, "Channel"] = None
+    plot_df, notes, webgl = prepare_chart_data(df, "Box", "Channel", "Sales", max_points=400)
+    assert not webgl and "stratified by Channel" in notes[0]
+    assert "Channel" in plot_df.columns
+    sizes = plot_df.groupby("Channel", dropna=False).size()
+    assert len(sizes) == 4 and (sizes == 100).all()
+
+
+def test_scatters_switch_to_webgl_then_bin():
+    df = _sales()
+    plot_df, notes, webgl = prepare_chart_data(df, "Scatter", "OrderDate", "Sales")
+    assert plot_df is df and webgl and "WebGL" in notes[0]
+    plot_df, notes, webgl = prepare_chart_data(df, "Scatter", "OrderDate", "Sales", max_points=400, webgl_points=1000)
+    assert webgl and len(plot_df) <= 400 and plot_df["points"].sum() == len(df)
+    assert pd.api.types.is_datetime64_any_dtype(plot_df["OrderDate"])
@@ -0,0 +1,81 @@
+import pytest
+
+from example_library import ExampleLibrary, format_examples, tokenize
+
+PAIRS = [
+    ("Gross sales by sales channel in FY2024", "SELECT Channel, SUM(Sales) FROM sales WHERE fy = 2024 GROUP BY Channel"),
+    ("Top 10 products by quantity sold last month", "SELECT TOP 10 ProductID, SUM(QTY) FROM lines GROUP BY ProductID"),
+    ("Number of orders per customer in 2023", "SELECT CustomerID, COUNT(*) FROM orders GROUP BY CustomerID"),
+    ("Average discount by department", "SELECT Department, AVG(Discount) FROM lines GROUP BY Department"),
+]
+
+
+@pytest.fixture
+def library():
+    library = ExampleLibrary(":memory:")
+    for question, sql in PAIRS:
+        library.add(question, sql)
+    return library
+
+
+def test_tokens_ignore_literals_and_stopwords():
+    assert tokenize("Show me sales in FY2024") == tokenize("sales for FY2023")
+    assert "the" not in tokenize("What were the sales")
+
+
+def test_the_closest_question_ranks_first(library):
+    results = library.search("Gross sales by channel for FY2025")
+    assert results[0]["question"] == PAIRS[0][0] and results[0]["sql"] == PAIRS[0][1]
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+    assert library.search("Top 5 products by quantity sold this month")[0]["question"] == PAIRS[1][0]
+
+
+def test_rare_terms_outweigh_common_ones(library):
+    library.add("Gross sales by department in 2024", "SELECT Department, SUM(Sales) FROM sales GROUP BY Department")
+    # "discount" appears in one example, "sales" in two: the discount example wins.
+    assert library.search("discount sales")[0]["question"] == PAIRS[3][0]
+
+
+def test_weak_matches_and_k_are_applied(library):
+    assert library.search("inventory turnover ratio") == []
+    assert len(library.search("sales products orders customer discount", k=2, min_score=0)) == 2
+    assert ExampleLibrary(":memory:").search("Gross sales") == []
+
+
+def test_verified_examples_get_a_boost(library):
+    question = "Gross sales by department in 2024"
+    library.add(question, "SELECT 1")
+    before = library.search("gross sales by department", k=5)
+    library.add(question, "SELECT 1", verified=True)
+    after = library.search("gross sales by department", k=5)
+    score = lambda results: next(r["score"] for r in results if r["question"] == question)
+    assert score(after) == pytest.approx(score(before) * 1.5, abs=0.01)
+
+
+def test_verified_sql_is_not_replaced_by_unverified_sql(library):
+    library.add(PAIRS[3][0], "SELECT 'verified'", verified=True)
+    library.add(PAIRS[3][0], "SELECT 'other'")
+    result = library.search(PAIRS[3][0])[0]
+    assert (result["sql"], result["verified"]) == ("SELECT 'verified'", True)
+
+
+def test_eviction_keeps_verified_examples(tmp_path):
+    library = ExampleLibrary(str(tmp_path / "examples.sqlite3"), max_entries=2)
+    library.add(PAIRS[0][0], PAIRS[0][1], verified=True)
+    library.add(PAIRS[1][0], PAIRS[1][1])
+    library.add(PAIRS[2][0], PAIRS[2][1])
+    assert library.stats()["examples"] == 2
+    assert library.search("gross sales by channel")[0]["verified"]
+    assert library.search("top products by quantity") == []
+    reopened = ExampleLibrary(str(tmp_path / "examples.sqlite3"))
+    assert reopened.search("orders per customer")[0]["question"] == PAIRS[2][0]
+
+
+def test_outcomes_and_format(library):
+    library.record_attempt(with_examples=True)
+    library.record_attempt(with_examples=True)
+    library.record_answer(with_examples=True, attempts=2)
+    assert library.stats()["with_examples"] == {"attempts": 2, "answered": 1, "success_rate": 0.5, "avg_attempts": 2.0}
+    assert format_examples([]) == ""
+    block = format_examples(library.search("gross sales by channel"))
+    assert PAIRS[0][1] in block and block.endswith("Now answer this question:\n")
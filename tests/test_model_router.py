@@ -0,0 +1,160 @@
+import pandas as pd
+import pytest
+
+import benchmark
+import sales_engine
+from model_router import ModelRouter, complexity, is_repairable, template_follow_ups
+from stub_llm import StubModel
+
+
+def _reply(explanation, sql):
+    return f"{explanation}\n\n```sql\n{sql}\n```"
+
+
+GOOD = [(pattern, _reply(explanation, sql)) for pattern, explanation, sql in benchmark.RECORDED_ANSWERS]
+DEFAULT = _reply(*benchmark.DEFAULT_ANSWER)
+BROKEN = _reply("Unique customers.", "SELECT NoSuchColumn FROM your_schema.Sales_SalesOrders")
+
+
+def _stubs(fast_replies=()):
+    return {"fast": StubModel(list(fast_replies) + GOOD, default_reply=DEFAULT, latency=0),
+            "standard": StubModel(GOOD, default_reply=DEFAULT, latency=0),
+            "strong": StubModel(GOOD, default_reply=DEFAULT, latency=0)}
+
+
+def _router(stubs, **kwargs):
+    return ModelRouter(clients={tier: stub.with_system_instruction for tier, stub in stubs.items()},
+                       suggestion_client=StubModel(default_reply=benchmark.SUGGESTIONS_REPLY, latency=0), **kwargs)
+
+
+@pytest.mark.parametrize("question, tables, tier", [
+    ("Daily order count for March 2025", [], "fast"),
+    ("Gross sales and quantity by product in 2024", [], "fast"),
+    ("Gross sales by channel", ["a", "b", "c", "d"], "standard"),
+    ("What is the margin loss in 2024?", [], "standard"),
+    ("Compare margin % and GCPM by department vs last year", [], "strong"),
+])
+def test_tier_follows_complexity(question, tables, tier):
+    route = _router(_stubs()).route(question, tables)
+    assert route["tier"] == tier
+    assert route["suggestions"] == ("template" if tier == "fast" else "llm")
+
+
+def test_longer_terms_are_not_counted_twice():
+    signals = complexity("margin loss for new customers")
+    assert signals["formulas"] == ["new customers", "margin loss"]
+    assert signals["metrics"] == []
+
+
+def test_history_length_raises_the_score():
+    assert complexity("and for web?", history_turns=3)["score"] == complexity("and for web?")["score"] + 1
+
+
+def test_routing_disabled_uses_the_standard_tier():
+    route = _router(_stubs(), enabled=False).route("Daily order count for March 2025")
+    assert (route["tier"], route["suggestions"]) == ("standard", "llm")
+
+
+def test_escalation_rules():
+    router = _router(_stubs())
+    fast = router.route("Daily order count for March 2025")
+    escalated = router.escalate(fast, "no such column: NoSuchColumn")
+    assert (escalated["tier"], escalated["escalated"]) == ("strong", True)
+    assert router.escalate(escalated, "no such column: NoSuchColumn") is None
+    assert router.escalate(fast, "Query failed: statement timed out after 120s") is None
+
+
+@pytest.mark.parametrize("error, repairable", [
+    ("Query failed: (pyodbc.ProgrammingError) ('42S22', \"[42S22] Invalid column name 'CancelDate'. (207)\")", True),
+    ("Query failed: Invalid object name 'your_schema.Sales_PoolOrders'.", True),
+    ("Query failed: statement timed out after 120s", False),
+    ("Query failed: ('HYT00', '[HYT00] [Microsoft][ODBC Driver 18 for SQL Server]Query timeout expired (0)')", False),
+    ("Query failed: ('HY008', '[HY008] Operation canceled (0)')", False),
+    ("Query failed: ('08S01', '[08S01] Communication link failure (10054)')", False),
+    ("Query failed: QueuePool limit of size 6 overflow 2 reached, connection timed out, timeout 30.00", False),
+    ("Query failed: the database is busy (too many queries queued), try again shortly", False),
+    ("Query failed: ('40001', 'Transaction (Process ID 57) was deadlocked on lock resources (1205)')", False),
+])
+def test_is_repairable(error, repairable):
+    assert is_repairable(error) == repairable
+
+
+def test_missing_tier_falls_back_to_the_nearest_one():
+    stubs = _stubs()
+    del stubs["fast"], stubs["strong"]
+    router = _router(stubs, models={"fast": "", "strong": ""})
+    route = router.route("Daily order count for March 2025")
+    assert (route["tier"], route["suggestions"]) == ("standard", "template")
+    assert router.route("Compare margin % and GCPM by department vs last year")["tier"] == "standard"
+    assert router.escalate(route, "no such column: x") is None
+    model = router.model(route, "rules")
+    assert model.system_instruction == "rules" and model._parent is stubs["standard"]
+
+
+def test_missing_middle_tier_prefers_the_stronger_neighbour():
+    router = ModelRouter(models={"standard": ""})
+    assert router.available_tier("standard") == "strong"
+    with pytest.raises(ValueError):
+        ModelRouter(models={"fast": "", "standard": "", "strong": ""}).available_tier("fast")
+
+
+def test_stats_per_route():
+    router = ModelRouter()
+    router.record("sql:fast", 0.1)
+    router.record("sql:fast", 0.3, ok=False)
+    router.record("sql:fast", ok=True)
+    stats = router.stats()["sql:fast"]
+    assert (stats["calls"], stats["ok"], stats["failed"], stats["success_rate"]) == (2, 1, 1, 0.5)
+    assert stats["p50_ms"] == pytest.approx(200.0)
+
+
+def test_template_follow_ups_from_column_types():
+    daily = pd.DataFrame({"Day": ["2025-03-01", "2025-03-02"], "OrderCount": [3, 4]})
+    assert template_follow_ups("daily orders", daily)[0] == "How does order count compare with the same period last year?"
+    by_channel = pd.DataFrame({"Channel": ["TV", "Web"], "GrossSales": [1.0, 2.0]})
+    suggestions = template_follow_ups("sales by channel", by_channel)
+    assert suggestions[0] == "Which channel had the lowest gross sales?"
+    assert not any("sales channel" in s for s in suggestions)
+    assert template_follow_ups("q", pd.DataFrame()) == []
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("bench") / "sales.sqlite3")
+    benchmark.build_dataset(path, orders=300)
+    return benchmark.open_database(path)
+
+
+@pytest.fixture
+def engine_for(database, tmp_path, monkeypatch):
+    for name, value in {"SQL_CACHE_PATH": "sql.sqlite3", "RESULT_STORE_DIR": "results", "EXAMPLE_LIBRARY_PATH": "examples.sqlite3",
+                        "PROMPT_DIR": "prompts", "ROLLUP_DIR": "rollups", "SCHEMA_SNAPSHOT_PATH": "snapshot.json"}.items():
+        monkeypatch.setenv(name, str(tmp_path / value))
+    monkeypatch.setenv("TRACING", "0")
+    monkeypatch.setattr(sales_engine, "USE_ROLLUPS", False)
+    monkeypatch.setattr(sales_engine, "GOVERN_QUERIES", False)
+    return lambda router: sales_engine.SalesEngine(database, schemas=[benchmark.SCHEMA], explain=lambda snapshot: "", router=router)
+
+
+def test_engine_escalates_a_failed_query_to_the_strong_model(engine_for):
+    stubs = _stubs(fast_replies=[("unique customers", BROKEN)])
+    engine = engine_for(_router(stubs))
+    conversation = sales_engine.Conversation()
+    turn = engine.ask(conversation, "Unique customers in 2024")
+    assert turn["status"] == "answered" and turn["escalated"]
+    assert (stubs["fast"].calls, stubs["strong"].calls) == (1, 1)
+    assert any(msg["content"].startswith("🔁") for msg in conversation.messages if msg["role"] == "assistant")
+    routes = engine.stats()["model_routes"]
+    assert routes["sql:fast"]["failed"] == 1 and routes["sql:strong (escalated)"]["ok"] == 1
+    # Template suggestions: no LLM call for a simple question.
+    assert routes["suggestions:template"]["calls"] == 1 and "suggestions:llm" not in routes
+    assert turn["suggestions"]
+
+
+def test_engine_does_not_escalate_twice(engine_for):
+    stubs = _stubs(fast_replies=[("unique customers", BROKEN)])
+    stubs["strong"] = StubModel([("unique customers", BROKEN)], default_reply=DEFAULT, latency=0)
+    engine = engine_for(_router(stubs))
+    turn = engine.ask(sales_engine.Conversation(), "Unique customers in 2024")
+    assert turn["status"] == "failed"
+    assert (stubs["fast"].calls, stubs["strong"].calls) == (1, 1)
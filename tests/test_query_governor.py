@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import create_engine
+
+import benchmark
+from query_governor import QueryGovernor, format_plan_summary
+
+BIG = {"sales_salesorderlines": 5_000_000, "sales_salesorders": 2_000_000, "sales_mstsaleschannels": 6}
+LINES = f"{benchmark.SCHEMA}.Sales_SalesOrderLines"
+ORDERS = f"{benchmark.SCHEMA}.Sales_SalesOrders"
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("governor") / "sales.sqlite3")
+    benchmark.build_dataset(path, orders=200)
+    return benchmark.open_database(path)
+
+
+def test_indexed_lookup_is_allowed(database):
+    plan = QueryGovernor(database, table_rows=BIG).check(f"SELECT so.OrderID FROM {ORDERS} so WHERE so.OrderDate >= '2025-01-01'")
+    assert (plan["verdict"], plan["reasons"], plan["error"]) == ("allow", [], None)
+
+
+def test_full_scan_of_a_big_table_needs_confirmation_without_a_row_limit(database):
+    governor = QueryGovernor(database, table_rows=BIG)
+    plan = governor.check(f"SELECT sol.ProductID, sol.QTY FROM {LINES} sol")
+    assert plan["verdict"] == "confirm"
+    assert plan["scans"] == [{"table": "sales_salesorderlines", "rows": 5_000_000}]
+    assert governor.check(f"SELECT sol.ProductID, sol.QTY FROM {LINES} sol LIMIT 10")["verdict"] == "allow"
+
+
+def test_cross_join_of_big_tables_is_blocked(database):
+    plan = QueryGovernor(database, table_rows=BIG).check(f"SELECT * FROM {LINES} sol, {ORDERS} so")
+    assert plan["verdict"] == "block" and plan["no_join_predicate"]
+    assert plan["estimated_rows"] == 5_000_000 * 2_000_000
+    assert any("cross join" in reason for reason in plan["reasons"])
+    small = QueryGovernor(database).check(f"SELECT * FROM {LINES} sol, {ORDERS} so")
+    assert small["verdict"] == "confirm"
+
+
+def test_verdicts_are_cached_per_normalized_sql(database):
+    governor = QueryGovernor(database, table_rows=BIG)
+    assert governor.check(f"SELECT sol.QTY FROM {LINES} sol")["cached"] is False
+    assert governor.check(f"select  sol.QTY\nfrom {LINES} sol;")["cached"] is True
+    stats = governor.stats()
+    assert (stats["checks"], stats["cache_hits"], stats["confirm"], stats["entries"]) == (2, 1, 1, 1)
+
+
+def test_plan_errors_allow_the_query_and_are_not_cached(database):
+    governor = QueryGovernor(database)
+    plan = governor.check("SELECT NoSuchColumn FROM nowhere")
+    assert plan["verdict"] == "allow" and "nowhere" in plan["error"]
+    assert governor.check("SELECT NoSuchColumn FROM nowhere")["cached"] is False
+    assert governor.stats()["errors"] == 2
+    assert format_plan_summary(plan).startswith("🔍 Plan unavailable")
+
+
+def test_unreachable_database_allows_the_query(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'missing' / 'sales.sqlite3'}")
+    plan = QueryGovernor(engine).check("SELECT 1")
+    assert plan["verdict"] == "allow" and plan["error"]
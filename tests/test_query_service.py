@@ -0,0 +1,59 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from query_service import QueryService
+
+SLOW_SQL = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+
+
+@pytest.fixture
+def service(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stream.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES " + ",".join(f"({i})" for i in range(250)))
+    service = QueryService(engine, max_concurrent=1)
+    yield service
+    engine.dispose()
+
+
+def test_stream_yields_chunks_up_to_max_rows(service):
+    chunks = list(service.stream("SELECT x FROM t ORDER BY x", "u", chunk_rows=100, max_rows=220))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 20]
+    assert chunks[-1]["x"].iloc[-1] == 219
+    assert service.queue.stats()["running"] == 0
+
+
+def test_stream_times_out_and_frees_its_slot(service):
+    started = time.perf_counter()
+    with pytest.raises(RuntimeError, match="timed out"):
+        list(service.stream(SLOW_SQL, "u", timeout_seconds=0.3))
+    assert time.perf_counter() - started < 10
+    assert service.queue.stats()["running"] == 0
+    assert len(list(service.stream("SELECT x FROM t", "u"))[0]) == 250
+
+
+def test_time_to_first_row_excludes_queue_wait(service):
+    holder = service.stream("SELECT x FROM t", "a", chunk_rows=10)
+    next(holder)  # keeps the only slot busy
+    job = service.submit("SELECT x FROM t", "b")
+    time.sleep(0.4)
+    holder.close()
+    job.wait(10)
+    assert job.status == "done"
+    assert job.queued_seconds >= 0.3
+    assert job.time_to_first_row < job.queued_seconds
+
+
+def test_truncated_job_does_not_return_its_connection(service):
+    connects = []
+    event.listen(service.engine, "connect", lambda *args: connects.append(1))
+    service.run("SELECT x FROM t", "u")
+    service.run("SELECT x FROM t", "u")
+    assert len(connects) == 0  # the fixture's connection is reused
+    job = service.run("SELECT x FROM t", "u", chunk_rows=50, max_rows=100)
+    assert job.status == "truncated"
+    service.run("SELECT x FROM t", "u")
+    assert len(connects) == 1
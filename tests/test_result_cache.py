@@ -0,0 +1,80 @@
+import datetime
+import time
+
+import pandas as pd
+
+from result_cache import ResultCache, normalize_sql, ttl_for_sql
+
+
+def _frame(rows=10):
+    return pd.DataFrame({"x": range(rows), "y": [float(i) for i in range(rows)]})
+
+
+def test_normalize_sql_keeps_literals():
+    sql = "SELECT  Name -- comment\nFROM T WHERE Name = 'Mobile App';"
+    assert normalize_sql(sql) == "select name from t where name = 'Mobile App'"
+
+
+def test_ttl_rules_for_relative_dates():
+    now = datetime.datetime(2025, 3, 1, 12, 0)
+    assert ttl_for_sql("select 1 from t where d >= '2024-01-01'", now=now) == 3600
+    assert ttl_for_sql("select 1 from t where d >= cast(getdate() as date)", now=now) == 900
+    assert ttl_for_sql("select 1 from t where d >= getdate()", now=now) == 60
+    late = datetime.datetime(2025, 3, 1, 23, 59, 30)
+    assert ttl_for_sql("select 1 from t where d >= cast(getdate() as date)", now=late) == 30
+
+
+def test_hit_for_equivalent_sql_and_miss_otherwise():
+    cache = ResultCache()
+    cache.put("SELECT x FROM t", _frame())
+    assert cache.get("select   x\nfrom t;") is not None
+    assert cache.get("SELECT y FROM t") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache = ResultCache(default_ttl=10)
+    cache.put("SELECT x FROM t", _frame())
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("SELECT x FROM t") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_memory_budget_evicts_least_recently_used():
+    entry_bytes = int(_frame().memory_usage(deep=True).sum())
+    cache = ResultCache(max_bytes=entry_bytes * 2, max_entry_fraction=1.0)
+    cache.put("SELECT 1", _frame())
+    cache.put("SELECT 2", _frame())
+    cache.get("SELECT 1")
+    cache.put("SELECT 3", _frame())
+    assert cache.get("SELECT 2") is None
+    assert cache.get("SELECT 1") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_oversized_results_are_not_cached():
+    cache = ResultCache(max_bytes=1024, max_entry_fraction=0.25)
+    cache.put("SELECT big", _frame(1000))
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_one_or_all():
+    cache = ResultCache()
+    cache.put("SELECT 1", _frame())
+    cache.put("SELECT 2", _frame())
+    cache.invalidate("select 1")
+    assert cache.get("SELECT 1") is None and cache.get("SELECT 2") is not None
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def test_variants_are_cached_apart():
+    cache = ResultCache()
+    cache.put("SELECT x FROM t", _frame(), variant="compact")
+    assert cache.get("SELECT x FROM t") is None
+    assert cache.get("SELECT x FROM t", variant="compact") is not None
+    cache.put("SELECT x FROM t", _frame())
+    cache.invalidate("SELECT x FROM t")
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import result_export
+from result_export import write_chunks
+
+
+def _chunks():
+    yield pd.DataFrame({"Channel": ["TV", "Web"], "Sales": [1.5, 2.5], "Note": [None, None]})
+    yield pd.DataFrame({"Channel": ["Mobile"], "Sales": [3.0], "Note": ["late"]})
+
+
+def test_csv(tmp_path):
+    path = tmp_path / "out.csv"
+    info = write_chunks(_chunks(), "csv", str(path))
+    assert info["rows"] == 3 and not info["truncated"] and info["bytes"] == path.stat().st_size
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    assert df["Channel"].tolist() == ["TV", "Web", "Mobile"]
+
+
+def test_parquet_types_all_null_first_chunk_as_text(tmp_path):
+    path = tmp_path / "out.parquet"
+    assert write_chunks(_chunks(), "parquet", str(path))["rows"] == 3
+    df = pd.read_parquet(path)
+    assert df["Sales"].tolist() == [1.5, 2.5, 3.0]
+    assert df["Note"].tolist()[2] == "late"
+
+
+def test_excel(tmp_path):
+    path = tmp_path / "out.xlsx"
+    assert write_chunks(_chunks(), "xlsx", str(path))["rows"] == 3
+    df = pd.read_excel(path, sheet_name="Result")
+    assert df.columns.tolist() == ["Channel", "Sales", "Note"] and len(df) == 3
+
+
+def test_excel_stops_at_sheet_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_export, "EXCEL_MAX_ROWS", 2)
+    info = write_chunks(_chunks(), "xlsx", str(tmp_path / "out.xlsx"))
+    assert info["rows"] == 2 and info["truncated"]
+
+
+def test_progress_and_cancel(tmp_path):
+    progress = []
+    with pytest.raises(RuntimeError):
+        write_chunks(_chunks(), "csv", str(tmp_path / "out.csv"), on_progress=progress.append, should_stop=lambda: len(progress) == 1)
+    assert progress == [2]
@@ -0,0 +1,76 @@
+import os
+import time
+
+import pandas as pd
+
+from result_store import ResultStore
+
+
+def _frame(rows=1000, offset=0):
+    return pd.DataFrame({"id": range(offset, offset + rows), "name": [f"row {i}" for i in range(rows)], "amount": [i * 0.5 for i in range(rows)]})
+
+
+SIZE = int(_frame().memory_usage(deep=True).sum())
+
+
+def test_results_are_spilled_and_reloaded(tmp_path):
+    store = ResultStore(str(tmp_path), max_bytes=SIZE)
+    df = _frame()
+    df.attrs["partial_result"] = "truncated"
+    handle = store.put("s1", df)
+    assert handle.startswith("s1/") and store.get(handle) is df
+    assert os.path.exists(os.path.join(store.root, "s1", handle.split("/")[-1] + ".arrow"))
+    store.put("s1", _frame(offset=1000))  # pushes the first frame out of memory
+    reloaded = store.get(handle)
+    pd.testing.assert_frame_equal(reloaded, df)
+    assert reloaded.attrs["partial_result"] == "truncated"
+    stats = store.stats()
+    assert (stats["spills"], stats["evictions"], stats["loads"]) == (2, 2, 1)
+    assert store.info(handle) == {"rows": 1000, "columns": ["id", "name", "amount"], "nbytes": SIZE}
+
+
+def test_session_budget_evicts_that_session_only(tmp_path):
+    store = ResultStore(str(tmp_path), session_max_bytes=int(SIZE * 2.5))
+    store.put("s2", _frame())
+    handles = [store.put("s1", _frame(offset=i)) for i in range(4)]
+    stats = store.stats()
+    assert (stats["evictions"], stats["in_memory"], stats["memory_bytes"]) == (2, 3, 3 * SIZE)
+    assert store.get(handles[0])["id"].iloc[0] == 0  # still served, from disk
+    assert store.stats()["loads"] == 1
+
+
+def test_global_budget_evicts_least_recently_used(tmp_path):
+    store = ResultStore(str(tmp_path), max_bytes=int(SIZE * 2.5))
+    first, second = store.put("a", _frame()), store.put("b", _frame())
+    store.get(first)  # now the most recently used
+    store.put("c", _frame())
+    store.get(first)
+    assert store.stats()["loads"] == 0
+    store.get(second)
+    assert store.stats()["loads"] == 1 and store.stats()["memory_bytes"] <= store.max_bytes
+
+
+def test_unspillable_frames_stay_in_memory(tmp_path):
+    store = ResultStore(str(tmp_path), max_bytes=1)
+    handle = store.put("s1", pd.DataFrame({"mixed": [1, "a", object()]}))
+    assert store.get(handle) is not None and store.stats()["spills"] == 0
+
+
+def test_chunks_and_dropped_sessions(tmp_path):
+    store = ResultStore(str(tmp_path), max_bytes=1)  # only the newest frame stays in memory
+    handle = store.put("s1", _frame(250))
+    store.put("s1", _frame(10))
+    assert store.stats()["in_memory"] == 1
+    assert [len(chunk) for chunk in store.iter_chunks(handle, 100)] == [100, 100, 50]
+    store.drop_session("s1")
+    assert store.get(handle) is None and not os.path.exists(os.path.join(store.root, "s1"))
+    assert list(store.iter_chunks(handle)) == []
+
+
+def test_idle_sessions_are_swept(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path), session_ttl=10)
+    handle = store.put("idle", _frame(10))
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    store.put("active", _frame(10))
+    assert store.get(handle) is None and store.stats()["expired_sessions"] == 1
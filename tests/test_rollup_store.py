@@ -0,0 +1,79 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import benchmark
+from rollup_store import BASE_FILTERS, ROLLUPS, RollupRouter, RollupStore, source_sql
+
+TODAY = datetime.date(2025, 9, 30)  # the stand-in's orders run from 2023-04-01 to late September 2025
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rollups") / "sales.sqlite3")
+    benchmark.build_dataset(path, orders=2000)
+    return benchmark.open_database(path)
+
+
+@pytest.fixture
+def store(database, tmp_path):
+    store = RollupStore(str(tmp_path / "rollups"))
+    store.refresh(database, benchmark.SCHEMA, full=True, today=TODAY)
+    return store
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What were gross sales by sales channel in FY2024?", (["gross_sales"], "channel", False, datetime.date(2024, 4, 1), datetime.date(2025, 4, 1))),
+    ("Daily order count for March 2025", (["order_count"], None, True, datetime.date(2025, 3, 1), datetime.date(2025, 4, 1))),
+    ("Quantity and revenue by department in 2024", (["gross_sales", "quantity"], "department", False, datetime.date(2024, 1, 1), datetime.date(2025, 1, 1))),
+])
+def test_parse_recognises_plain_metric_questions(question, expected):
+    parsed = RollupRouter(None).parse(question)
+    assert (parsed["measures"], parsed["dimension"], parsed["by_day"], parsed["start"], parsed["end"]) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "Net sales in 2024",  # not a Part 2-D metric: the LLM decides what it means
+    "Top 10 products by sales in 2024",
+    "Gross sales by channel and by department in 2024",
+    "Gross sales by channel",  # no period
+])
+def test_parse_declines_everything_else(question):
+    assert RollupRouter(None).parse(question) is None
+
+
+def test_fiscal_year_naming():
+    assert RollupRouter(None).parse("sales in fy24")["start"] == datetime.date(2024, 4, 1)
+    assert RollupRouter(None, fy_named_by_start=False).parse("sales in fy24")["start"] == datetime.date(2023, 4, 1)
+
+
+def test_answer_matches_the_source_query(database, store):
+    answer = RollupRouter(store, dialect="sqlite").route("Gross sales by sales channel in FY2024")
+    assert answer["rollup"] == "daily_channel"
+    expected = pd.read_sql(source_sql("sqlite", benchmark.SCHEMA, ["gross_sales"], "channel", "2024-04-01", "2025-04-01", by_day=False), database)
+    expected = expected.set_index("Channel")["GrossSales"].round(2).sort_index()
+    assert answer["df"].set_index("Channel")["GrossSales"].sort_index().tolist() == pytest.approx(expected.tolist())
+    assert "'2024-04-01'" in answer["sql"] and "'2025-04-01'" in answer["sql"]
+
+
+def test_distinct_counts_are_not_summed_over_days(store):
+    router = RollupRouter(store, dialect="sqlite")
+    assert router.route("Unique customers in 2024") is None
+    assert router.route("Daily unique customers for March 2025") is not None
+    assert router.stats() == {"routed": 1, "declined": 1}
+
+
+def test_refresh_rebuilds_only_recent_and_missing_months(database, store, tmp_path):
+    assert store.refresh(database, benchmark.SCHEMA, recent_months=2, today=TODAY)["partitions"] == 2 * len(ROLLUPS)
+    (tmp_path / "rollups" / "daily" / "2024-01.parquet").unlink()
+    assert store.refresh(database, benchmark.SCHEMA, recent_months=0, today=TODAY)["partitions"] == 1
+
+
+def test_other_filters_rebuild_and_stale_rollups_are_not_served(database, store, tmp_path):
+    other = RollupStore(str(tmp_path / "rollups"), filters=BASE_FILTERS.replace("sol.ProductID > 0", "sol.ProductID > 10"))
+    assert RollupRouter(other, dialect="sqlite").route("Gross sales in 2024") is None
+    months = len(store.manifest()["partitions"]["daily"])
+    assert other.refresh(database, benchmark.SCHEMA, today=TODAY)["partitions"] == months * len(ROLLUPS)
+    assert RollupRouter(other, dialect="sqlite").route("Gross sales in 2024") is not None
+    assert RollupRouter(other, max_age_seconds=0, dialect="sqlite").route("Gross sales in 2024") is None
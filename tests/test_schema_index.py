@@ -0,0 +1,46 @@
+from schema_index import SchemaIndex, tokenize
+
+
+def _table(*columns, foreign_keys=(), row_estimate=None):
+    return {"columns": [{"name": c, "type": "int", "nullable": True} for c in columns], "foreign_keys": list(foreign_keys), "row_estimate": row_estimate}
+
+
+TABLES = {
+    "s.Sales_SalesOrders": _table("OrderID", "OrderDate", "CustomerID", "SalesChannelID", row_estimate=1_000_000,
+                                  foreign_keys=[{"name": "fk1", "columns": ["SalesChannelID"], "ref_table": "s.Sales_MstSalesChannels", "ref_columns": ["SalesChannelID"]}]),
+    "s.Sales_SalesOrderLines": _table("OrderID", "ProductID", "QTY", "TotalNetAmt", row_estimate=5_000_000,
+                                      foreign_keys=[{"name": "fk2", "columns": ["OrderID"], "ref_table": "s.Sales_SalesOrders", "ref_columns": ["OrderID"]}]),
+    "s.Sales_MstSalesChannels": _table("SalesChannelID", "Name"),
+    "s.Discount_Discounts": _table("DiscountID", "DiscountAmt"),
+    "s.System_MstBudgetPay": _table("BudgetID", "Amount"),
+}
+
+
+def test_tokenize_splits_identifiers_and_plurals():
+    assert tokenize("Sales_MstSalesChannels") == ["sale", "mst", "sale", "channel"]
+    assert tokenize("show the orders for 2024") == ["order"]
+
+
+def test_table_names_outrank_columns():
+    index = SchemaIndex(TABLES)
+    scores = index.score("sales by channel")
+    assert max(scores, key=scores.get) == "s.Sales_MstSalesChannels"
+
+
+def test_business_terms_route_to_their_tables():
+    index = SchemaIndex(TABLES, business_terms={"gcpm margin loss": ["System_MstBudgetPay"]})
+    scores = index.score("what was the margin loss")
+    assert list(scores) == ["s.System_MstBudgetPay"]
+
+
+def test_select_adds_fk_neighbours_and_core_tables():
+    index = SchemaIndex(TABLES, always_include=["Sales_SalesOrderLines"])
+    selected = index.select("discount amount", top_k=1)
+    assert selected[0] == "s.Discount_Discounts"
+    assert "s.Sales_SalesOrderLines" in selected
+    channel = index.select("channel name", top_k=1)
+    assert channel[:2] == ["s.Sales_MstSalesChannels", "s.Sales_SalesOrders"]
+
+
+def test_select_is_empty_when_nothing_matches():
+    assert SchemaIndex(TABLES).select("weather tomorrow") == []
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+import benchmark
+from schema_snapshot import load_snapshot, refresh_snapshot, schema_column_map
+
+SCHEMA = benchmark.SCHEMA
+_DDL = """
+CREATE TABLE Customers (CustomerID INTEGER PRIMARY KEY, Name VARCHAR(100) NOT NULL);
+CREATE TABLE Orders (OrderID INTEGER PRIMARY KEY, CustomerID INTEGER REFERENCES Customers (CustomerID), Amount DECIMAL(12, 2));
+CREATE INDEX ix_orders_customer ON Orders (CustomerID);
+CREATE TABLE Scratch (x INTEGER);
+"""
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "app.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(_DDL)
+    engine = benchmark.open_database(path)
+    yield path, engine
+    engine.dispose()
+
+
+def _execute(path, sql):
+    with sqlite3.connect(path) as conn:
+        conn.executescript(sql)
+
+
+def test_full_read(database, tmp_path):
+    _, engine = database
+    snapshot_path = str(tmp_path / "snapshot.json")
+    snapshot = refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    assert snapshot["last_refresh"]["full"] and snapshot["last_refresh"]["reread"] == 3
+    orders = snapshot["tables"][f"{SCHEMA}.Orders"]
+    assert orders["columns"] == [{"name": "OrderID", "type": "integer", "nullable": True},
+                                 {"name": "CustomerID", "type": "integer", "nullable": True},
+                                 {"name": "Amount", "type": "decimal(12, 2)", "nullable": True}]
+    assert orders["primary_key"] == ["OrderID"]
+    assert orders["foreign_keys"] == [{"name": "fk_Orders_0", "columns": ["CustomerID"], "ref_table": f"{SCHEMA}.Customers", "ref_columns": ["CustomerID"]}]
+    assert snapshot["tables"][f"{SCHEMA}.Customers"]["columns"][1] == {"name": "Name", "type": "varchar(100)", "nullable": False}
+    assert load_snapshot(snapshot_path)["fingerprint"] == snapshot["fingerprint"]
+    assert schema_column_map(snapshot)[f"{SCHEMA}.Customers"] == ["CustomerID", "Name"]
+
+
+def test_incremental_reread(database, tmp_path):
+    path, engine = database
+    snapshot_path = str(tmp_path / "snapshot.json")
+    first = refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    unchanged = refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    assert (unchanged["last_refresh"]["full"], unchanged["last_refresh"]["reread"]) == (False, 0)
+    assert unchanged["fingerprint"] == first["fingerprint"]
+
+    _execute(path, "ALTER TABLE Orders ADD COLUMN OrderDate DATE; INSERT INTO Orders VALUES (1, NULL, 1.5, NULL), (2, NULL, 2.5, NULL); ANALYZE;")
+    changed = refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    assert changed["last_refresh"]["reread"] == 1
+    assert [c["name"] for c in changed["tables"][f"{SCHEMA}.Orders"]["columns"]][-1] == "OrderDate"
+    assert changed["tables"][f"{SCHEMA}.Orders"]["row_estimate"] == 2
+    assert changed["fingerprint"] != first["fingerprint"]
+
+
+def test_removed_table(database, tmp_path):
+    path, engine = database
+    snapshot_path = str(tmp_path / "snapshot.json")
+    refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    _execute(path, "DROP TABLE Scratch;")
+    snapshot = refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    assert (snapshot["last_refresh"]["removed"], snapshot["last_refresh"]["reread"]) == (1, 0)
+    assert f"{SCHEMA}.Scratch" not in load_snapshot(snapshot_path)["tables"]
+
+
+def test_other_schemas_force_a_full_read(database, tmp_path):
+    _, engine = database
+    snapshot_path = str(tmp_path / "snapshot.json")
+    refresh_snapshot(engine, [SCHEMA], snapshot_path)
+    snapshot = refresh_snapshot(engine, [SCHEMA, "main"], snapshot_path)
+    assert snapshot["last_refresh"]["full"]
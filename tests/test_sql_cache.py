@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from sql_cache import SqlCache, question_template, substitute_literals
+
+
+def _literals(question):
+    return question_template(question)[1]
+
+
+def test_question_template_extracts_literals():
+    template, literals = question_template("Gross sales for 'Mobile' in FY24?")
+    assert template == "gross sales for <string> in <fy>"
+    assert literals == [("string", "mobile"), ("fy", "2024")]
+
+
+def test_substitute_string_only_inside_sql_literals():
+    sql = "SELECT * FROM s.Sales_mobileTargets t WHERE t.Channel = 'mobile'"
+    new_sql = substitute_literals(sql, _literals("targets for 'mobile'"), _literals("targets for 'web'"))
+    assert new_sql == "SELECT * FROM s.Sales_mobileTargets t WHERE t.Channel = 'web'"
+
+
+def test_substitute_string_escapes_quotes():
+    sql = "SELECT 1 FROM t WHERE name LIKE '%mobile%'"
+    new_sql = substitute_literals(sql, _literals("customers named 'mobile'"), _literals('customers named "o\'brien"'))
+    assert new_sql == "SELECT 1 FROM t WHERE name LIKE '%o''brien%'"
+
+
+def test_substitute_string_missing_from_literals_falls_through():
+    sql = "SELECT * FROM s.Sales_mobileTargets"
+    assert substitute_literals(sql, _literals("targets for 'mobile'"), _literals("targets for 'web'")) is None
+
+
+def test_substitute_fiscal_year_shifts_both_bounds():
+    sql = "WHERE OrderDate >= '2024-04-01' AND OrderDate < '2025-04-01'"
+    new_sql = substitute_literals(sql, _literals("sales in fy24"), _literals("sales in fy25"))
+    assert new_sql == "WHERE OrderDate >= '2025-04-01' AND OrderDate < '2026-04-01'"
+
+
+def test_substitute_calendar_year_shifts_the_range_end():
+    sql = "WHERE OrderDate >= '2024-01-01' AND OrderDate < '2025-01-01' AND YEAR(OrderDate) = 2024"
+    new_sql = substitute_literals(sql, _literals("gross sales in 2024"), _literals("gross sales in 2025"))
+    assert new_sql == "WHERE OrderDate >= '2025-01-01' AND OrderDate < '2026-01-01' AND YEAR(OrderDate) = 2025"
+
+
+def test_substitute_fiscal_year_shifts_both_bounds_backwards():
+    sql = "WHERE OrderDate >= '2024-04-01' AND OrderDate < '2025-04-01'"
+    new_sql = substitute_literals(sql, _literals("sales in fy2024"), _literals("sales in fy2022"))
+    assert new_sql == "WHERE OrderDate >= '2022-04-01' AND OrderDate < '2023-04-01'"
+
+
+def test_substitute_two_years_in_one_question():
+    sql = "WHERE d >= '2023-01-01' AND d < '2025-01-01'"
+    assert substitute_literals(sql, _literals("sales in 2023 and 2024"), _literals("sales in 2021 and 2022")) == "WHERE d >= '2021-01-01' AND d < '2023-01-01'"
+    # 2024 would have to move by -2 for the first year and by +1 for the second.
+    assert substitute_literals(sql, _literals("sales in 2023 and 2024"), _literals("sales in 2021 and 2025")) is None
+
+
+def test_substitute_number_ignores_digits_in_literals():
+    sql = "SELECT x FROM t WHERE d >= '2024-10-01'"
+    assert substitute_literals(sql, _literals("top 10 products"), _literals("top 5 products")) is None
+    sql = "SELECT TOP (10) x FROM t WHERE d >= '2024-10-01' AND code = '10'"
+    assert substitute_literals(sql, _literals("top 10 products"), _literals("top 5 products")) == \
+        "SELECT TOP (5) x FROM t WHERE d >= '2024-10-01' AND code = '10'"
+
+
+def test_substitute_ambiguous_number_falls_through():
+    sql = "SELECT TOP (10) x FROM t WHERE y > 10"
+    assert substitute_literals(sql, _literals("top 10 products"), _literals("top 5 products")) is None
+    assert substitute_literals("SELECT TOP (10) x FROM t", _literals("top 10 products"), _literals("top 5 products")) == "SELECT TOP (5) x FROM t"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SqlCache(str(tmp_path / "sql_cache.sqlite3"), max_entries=3)
+
+
+def test_exact_hit_and_miss(cache):
+    cache.put("Top 10 products in 2024?", "p1", "Best sellers.", "SELECT TOP (10) * FROM t WHERE y = 2024", gen_seconds=2.0)
+    assert cache.get("top 10 products in 2024", "p1") == ("Best sellers.", "SELECT TOP (10) * FROM t WHERE y = 2024")
+    assert cache.get("top 10 products in 2024", "other prompt") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["seconds_saved"]) == (1, 1, 2.0)
+
+
+def test_template_hit_rewrites_literals(cache):
+    cache.put("top 10 products in 2024", "p1", "Best sellers of 2024.", "SELECT TOP (10) * FROM t WHERE y = 2024")
+    assert cache.get("top 5 products in 2025", "p1") == ("Best sellers of 2025.", "SELECT TOP (5) * FROM t WHERE y = 2025")
+    assert cache.stats()["template_hits"] == 1
+
+
+def test_template_hit_moves_the_whole_year_range(cache):
+    sql = "SELECT SUM(x) FROM t WHERE d >= '2024-01-01' AND d < '2025-01-01'"
+    cache.put("gross sales in 2024", "p1", "Sales from 2024-01-01 to 2025-01-01.", sql)
+    assert cache.get("gross sales in 2025", "p1") == ("Sales from 2025-01-01 to 2026-01-01.",
+                                                      "SELECT SUM(x) FROM t WHERE d >= '2025-01-01' AND d < '2026-01-01'")
+
+
+def test_entries_expire_after_ttl(cache, monkeypatch):
+    cache.put("sales in 2024", "p1", "e", "SELECT 1")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + cache.ttl_seconds + 1)
+    assert cache.get("sales in 2024", "p1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_beyond_max_entries(cache):
+    for i in range(4):
+        cache.put(f"question {chr(97 + i)}", "p1", "e", f"SELECT {i}")
+    assert cache.stats()["entries"] == 3
+
+
+def test_held_sql_is_cached_only_once_confirmed(cache):
+    cache.hold("sales in 2024", "p1", "e", "SELECT 1")
+    assert cache.get("sales in 2024", "p1") is None
+    cache.confirm("SELECT 1")
+    assert cache.get("sales in 2024", "p1") == ("e", "SELECT 1")
+    cache.hold("sales in 2023", "p1", "e", "SELECT 2")
+    cache.discard("SELECT 2")
+    cache.confirm("SELECT 2")
+    assert cache.get("sales in 2023", "p1") is None
+
+
+def test_invalidate_drops_one_entry(cache):
+    cache.put("sales in 2024", "p1", "e", "SELECT 1")
+    cache.put("orders in 2024", "p1", "e", "SELECT 2")
+    cache.invalidate("Sales in 2024?", "p1")
+    assert cache.get("sales in 2024", "p1") is None
+    assert cache.get("orders in 2024", "p1") == ("e", "SELECT 2")
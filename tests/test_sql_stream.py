@@ -0,0 +1,58 @@
+import math
+
+from sql_generation import SqlReplyStream, read_sql_stream
+from stub_llm import StubModel, StubStream
+
+EXPLANATION = "Gross sales per sales channel for FY2024."
+SQL = "SELECT Channel, SUM(TotalNetAmt) AS GrossSales\nFROM t\nGROUP BY Channel"
+NOTES = "\n\n**Validation:**\n- Applied the standard order filters.\n- Grouped by channel.\n"
+REPLY = f"{EXPLANATION}\n\n```sql\n{SQL}\n```{NOTES}"
+
+
+def _stream(text, chunk_chars):
+    return StubStream(text, prompt_tokens=0, first_delay=0, seconds_per_token=0, chunk_chars=chunk_chars)
+
+
+def test_fence_split_across_chunks():
+    shown = []
+    explanation, sql, _ = read_sql_stream(_stream(REPLY, chunk_chars=3), on_explanation=shown.append)
+    assert (explanation, sql) == (EXPLANATION, SQL)
+    assert shown and all("`" not in text for text in shown)
+    assert shown[-1] == EXPLANATION
+
+
+def test_stops_reading_once_the_fence_closes():
+    stream = _stream(REPLY, chunk_chars=5)
+    read_sql_stream(stream)
+    fence_end = REPLY.index("```", REPLY.index("```sql") + 6) + 3
+    assert stream.chunks_sent == math.ceil(fence_end / 5)
+    assert stream.chunks_sent < math.ceil(len(REPLY) / 5)
+
+
+def test_unclosed_fence_falls_back_to_the_whole_reply():
+    explanation, sql, _ = read_sql_stream(_stream(f"{EXPLANATION}\n\n```sql\n{SQL}\n", chunk_chars=7))
+    assert (explanation, sql) == (EXPLANATION, SQL)
+
+
+def test_reply_without_sql():
+    text = "I can only answer questions about sales data."
+    explanation, sql, last = read_sql_stream(_stream(text, chunk_chars=8))
+    assert (explanation, sql) == (text, None)
+    assert last.text == text[-(len(text) % 8 or 8):]
+
+
+def test_bare_select_reply():
+    assert SqlReplyStream().result() == ("", None)
+    parser = SqlReplyStream()
+    parser.feed("SELECT 1")
+    assert parser.result() == ("SELECT 1", "SELECT 1")
+
+
+def test_stub_model_stream_through_a_chat():
+    model = StubModel([("channel", REPLY)], default_reply="No SQL here.", latency=0)
+    chat = model.with_system_instruction("rules").start_chat()
+    explanation, sql, last = read_sql_stream(chat.send_message("gross sales by channel", stream=True))
+    assert (explanation, sql) == (EXPLANATION, SQL)
+    assert last.usage_metadata.prompt_token_count > 0
+    assert read_sql_stream(chat.send_message("hello", stream=True))[:2] == ("No SQL here.", None)
+    assert model.calls == 2
@@ -0,0 +1,22 @@
+from system_prompt import PromptArtifacts, SCHEMA_PLACEHOLDER, compiled_prompt_path, rules_version
+
+SNAPSHOT = {"fingerprint": "abc123", "tables": {"dbo.Sales_SalesOrders": {"columns": [{"name": "OrderID", "type": "INT"}]}}}
+TEMPLATE = f"Rules v1\n{SCHEMA_PLACEHOLDER}\n"
+
+
+def test_compiled_prompt_is_written_to_the_artifacts_directory(tmp_path):
+    artifacts = PromptArtifacts(str(tmp_path), rules_template=TEMPLATE)
+    artifact = artifacts.get(SNAPSHOT, lambda snapshot: "hint")
+    with open(compiled_prompt_path(str(tmp_path)), encoding="utf-8") as f:
+        assert f.read() == artifact["system_prompt"]
+    assert "Sales_SalesOrders" in artifact["system_prompt"]
+
+
+def test_rules_change_recompiles_without_a_new_explanation(tmp_path):
+    explained = []
+    explain = lambda snapshot: explained.append(snapshot["fingerprint"]) or "hint"
+    first = PromptArtifacts(str(tmp_path), rules_template=TEMPLATE).get(SNAPSHOT, explain)
+    second = PromptArtifacts(str(tmp_path), rules_template=TEMPLATE.replace("v1", "v2")).get(SNAPSHOT, explain)
+    assert first["rules_version"] == rules_version(TEMPLATE) != second["rules_version"]
+    assert first["key"] != second["key"]
+    assert explained == ["abc123"]
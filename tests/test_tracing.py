@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from tracing import Tracer, read_spans, recent_requests, slowest_spans, stage_percentiles
+
+
+def test_spans_time_the_block_and_collect_attributes():
+    tracer = Tracer(path=None)
+    trace_id = tracer.new_trace()
+    with tracer.span("sql", trace_id, dialect="sqlite") as attrs:
+        time.sleep(0.01)
+        attrs["rows"] = 3
+    span, = tracer.spans()
+    assert (span["trace"], span["span"], span["attrs"]) == (trace_id, "sql", {"dialect": "sqlite", "rows": 3})
+    assert span["ms"] >= 10
+
+
+def test_errors_are_recorded_and_reraised():
+    tracer = Tracer(path=None)
+    with pytest.raises(ValueError):
+        with tracer.span("llm"):
+            raise ValueError("quota exceeded")
+    assert tracer.spans()[0]["attrs"] == {"error": "quota exceeded"}
+
+
+def test_unsampled_traces_are_dropped_whole():
+    tracer = Tracer(path=None, sample_rate=0)
+    trace_id = tracer.new_trace()
+    tracer.record("llm", 0.5, trace_id)
+    tracer.record("request", 0.6, trace_id)
+    assert tracer.spans() == []
+    tracer.end_trace(trace_id)
+    tracer.record("request", 0.6, trace_id)
+    assert len(tracer.spans()) == 1
+
+
+def test_ring_buffer_keeps_the_newest_spans():
+    tracer = Tracer(path=None, max_recent=3)
+    for i in range(5):
+        tracer.record(f"s{i}", 0.001)
+    assert [s["span"] for s in tracer.spans()] == ["s2", "s3", "s4"]
+
+
+def test_spans_are_written_and_read_back(tmp_path):
+    path = str(tmp_path / "traces" / "spans.jsonl")
+    tracer = Tracer(path=path)
+    tracer.record("llm", 1.0, "t1", model="flash")
+    tracer.record("sql", 0.25, "t1")
+    deadline = time.time() + 5
+    while len(read_spans(path)) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert read_spans(path) == tracer.spans()
+    assert read_spans(path, since=time.time() + 60) == []
+
+
+def test_read_spans_includes_the_rotated_log_and_skips_torn_lines(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    (tmp_path / "spans.jsonl.1").write_text('{"ts": 1, "trace": null, "span": "old", "ms": 1}\n')
+    path.write_text('{"ts": 2, "trace": null, "span": "new", "ms": 2}\n{"ts": 3, "tra\n')
+    assert [s["span"] for s in read_spans(str(path))] == ["old", "new"]
+
+
+def _span(name, ms, trace="t1", ts=1000.0, **attrs):
+    return {"ts": ts, "trace": trace, "span": name, "ms": ms, **({"attrs": attrs} if attrs else {})}
+
+
+def test_stage_percentiles():
+    spans = [_span("sql", float(ms)) for ms in range(1, 101)] + [_span("llm", 40.0)]
+    llm, sql = stage_percentiles(spans)
+    assert llm == {"stage": "llm", "count": 1, "p50_ms": 40.0, "p95_ms": 40.0, "p99_ms": 40.0, "max_ms": 40.0}
+    assert (sql["count"], sql["p50_ms"], sql["p95_ms"], sql["p99_ms"], sql["max_ms"]) == (100, 50.5, 95.0, 99.0, 100.0)
+
+
+def test_recent_requests_and_slowest_spans():
+    spans = [
+        _span("request", 900.0, "t1", ts=1000.0, question="Sales in 2024", status="ok"),
+        _span("llm", 500.0, "t1", ts=1000.1),
+        _span("sql", 150.0, "t1", ts=1000.6),
+        _span("sql", 100.0, "t1", ts=1000.8),
+        _span("request", 300.0, "t2", ts=2000.0, question="Top products"),
+        _span("sql", 5.0, None, ts=3000.0),
+    ]
+    newest, oldest = recent_requests(spans)
+    assert newest["trace"] == "t2" and newest["total_ms"] == 300.0
+    assert (oldest["question"], oldest["total_ms"], oldest["llm_ms"], oldest["sql_ms"]) == ("Sales in 2024", 900.0, 500.0, 250.0)
+    assert len(recent_requests(spans, limit=1)) == 1
+    assert [s["ms"] for s in slowest_spans(spans, "sql", limit=2)] == [150.0, 100.0]
+    assert slowest_spans(spans, "request")[0]["question"] == "Sales in 2024"
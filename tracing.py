@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_TRACE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traces", "spans.jsonl")
+
+
+class Tracer:
+    """Structured timing spans, written as JSON lines and kept in a ring buffer for the admin panel.
+
+    A span costs a dict, two perf_counter calls and a queue put on the calling thread; a daemon
+    writer batches the file writes. `sample_rate` drops whole traces (not single spans) when lower
+    than 1. The log rotates to `<path>.1` once it grows past `max_file_bytes`."""
+
+    def __init__(self, path: str = DEFAULT_TRACE_PATH, sample_rate: float = 1.0, max_recent: int = 5000, max_file_bytes: int = 50 * 1024 ** 2):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.recent = deque(maxlen=max_recent)
+        self._pending = queue.SimpleQueue()
+        self._unsampled = set()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            threading.Thread(target=self._write_loop, name="trace-writer", daemon=True).start()
+
+    def new_trace(self) -> str:
+        trace_id = uuid.uuid4().hex[:16]
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            with self._lock:
+                self._unsampled.add(trace_id)
+        return trace_id
+
+    def end_trace(self, trace_id):
+        with self._lock:
+            self._unsampled.discard(trace_id)
+
+    def record(self, name: str, seconds: float, trace_id=None, **attrs):
+        """Adds a span that was timed elsewhere (e.g. by a QueryJob)."""
+        if trace_id in self._unsampled:
+            return
+        span = {"ts": round(time.time() - seconds, 3), "trace": trace_id, "span": name, "ms": round(seconds * 1000, 2)}
+        if attrs:
+            span["attrs"] = attrs
+        self.recent.append(span)
+        if self.path:
+            self._pending.put(span)
+
+    @contextmanager
+    def span(self, name: str, trace_id=None, **attrs):
+        """Times the block; the yielded dict collects attributes known only inside it (rows, tokens...)."""
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = str(e)[:200]
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, trace_id, **attrs)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            while not self._pending.empty() and len(batch) < 500:
+                batch.append(self._pending.get())
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_file_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(span, default=str) + "\n" for span in batch))
+            except OSError as e:
+                print(f"Could not write trace spans: {e}")
+
+    def spans(self):
+        return list(self.recent)
+
+
+def stage_percentiles(spans) -> list:
+    """Rows of {stage, count, p50_ms, p95_ms, p99_ms, max_ms} over the given spans."""
+    by_stage = defaultdict(list)
+    for span in spans:
+        by_stage[span["span"]].append(span["ms"])
+    rows = []
+    for stage, values in sorted(by_stage.items()):
+        arr = np.asarray(values)
+        rows.append({"stage": stage, "count": len(arr), "p50_ms": round(float(np.percentile(arr, 50)), 1),
+                     "p95_ms": round(float(np.percentile(arr, 95)), 1), "p99_ms": round(float(np.percentile(arr, 99)), 1), "max_ms": round(float(arr.max()), 1)})
+    return rows
+
+
+def recent_requests(spans, limit: int = 20) -> list:
+    """One row per trace, newest first: the request span's attributes plus the time spent in each stage."""
+    traces = {}
+    for span in spans:
+        if span["trace"] is None:
+            continue
+        row = traces.setdefault(span["trace"], {"trace": span["trace"], "ts": span["ts"]})
+        row["ts"] = min(row["ts"], span["ts"])
+        if span["span"] == "request":
+            row.update(span.get("attrs", {}))
+            row["total_ms"] = span["ms"]
+        else:
+            row[f"{span['span']}_ms"] = round(row.get(f"{span['span']}_ms", 0) + span["ms"], 1)
+    rows = sorted(traces.values(), key=lambda r: r["ts"], reverse=True)[:limit]
+    for row in rows:
+        row["time"] = time.strftime("%H:%M:%S", time.localtime(row.pop("ts")))
+    return rows
+
+
+def slowest_spans(spans, name: str, limit: int = 10) -> list:
+    return [dict(span.get("attrs", {}), ms=span["ms"], trace=span["trace"], time=time.strftime("%H:%M:%S", time.localtime(span["ts"])))
+            for span in sorted((s for s in spans if s["span"] == name), key=lambda s: s["ms"], reverse=True)[:limit]]
+
+
+def read_spans(path: str = DEFAULT_TRACE_PATH, since: float = 0.0):
+    """Spans from a JSON lines log (including its rotated predecessor), e.g. to merge several app processes."""
+    spans = []
+    for candidate in (f"{path}.1", path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if span["ts"] >= since:
+                    spans.append(span)
+    return spans
+
+
+if __name__ == "__main__":
+    # `python tracing.py [spans.jsonl] [hours]`: per-stage percentiles from the log.
+    log_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRACE_PATH
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24
+    for stats in stage_percentiles(read_spans(log_path, since=time.time() - hours * 3600)):
+        print(f"{stats['stage']:<18}{stats['count']:>7}  p50 {stats['p50_ms']:>9.1f}  p95 {stats['p95_ms']:>9.1f}  p99 {stats['p99_ms']:>9.1f}  max {stats['max_ms']:>9.1f} ms")